@@ -2,24 +2,29 @@ from NEMO.models import User
 
 
 def lock_selected_interlocks(model_admin, request, queryset):
-	for interlock in queryset:
-		interlock.lock()
+	from NEMO import interlocks
+	interlocks.bulk_lock(queryset.select_related('card__category'))
 
 
 def unlock_selected_interlocks(model_admin, request, queryset):
-	for interlock in queryset:
-		interlock.unlock()
+	from NEMO import interlocks
+	interlocks.bulk_unlock(queryset.select_related('card__category'))
 
 
 def synchronize_with_tool_usage(model_admin, request, queryset):
-	for interlock in queryset:
+	from NEMO import interlocks
+	interlocks_to_unlock = []
+	interlocks_to_lock = []
+	for interlock in queryset.select_related('card__category'):
 		# Ignore interlocks with no tool assigned, and ignore interlocks connected to doors
 		if not interlock.tool or interlock.door:
 			continue
 		if interlock.tool.in_use():
-			interlock.unlock()
+			interlocks_to_unlock.append(interlock)
 		else:
-			interlock.lock()
+			interlocks_to_lock.append(interlock)
+	interlocks.bulk_unlock(interlocks_to_unlock)
+	interlocks.bulk_lock(interlocks_to_lock)
 
 def duplicate_tool_configuration(model_admin, request, queryset):
 	for tool in queryset:
@@ -0,0 +1,268 @@
+from collections import deque
+from datetime import datetime, timedelta
+from logging import getLogger
+from queue import Queue
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from NEMO.models import Door, TimedServiceRun
+
+door_scheduler_logger = getLogger(__name__)
+
+
+def get_unlock_duration() -> float:
+	""" Number of seconds a door stays unlocked after a badge swipe. """
+	return getattr(settings, 'DOOR_UNLOCK_DURATION', 8)
+
+
+def get_worker_count() -> int:
+	""" Number of threads sending the door commands in each process. """
+	return getattr(settings, 'DOOR_SCHEDULER_WORKERS', 4)
+
+
+class TimerWheel:
+	"""
+	Hashed timer wheel: deadlines are kept in slots of "tick" seconds, so scheduling, rescheduling and expiring a key
+	are constant time. Each tick only looks at one slot. A deadline more than a full turn away stays in its slot until its turn comes.
+	"""
+
+	def __init__(self, tick: float, slot_count: int = 64, now: float = None):
+		self.tick = tick
+		self.slots: List[Dict[Hashable, int]] = [{} for i in range(slot_count)]
+		self.positions: Dict[Hashable, int] = {}
+		self.lock = Lock()
+		self.next_tick = self.tick_of(monotonic() if now is None else now)
+
+	def tick_of(self, time: float) -> int:
+		return int(time / self.tick)
+
+	def schedule(self, key: Hashable, deadline: float):
+		""" Schedules the key to expire at the deadline (a monotonic time), replacing its previous deadline. """
+		with self.lock:
+			self.remove(key)
+			# Keys expire once the tick of their deadline is over, or with the next tick if the deadline already passed
+			deadline_tick = max(self.tick_of(deadline) + 1, self.next_tick)
+			slot = deadline_tick % len(self.slots)
+			self.slots[slot][key] = deadline_tick
+			self.positions[key] = slot
+
+	def remove(self, key: Hashable):
+		slot = self.positions.pop(key, None)
+		if slot is not None:
+			del self.slots[slot][key]
+
+	def expire(self, now: float) -> List[Hashable]:
+		""" Returns the keys whose deadline passed, going through the slots of all the ticks elapsed since the last call. """
+		expired = []
+		with self.lock:
+			now_tick = self.tick_of(now)
+			while self.next_tick <= now_tick:
+				slot = self.slots[self.next_tick % len(self.slots)]
+				for key, deadline_tick in list(slot.items()):
+					if deadline_tick <= self.next_tick:
+						expired.append(key)
+						del slot[key]
+						del self.positions[key]
+				self.next_tick += 1
+		return expired
+
+	def __len__(self):
+		return len(self.positions)
+
+
+class DoorScheduler:
+	"""
+	Unlocks doors and locks them again DOOR_UNLOCK_DURATION seconds later.
+	Each door has its own queue of commands, sent in order by a pool of DOOR_SCHEDULER_WORKERS threads that only takes one
+	command of a door at a time, so an unreachable door only holds up one thread and delays its own commands.
+	The relock deadlines are kept in a timer wheel checked by a single timer thread.
+	Unlocking a door that was unlocked successfully only pushes back its relock, and a door that failed to unlock
+	is unlocked again by the next badge swipe.
+	The deadlines are also saved on the doors, so the doors left unlocked when the server stopped are locked again
+	by "recover", and a relock is postponed when another process unlocked the same door again in the meantime.
+	The clocks can be replaced: "clock" returns a monotonic time in seconds and "now" the current date and time.
+	"""
+
+	def __init__(self, tick: float = 0.25, clock: Callable[[], float] = monotonic, now: Callable[[], datetime] = timezone.now, worker_count: int = None):
+		self.tick = tick
+		self.clock = clock
+		self.now = now
+		self.started = now()
+		self.worker_count = worker_count
+		self.wheel = TimerWheel(tick, now=clock())
+		self.lock = Lock()
+		# Relock deadline (monotonic time) of the doors this scheduler unlocked successfully, by door id
+		self.unlocked: Dict[int, float] = {}
+		self.stopped = Event()
+		# The commands waiting for each door. A door is in the ready queue while it has commands and none is being sent.
+		self.commands: Dict[int, Deque[Tuple[Callable, tuple]]] = {}
+		self.ready: Queue = Queue()
+		# Number of commands queued or being sent, signalled when it drops to 0
+		self.pending = 0
+		self.idle = Condition(self.lock)
+		# Started with the first command
+		self.threads: List[Thread] = []
+		self.timer = Thread(target=self.run_timer, daemon=True, name='door_timer')
+		self.timer.start()
+
+	def unlock(self, door_id: int):
+		""" Unlocks the door, and locks it again after DOOR_UNLOCK_DURATION seconds. Returns immediately. """
+		duration = get_unlock_duration()
+		deadline = self.clock() + duration
+		# The relock is scheduled even when the unlock fails, the state of the door is unknown then
+		self.wheel.schedule(door_id, deadline)
+		with self.lock:
+			already_unlocked = door_id in self.unlocked
+			if already_unlocked:
+				self.unlocked[door_id] = deadline
+		if already_unlocked:
+			self.submit(door_id, self.save_relock_deadline, duration)
+		else:
+			self.submit(door_id, self.unlock_door, duration, deadline)
+
+	def submit(self, door_id: int, job: Callable, *arguments):
+		with self.lock:
+			if not self.threads:
+				for i in range(self.worker_count or get_worker_count()):
+					thread = Thread(target=self.work, daemon=True, name=f'door_worker_{i}')
+					self.threads.append(thread)
+					thread.start()
+			self.pending += 1
+			commands = self.commands.get(door_id)
+			if commands is None:
+				# No command of the door is queued or being sent
+				self.commands[door_id] = deque([(job, arguments)])
+				self.ready.put(door_id)
+			else:
+				commands.append((job, arguments))
+
+	def work(self):
+		while True:
+			door_id = self.ready.get()
+			if door_id is None:
+				return
+			with self.lock:
+				job, arguments = self.commands[door_id].popleft()
+			try:
+				job(door_id, *arguments)
+			except Exception:
+				door_scheduler_logger.exception(f"The command for door {door_id} failed")
+			finally:
+				# Don't hold a database connection while waiting for the next command
+				connection.close()
+				with self.lock:
+					if self.commands[door_id]:
+						# The next command of the door goes behind the commands of the other doors
+						self.ready.put(door_id)
+					else:
+						del self.commands[door_id]
+					self.pending -= 1
+					if not self.pending:
+						self.idle.notify_all()
+
+	def run_timer(self):
+		while not self.stopped.wait(self.tick):
+			self.relock_due_doors()
+
+	def relock_due_doors(self):
+		for door_id in self.wheel.expire(self.clock()):
+			self.submit(door_id, self.relock_door)
+
+	def unlock_door(self, door_id: int, duration: float, deadline: float):
+		# The deadline is saved first, so the door is locked again even if the server stops right after unlocking it
+		self.save_relock_deadline(door_id, duration)
+		if Door.objects.select_related('interlock__card__category').get(id=door_id).interlock.unlock():
+			with self.lock:
+				# From now on badge swipes only push back the relock, until the door is locked again
+				self.unlocked[door_id] = max(deadline, self.unlocked.get(door_id, deadline))
+
+	def save_relock_deadline(self, door_id: int, duration: float):
+		Door.objects.filter(id=door_id).update(relock_deadline=self.now() + timedelta(seconds=duration))
+
+	def relock_door(self, door_id: int):
+		with self.lock:
+			if self.unlocked.get(door_id, 0) > self.clock():
+				# Unlocked again since the relock was due, the wheel already has the new deadline
+				return
+			# Badge swipes from now on unlock the door again, after it is locked
+			self.unlocked.pop(door_id, None)
+		door = Door.objects.select_related('interlock__card__category').get(id=door_id)
+		remaining = (door.relock_deadline - self.now()).total_seconds() if door.relock_deadline else 0
+		if remaining > 0:
+			# Another process unlocked the door again
+			self.schedule_relock(door_id, remaining)
+			return
+		door.interlock.lock()
+		Door.objects.filter(id=door_id, relock_deadline=door.relock_deadline).update(relock_deadline=None)
+
+	def schedule_relock(self, door_id: int, remaining: float):
+		deadline = self.clock() + max(remaining, 0)
+		with self.lock:
+			self.unlocked[door_id] = deadline
+		self.wheel.schedule(door_id, deadline)
+
+	def recover(self):
+		""" Schedules the relock of the doors that were still unlocked when the server stopped. """
+		now = self.now()
+		for door_id, relock_deadline in Door.objects.filter(relock_deadline__isnull=False).values_list('id', 'relock_deadline'):
+			door_scheduler_logger.info(f"Door {door_id} was left unlocked, it will be locked again")
+			self.schedule_relock(door_id, (relock_deadline - now).total_seconds())
+
+	def pending_relocks(self) -> int:
+		return len(self.wheel)
+
+	def join(self):
+		""" Waits until the commands already queued are sent. """
+		with self.idle:
+			self.idle.wait_for(lambda: not self.pending)
+
+	def stop(self):
+		""" Stops the threads once the commands already queued are sent. Relocks not due yet are left to "recover". """
+		self.stopped.set()
+		self.timer.join()
+		self.join()
+		with self.lock:
+			threads = list(self.threads)
+		for thread in threads:
+			self.ready.put(None)
+		for thread in threads:
+			thread.join()
+
+
+door_recovery_service_name = 'door_recovery'
+
+
+def recover_doors_left_unlocked(scheduler: DoorScheduler):
+	"""
+	Schedules the relock of the doors left unlocked when the server stopped, once for all the processes started with the server:
+	the first process to lock the run recovers the doors, the processes started before it did skip the recovery.
+	"""
+	with transaction.atomic():
+		service_run = TimedServiceRun.lock(door_recovery_service_name)
+		if service_run.last_run and service_run.last_run >= scheduler.started:
+			return
+		scheduler.recover()
+		service_run.last_run = scheduler.now()
+		service_run.save()
+
+
+door_scheduler: Optional[DoorScheduler] = None
+door_scheduler_lock = Lock()
+
+
+def get_door_scheduler() -> DoorScheduler:
+	""" Returns the door scheduler of this process, starting it and recovering the pending relocks the first time. """
+	global door_scheduler
+	with door_scheduler_lock:
+		if door_scheduler is None:
+			door_scheduler = DoorScheduler()
+			try:
+				recover_doors_left_unlocked(door_scheduler)
+			except DatabaseError:
+				door_scheduler_logger.exception("The doors left unlocked could not be recovered")
+		return door_scheduler
@@ -1,18 +1,16 @@
-from time import sleep
-
 from django.contrib.auth.decorators import login_required, permission_required
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
 from django.views.decorators.http import require_GET, require_POST
 
+from NEMO.apps.area_access.door_scheduler import get_door_scheduler
 from NEMO.decorators import disable_session_expiry_refresh
 from NEMO.exceptions import InactiveUserError, NoActiveProjectsForUserError, PhysicalAccessExpiredUserError, \
 	NoPhysicalAccessUserError, NoAccessiblePhysicalAccessUserError, UnavailableResourcesUserError, \
 	MaximumCapacityReachedError
-from NEMO.models import AreaAccessRecord, Door, PhysicalAccessLog, PhysicalAccessType, Project, User, UsageEvent, Area
-from NEMO.tasks import postpone
-from NEMO.views.policy import check_policy_to_enter_this_area, check_policy_to_enter_any_area
+from NEMO.models import AreaAccessRecord, Door, PhysicalAccessLog, PhysicalAccessType, Project, User, UsageEvent, Area, get_area_occupancy
+from NEMO.views.policy import check_policy_to_enter_this_area, check_policy_to_enter_any_area, get_area_access_profile
 
 
 @login_required
@@ -35,7 +33,7 @@ def farewell_screen(request, door_id):
 @permission_required('NEMO.add_areaaccessrecord')
 @require_POST
 def login_to_area(request, door_id):
-	door = get_object_or_404(Door, id=door_id)
+	door = get_object_or_404(Door.objects.select_related('area'), id=door_id)
 
 	badge_number = request.POST.get('badge_number', '')
 	if badge_number == '':
@@ -99,7 +97,7 @@ def login_to_area(request, door_id):
 		max_capacity_reached = True
 
 	current_area_access_record = user.area_access_record()
-	if current_area_access_record and current_area_access_record.area == door.area:
+	if current_area_access_record and current_area_access_record.area_id == door.area_id:
 		# No log entry necessary here because all validation checks passed.
 		# The log entry is captured when the subsequent choice is made by the user.
 		return render(request, 'area_access/already_logged_in.html', {'area': door.area, 'project': current_area_access_record.project, 'badge_number': user.badge_number})
@@ -111,9 +109,10 @@ def login_to_area(request, door_id):
 		return render(request, 'area_access/physical_access_denied.html', {'message': message})
 
 	previous_area = None
-	if user.active_project_count() >= 1:
-		if user.active_project_count() == 1:
-			project = user.active_projects()[0]
+	active_projects = get_area_access_profile(user).active_projects
+	if len(active_projects) >= 1:
+		if len(active_projects) == 1:
+			project = active_projects[0]
 		else:
 			project_id = request.POST.get('project_id')
 			if not project_id:
@@ -122,7 +121,7 @@ def login_to_area(request, door_id):
 				return render(request, 'area_access/choose_project.html', {'area': door.area, 'user': user})
 			else:
 				project = get_object_or_404(Project, id=project_id)
-				if project not in user.active_projects():
+				if project not in active_projects:
 					log.details = "The user attempted to bill the project named {}, but they are not a member of that project.".format(
 						project.name)
 					log.save()
@@ -133,11 +132,10 @@ def login_to_area(request, door_id):
 		log.save()
 
 		# Automatically log the user out of any previous area before logging them in to the new area.
-		if user.in_area():
-			previous_area_access_record = user.area_access_record()
-			previous_area_access_record.end = timezone.now()
-			previous_area_access_record.save()
-			previous_area = previous_area_access_record.area
+		if current_area_access_record:
+			current_area_access_record.end = timezone.now()
+			current_area_access_record.save()
+			previous_area = current_area_access_record.area
 
 		record = AreaAccessRecord()
 		record.area = door.area
@@ -148,12 +146,8 @@ def login_to_area(request, door_id):
 		return render(request, 'area_access/login_success.html', {'area': door.area, 'name': user.first_name, 'project': record.project, 'previous_area': previous_area})
 
 
-@postpone
 def unlock_door(door_id):
-	door = Door.objects.get(id=door_id)
-	door.interlock.unlock()
-	sleep(8)
-	door.interlock.lock()
+	get_door_scheduler().unlock(door_id)
 
 
 @login_required
@@ -190,7 +184,7 @@ def open_door(request, door_id):
 		user = User.objects.get(badge_number=badge_number)
 	except (User.DoesNotExist, ValueError):
 		return render(request, 'area_access/badge_not_found.html')
-	if user.area_access_record() and user.area_access_record().area == door.area:
+	if get_area_occupancy().get_area_id(user.id) == door.area_id:
 		log = PhysicalAccessLog(user=user, door=door, time=timezone.now(), result=PhysicalAccessType.ALLOW, details="The user was permitted to enter this area, and already had an active area access record for this area.")
 		log.save()
 		unlock_door(door.id)
@@ -211,6 +205,6 @@ def area_access_occupancy(request):
 		return HttpResponse()
 	dictionary = {
 		'area': area,
-		'occupants': AreaAccessRecord.objects.filter(area__name=area.name, end=None, staff_charge=None).prefetch_related('customer'),
+		'occupants': AreaAccessRecord.objects.filter(area=area, end=None, staff_charge=None).prefetch_related('customer') if get_area_occupancy().get_count(area.id) else AreaAccessRecord.objects.none(),
 	}
 	return render(request, 'area_access/occupancy.html', dictionary)
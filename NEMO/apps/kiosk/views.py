@@ -11,13 +11,13 @@ from django.utils.dateparse import parse_date, parse_time
 from django.views.decorators.http import require_GET, require_POST
 
 from NEMO.decorators import disable_session_expiry_refresh
-from NEMO.models import Project, Reservation, Tool, UsageEvent, User, Area, AreaAccessRecord
+from NEMO.models import Project, Reservation, Tool, UsageEvent, User, Area, AreaAccessRecord, get_area_occupancy
 from NEMO.utilities import quiet_int, localize
 from NEMO.views.calendar import determine_insufficient_notice, extract_configuration, cancel_the_reservation
 from NEMO.views.policy import check_policy_to_disable_tool, check_policy_to_enable_tool, \
 	check_policy_to_save_reservation
 from NEMO.views.status_dashboard import create_tool_summary
-from NEMO.widgets.dynamic_form import DynamicForm
+from NEMO.widgets.dynamic_form import get_dynamic_form
 
 
 @login_required
@@ -93,7 +93,7 @@ def disable_tool(request):
 	current_usage_event.end = timezone.now() + downtime
 
 	# Collect post-usage questions
-	current_usage_event.run_data = DynamicForm(tool.post_usage_questions).extract(request)
+	current_usage_event.run_data = get_dynamic_form(tool.post_usage_questions).extract(request)
 	current_usage_event.save()
 
 	dictionary = {
@@ -249,7 +249,7 @@ def tool_information(request, tool_id, user_id, back):
 		'customer': customer,
 		'tool': tool,
 		'rendered_configuration_html': tool.configuration_widget(customer),
-		'post_usage_questions': DynamicForm(tool.post_usage_questions).render(),
+		'post_usage_questions': get_dynamic_form(tool.post_usage_questions).render(),
 		'back': back,
 	}
 	try:
@@ -294,6 +294,6 @@ def kiosk_occupancy(request):
 		return HttpResponse()
 	dictionary = {
 		'area': area,
-		'occupants': AreaAccessRecord.objects.filter(area__name=area.name, end=None, staff_charge=None).prefetch_related('customer'),
+		'occupants': AreaAccessRecord.objects.filter(area=area, end=None, staff_charge=None).prefetch_related('customer') if get_area_occupancy().get_count(area.id) else AreaAccessRecord.objects.none(),
 	}
 	return render(request, 'kiosk/occupancy.html', dictionary)
@@ -0,0 +1,101 @@
+from itertools import islice
+from logging import getLogger
+from smtplib import SMTPException
+from time import monotonic, sleep
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from NEMO.tasks import executor
+
+email_delivery_logger = getLogger(__name__)
+
+
+def get_batch_size() -> int:
+	""" Number of messages sent with each call to the email backend. """
+	return getattr(settings, 'EMAIL_BATCH_SIZE', 50)
+
+
+def get_rate_limit() -> float:
+	""" Maximum number of messages sent per second, to stay within the limits of the mail relay. 0 means no limit. """
+	return getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+
+
+class DeliveryReport:
+	""" Progress of a delivery: the number of messages sent and failed, and each failed message with its error. """
+
+	def __init__(self, description: str):
+		self.description = description
+		self.batches = 0
+		self.sent = 0
+		self.failed = 0
+		self.errors: List[Tuple[EmailMessage, str]] = []
+
+	def __str__(self):
+		return f"{self.description}: {self.sent} sent, {self.failed} failed in {self.batches} batches"
+
+
+def deliver(messages: Iterable[EmailMessage], description: str = "Email delivery", batch_size: int = None, rate_limit: float = None, connection=None, progress: Callable[[DeliveryReport], None] = None) -> DeliveryReport:
+	"""
+	Sends the messages over one connection to the email backend, a batch at a time.
+	The messages are only built when their batch is sent, so they can be given by a generator.
+	A message that fails doesn't stop the delivery: its recipients are reported and the connection is opened again for the next message.
+	The progress callback is called with the report after each batch.
+	"""
+	batch_size = batch_size or get_batch_size()
+	rate_limit = get_rate_limit() if rate_limit is None else rate_limit
+	connection = connection or get_connection()
+	report = DeliveryReport(description)
+	messages = iter(messages)
+	start = monotonic()
+	try:
+		while True:
+			batch = list(islice(messages, batch_size))
+			if not batch:
+				break
+			if rate_limit:
+				# Wait until sending this batch keeps the average rate under the limit
+				wait = (report.sent + report.failed) / rate_limit - (monotonic() - start)
+				if wait > 0:
+					sleep(wait)
+			report.batches += 1
+			for message in batch:
+				try:
+					# Opened here rather than by send_messages, which would close it again after the message. Does nothing when it is already open.
+					connection.open()
+					report.sent += connection.send_messages([message]) or 0
+				except (SMTPException, OSError) as error:
+					report.failed += 1
+					report.errors.append((message, str(error)))
+					email_delivery_logger.error(f"{description}: the message to {', '.join(message.recipients())} was not sent: {error}")
+					# The error may have broken the connection, so it is opened again for the next message
+					close(connection)
+			if progress:
+				progress(report)
+	finally:
+		close(connection)
+	email_delivery_logger.info(str(report))
+	return report
+
+
+def close(connection):
+	try:
+		connection.close()
+	except (SMTPException, OSError):
+		pass
+
+
+def deliver_in_background(messages: Iterable[EmailMessage], description: str = "Email delivery", on_complete: Optional[Callable[[DeliveryReport], None]] = None):
+	"""
+	Delivers the messages with the postponed tasks executor, so the request doesn't wait for the mail server.
+	The on_complete callback is called with the report once every message was tried.
+	"""
+
+	def deliver_and_report():
+		report = deliver(messages, description)
+		if on_complete:
+			on_complete(report)
+
+	# A delivery that failed is not retried as a whole, the messages already sent would be sent again
+	executor.submit(deliver_and_report, retries=0)
@@ -1,13 +1,20 @@
 import socket
 import struct
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import partial
+from itertools import count
 from logging import getLogger
-from typing import Dict
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import perf_counter
+from typing import Dict, List, Iterable, Set, Tuple
 from xml.etree import ElementTree
 
 import requests
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import connection as db_connection
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -43,43 +50,10 @@ class Interlock(ABC):
 		return self.__issue_command(interlock, Interlock_model.State.UNLOCKED)
 
 	def __issue_command(self, interlock: Interlock_model, command_type: Interlock_model.State):
-		interlocks_enabled = getattr(settings, 'INTERLOCKS_ENABLED', False)
-		if not interlocks_enabled or not interlock.card.enabled:
-			interlock.most_recent_reply = "Interlock interface mocked out because settings.INTERLOCKS_ENABLED = False or interlock card is disabled. Interlock last set on " + format_datetime(timezone.now()) + "."
-			interlock.state = command_type
-			interlock.save()
-			return True
-
-		state = Interlock_model.State.UNKNOWN
-		error_message = ''
-		# try to send the command to the interlock
-		try:
-			state = self._send_command(interlock, command_type)
-		except InterlockError as error:
-			interlocks_logger.error(error)
-			error_message = error.message
-		except Exception as error:
-			interlocks_logger.error(error)
-			error_message = str(error)
-
-		# save interlock state
-		interlock.state = state
-		interlock.most_recent_reply = Interlock.__create_reply_message(command_type, state, error_message)
-		interlock.save()
-
-		# log some useful information
-		if interlock.state == interlock.State.UNKNOWN:
-			interlocks_logger.error(f"Interlock {interlock.id} is in an unknown state. {interlock.most_recent_reply}")
-		elif interlock.state == interlock.State.LOCKED:
-			interlocks_logger.debug(f"Interlock {interlock.id} locked successfully at {format_datetime(timezone.now())}")
-		elif interlock.state == interlock.State.UNLOCKED:
-			interlocks_logger.debug(f"Interlock {interlock.id} unlocked successfully at {format_datetime(timezone.now())}")
-
-		# If the command type equals the current state then the command worked which will return true:
-		return interlock.state == command_type
+		return issue_commands([interlock], command_type, implementation=self)[interlock.id]
 
 	@staticmethod
-	def __create_reply_message(command_type: Interlock_model.State, actual_state: Interlock_model.State, error_message: str) -> str:
+	def _create_reply_message(command_type: Interlock_model.State, actual_state: Interlock_model.State, error_message: str) -> str:
 		# Compose the status message of the last command.
 		reply_message = f"Reply received at {format_datetime(timezone.now())}. "
 		if command_type == Interlock_model.State.UNLOCKED:
@@ -105,7 +79,59 @@ class NoOpInterlock(Interlock):
 	def _send_command(self, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
 		pass
 
-class StanfordInterlock(Interlock):
+
+class ConnectedInterlock(Interlock):
+	"""
+	Interlocks talking to their card over a connection (socket, HTTP session...) that can be kept open between commands.
+	The dispatcher opens one connection per card with "_open_connection" and sends all the commands for that card over it
+	with "_send_command_on_connection". Without the dispatcher, "_send_command" opens a connection for a single command.
+
+	Cards able to set several relays in one exchange set "supports_batch_commands" and implement "_send_commands_on_connection".
+	"""
+	supports_batch_commands = False
+	# Seconds the connection to the card may take to open, and each exchange on it to be answered
+	timeout = 10.0
+
+	def _send_command(self, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
+		connection = self._open_connection(interlock)
+		try:
+			return self._send_command_on_connection(connection, interlock, command_type)
+		finally:
+			self._close_connection(connection)
+
+	@abstractmethod
+	def _open_connection(self, interlock: Interlock_model, timeout: float = None):
+		""" Opens the connection to the card, within the given timeout when it is shorter than the timeout of the card. """
+		pass
+
+	def _get_timeout(self, timeout: float = None) -> float:
+		return self.timeout if timeout is None else min(self.timeout, timeout)
+
+	def _set_connection_timeout(self, connection, timeout: float):
+		"""
+		Shortens the time the next exchange on the connection may take, so it ends before the request gives up.
+		Connections without a timeout of their own, like HTTP sessions, keep the timeout of the card.
+		"""
+		if hasattr(connection, 'settimeout'):
+			connection.settimeout(self._get_timeout(timeout))
+
+	def _close_connection(self, connection):
+		connection.close()
+
+	@abstractmethod
+	def _send_command_on_connection(self, connection, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
+		pass
+
+	def _send_commands_on_connection(self, connection, interlocks: List[Interlock_model], command_type: Interlock_model.State) -> Dict[int, Interlock_model.State]:
+		"""
+		Sends the same command to several interlocks of the card. Returns the resulting state of each interlock, keyed by id.
+		Sends one command per interlock by default, cards able to set several relays in one exchange override it.
+		"""
+		return {interlock.id: self._send_command_on_connection(connection, interlock, command_type) for interlock in interlocks}
+
+
+class StanfordInterlock(ConnectedInterlock):
+	timeout = 3.0
 
 	def clean_interlock_card(self, interlock_card_form: InterlockCardAdminForm):
 		even_port = interlock_card_form.cleaned_data['even_port']
@@ -129,7 +155,19 @@ class StanfordInterlock(Interlock):
 		if error:
 			raise ValidationError(error)
 
-	def _send_command(self, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
+	def _open_connection(self, interlock: Interlock_model, timeout: float = None):
+		# Create a TCP socket to send the interlock commands.
+		sock = socket.socket()
+		try:
+			sock.settimeout(self._get_timeout(timeout))  # Set the send/receive timeout to be 3 seconds, or less when the request gives up sooner.
+			server_address = (interlock.card.server, interlock.card.port)
+			sock.connect(server_address)
+		except OSError as error:
+			sock.close()
+			raise InterlockError(interlock=interlock, msg=StanfordInterlock._socket_error_message(error))
+		return sock
+
+	def _send_command_on_connection(self, sock, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
 		# The string in this next function call identifies the format of the interlock message.
 		# '!' means use network byte order (big endian) for the contents of the message.
 		# '20s' means that the message begins with a 20 character string.
@@ -158,12 +196,7 @@ class StanfordInterlock(Interlock):
 			b'EQCNTL_END_COMMAND'
 		)
 
-		# Create a TCP socket to send the interlock command.
-		sock = socket.socket()
 		try:
-			sock.settimeout(3.0)  # Set the send/receive timeout to be 3 seconds.
-			server_address = (interlock.card.server, interlock.card.port)
-			sock.connect(server_address)
 			sock.send(command_message)
 			# The reply schema is the same as the command schema except there are no start and end strings.
 			reply_schema = struct.Struct('!iiiiiiiiibbbbb')
@@ -195,11 +228,7 @@ class StanfordInterlock(Interlock):
 
 		# Log any errors that occurred during the operation into the database.
 		except OSError as error:
-			reply_message = "Socket error"
-			if error.errno:
-				reply_message += " " + str(error.errno)
-			reply_message += ": " + str(error)
-			raise InterlockError(interlock=interlock, msg=reply_message)
+			raise InterlockError(interlock=interlock, msg=StanfordInterlock._socket_error_message(error))
 		except struct.error as error:
 			reply_message = "Response format error: " + str(error)
 			raise InterlockError(interlock=interlock, msg=reply_message)
@@ -208,11 +237,16 @@ class StanfordInterlock(Interlock):
 		except Exception as error:
 			reply_message = "General exception: " + str(error)
 			raise InterlockError(interlock=interlock, msg=reply_message)
-		finally:
-			sock.close()
+
+	@staticmethod
+	def _socket_error_message(error: OSError) -> str:
+		reply_message = "Socket error"
+		if error.errno:
+			reply_message += " " + str(error.errno)
+		return reply_message + ": " + str(error)
 
 
-class ProXrInterlock(Interlock):
+class ProXrInterlock(ConnectedInterlock):
 	"""
 	Support for ProXR relay controllers.
 	See https://ncd.io/proxr-quick-start-guide/ for more about ProXR.
@@ -220,6 +254,7 @@ class ProXrInterlock(Interlock):
 	# proxr relay status
 	PXR_RELAY_OFF = 0
 	PXR_RELAY_ON = 1
+	supports_batch_commands = True
 
 	def clean_interlock(self, interlock_form: InterlockAdminForm):
 		"""Validates NEMO interlock configuration."""
@@ -258,27 +293,56 @@ class ProXrInterlock(Interlock):
 		else:
 			return Interlock_model.State.UNKNOWN
 
-	def _send_command(self, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
+	def _open_connection(self, interlock: Interlock_model, timeout: float = None):
+		"""Returns a socket connected to the relay controller."""
+		try:
+			return socket.create_connection((interlock.card.server, interlock.card.port), self._get_timeout(timeout))
+		except Exception as error:
+			raise InterlockError(interlock=interlock, msg="Communication error: " + str(error))
+
+	def _send_command_on_connection(self, relay_socket, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
 		"""Returns and sets NEMO locked/unlocked state."""
 		state = Interlock_model.State.UNKNOWN
 		try:
-			with socket.create_connection((interlock.card.server, interlock.card.port), 10) as relay_socket:
+			if command_type == Interlock_model.State.LOCKED:
+				# turn the interlock channel off
+				self._send_bytes(relay_socket, (254, 99 + interlock.channel, 1))
+				state = self._get_state(relay_socket, interlock.channel)
+			elif command_type == Interlock_model.State.UNLOCKED:
+				# turn the interlock channel on
+				self._send_bytes(relay_socket, (254, 107 + interlock.channel, 1))
+				state = self._get_state(relay_socket, interlock.channel)
+		except Exception as error:
+			raise InterlockError(interlock=interlock, msg="Communication error: " + str(error))
+		return state
+
+	def _send_commands_on_connection(self, relay_socket, interlocks: List[Interlock_model], command_type: Interlock_model.State) -> Dict[int, Interlock_model.State]:
+		"""
+		Switches each relay, then reads the status of the whole relay bank once to get all the resulting states.
+		The bank status is not written directly, so that relays switched at the same time by someone else are left alone.
+		"""
+		try:
+			for interlock in interlocks:
 				if command_type == Interlock_model.State.LOCKED:
-					# turn the interlock channel off
 					self._send_bytes(relay_socket, (254, 99 + interlock.channel, 1))
-					state = self._get_state(relay_socket, interlock.channel)
 				elif command_type == Interlock_model.State.UNLOCKED:
-					# turn the interlock channel on
 					self._send_bytes(relay_socket, (254, 107 + interlock.channel, 1))
-					state = self._get_state(relay_socket, interlock.channel)
+			bank_status = self._send_bytes(relay_socket, (254, 124, 1))
 		except Exception as error:
-			raise InterlockError(interlock=interlock, msg="Communication error: " + str(error))
-		return state
+			raise InterlockError(interlock=interlocks[0], msg="Communication error: " + str(error))
+		states = {}
+		for interlock in interlocks:
+			relay_on = bank_status & (1 << (interlock.channel - 1))
+			states[interlock.id] = Interlock_model.State.UNLOCKED if relay_on else Interlock_model.State.LOCKED
+		return states
 
 
-class WebRelayHttpInterlock(Interlock):
+class WebRelayHttpInterlock(ConnectedInterlock):
 	WEB_RELAY_OFF = 0
 	WEB_RELAY_ON = 1
+	# connect and read timeout in seconds
+	timeout = 10
+	supports_batch_commands = True
 
 	def clean_interlock_card(self, interlock_card_form: InterlockCardAdminForm):
 		username = interlock_card_form.cleaned_data['username']
@@ -289,35 +353,413 @@ class WebRelayHttpInterlock(Interlock):
 		if error:
 			raise ValidationError(error)
 
-	def _send_command(self, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
+	def _open_connection(self, interlock: Interlock_model, timeout: float = None):
+		# The session keeps the HTTP connection to the card alive between commands
+		return requests.Session()
+
+	def _send_command_on_connection(self, session, interlock: Interlock_model, command_type: Interlock_model.State) -> Interlock_model.State:
 		state = Interlock_model.State.UNKNOWN
 		try:
 			if command_type == Interlock_model.State.LOCKED:
-				state = WebRelayHttpInterlock.setRelayState(interlock, WebRelayHttpInterlock.WEB_RELAY_OFF)
+				state = WebRelayHttpInterlock.setRelayState(interlock, WebRelayHttpInterlock.WEB_RELAY_OFF, session)
 			elif command_type == Interlock_model.State.UNLOCKED:
-				state = WebRelayHttpInterlock.setRelayState(interlock, WebRelayHttpInterlock.WEB_RELAY_ON)
+				state = WebRelayHttpInterlock.setRelayState(interlock, WebRelayHttpInterlock.WEB_RELAY_ON, session)
 		except Exception as error:
 			raise InterlockError(interlock=interlock, msg="General exception: " + str(error))
 		return state
 
+	def _send_commands_on_connection(self, session, interlocks: List[Interlock_model], command_type: Interlock_model.State) -> Dict[int, Interlock_model.State]:
+		states = {}
+		try:
+			if command_type == Interlock_model.State.LOCKED:
+				states = WebRelayHttpInterlock.setRelayStates(interlocks, WebRelayHttpInterlock.WEB_RELAY_OFF, session)
+			elif command_type == Interlock_model.State.UNLOCKED:
+				states = WebRelayHttpInterlock.setRelayStates(interlocks, WebRelayHttpInterlock.WEB_RELAY_ON, session)
+		except Exception as error:
+			raise InterlockError(interlock=interlocks[0], msg="General exception: " + str(error))
+		return states
+
 	@staticmethod
-	def setRelayState(interlock: Interlock_model, state: {0, 1}) -> Interlock_model.State:
-		url = f"{interlock.card.server}:{interlock.card.port}/stateFull.xml?relay{interlock.channel}State={state}"
+	def setRelayState(interlock: Interlock_model, state: {0, 1}, session: requests.Session = None) -> Interlock_model.State:
+		return WebRelayHttpInterlock.setRelayStates([interlock], state, session)[interlock.id]
+
+	@staticmethod
+	def setRelayStates(interlocks: List[Interlock_model], state: {0, 1}, session: requests.Session = None) -> Dict[int, Interlock_model.State]:
+		""" Sets all the relays of the same card in a single request. Returns the resulting state of each interlock, keyed by id. """
+		card = interlocks[0].card
+		relay_parameters = "&".join(f"relay{interlock.channel}State={state}" for interlock in interlocks)
+		url = f"{card.server}:{card.port}/stateFull.xml?{relay_parameters}"
 		if not url.startswith('http') and not url.startswith('https'):
 			url = 'http://' + url
 		auth = None
-		if interlock.card.username and interlock.card.password:
-			auth = (interlock.card.username, interlock.card.password)
-		response = requests.get(url, auth=auth)
+		if card.username and card.password:
+			auth = (card.username, card.password)
+		response = (session or requests).get(url, auth=auth, timeout=WebRelayHttpInterlock.timeout)
 		response.raise_for_status()
 		responseXML = ElementTree.fromstring(response.content)
-		state = int(responseXML.find(f"relay{interlock.channel}state").text)
-		if state == WebRelayHttpInterlock.WEB_RELAY_OFF:
-			return Interlock_model.State.LOCKED
-		elif state == WebRelayHttpInterlock.WEB_RELAY_ON:
-			return Interlock_model.State.UNLOCKED
-		else:
-			raise Exception(f"Unexpected state received from interlock: {state}")
+		states = {}
+		for interlock in interlocks:
+			relay_state = int(responseXML.find(f"relay{interlock.channel}state").text)
+			if relay_state == WebRelayHttpInterlock.WEB_RELAY_OFF:
+				states[interlock.id] = Interlock_model.State.LOCKED
+			elif relay_state == WebRelayHttpInterlock.WEB_RELAY_ON:
+				states[interlock.id] = Interlock_model.State.UNLOCKED
+			else:
+				raise Exception(f"Unexpected state received from interlock: {relay_state}")
+		return states
+
+
+def get_command_timeout() -> float:
+	"""
+	Returns the maximum time in seconds a request waits for an interlock command to be sent and answered.
+	The connection to the card, the exchange and its retry on a new connection all end within that time.
+	The default is the longest timeout of the cards.
+	"""
+	return getattr(settings, 'INTERLOCK_COMMAND_TIMEOUT', 10)
+
+
+def get_connection_idle_timeout() -> float:
+	""" Returns the time in seconds after which an unused connection to an interlock card is closed. """
+	return getattr(settings, 'INTERLOCK_CONNECTION_IDLE_TIMEOUT', 60)
+
+
+class InterlockCardChannel:
+	"""
+	Sends the commands queued for one interlock card, one batch at a time and in order, from a dedicated thread.
+	The connection to the card is kept open between commands and closed after it has been idle for a while.
+	Only the network exchange happens in the thread, the interlock states are saved by the request waiting for the reply,
+	except for replies received after that request gave up.
+	The commands are numbered, so a late reply can tell whether a newer command for the same interlock is on its way or succeeded.
+	"""
+
+	def __init__(self, card_id: int):
+		self.card_id = card_id
+		self.commands = Queue()
+		self.commands_lock = Lock()
+		self.sequence = count()
+		# The commands queued or being sent for each interlock, and the number of the last command that succeeded
+		self.pending_commands: Dict[int, Set['InterlockCommand']] = {}
+		self.last_succeeded: Dict[int, int] = {}
+		self.connection = None
+		self.connection_key = None
+		self.statistics_lock = Lock()
+		self.commands_sent = 0
+		self.failures = 0
+		self.timeouts = 0
+		self.connections_opened = 0
+		self.exchanges = 0
+		self.total_latency = 0.0
+		self.max_latency = 0.0
+		self.last_latency = None
+		self.thread = Thread(target=self.run, name=f"interlock_card_{card_id}", daemon=True)
+		self.thread.start()
+
+	def submit(self, implementation: Interlock, interlocks: List[Interlock_model], command_type: Interlock_model.State, deadline: float) -> 'InterlockCommand':
+		""" Queues the command, to be answered before the deadline (a perf_counter time). """
+		with self.commands_lock:
+			command = InterlockCommand(next(self.sequence), [interlock.id for interlock in interlocks])
+			for interlock_id in command.interlock_ids:
+				self.pending_commands.setdefault(interlock_id, set()).add(command)
+			self.commands.put((command, implementation, interlocks, command_type, deadline))
+		command.add_done_callback(self.forget)
+		return command
+
+	def forget(self, command: 'InterlockCommand'):
+		""" Called when the command was answered, failed or was dropped. """
+		with self.commands_lock:
+			for interlock_id in command.interlock_ids:
+				self.pending_commands[interlock_id].discard(command)
+
+	def superseded(self, command: 'InterlockCommand') -> List[int]:
+		""" Returns the interlocks of the command for which a newer command is queued, being sent or succeeded. """
+		with self.commands_lock:
+			return [
+				interlock_id for interlock_id in command.interlock_ids
+				if self.last_succeeded.get(interlock_id, -1) > command.sequence or any(pending.sequence > command.sequence for pending in self.pending_commands[interlock_id])
+			]
+
+	def stop(self):
+		self.commands.put(None)
+
+	def run(self):
+		while True:
+			try:
+				command = self.commands.get(timeout=get_connection_idle_timeout())
+			except Empty:
+				self.disconnect()
+				continue
+			if command is None:
+				self.disconnect()
+				return
+			future, implementation, interlocks, command_type, deadline = command
+			# The request waiting for this command gave up before it was sent
+			if not future.set_running_or_notify_cancel():
+				continue
+			start = perf_counter()
+			try:
+				replies = self.send(implementation, interlocks, command_type, deadline)
+			except Exception as error:
+				self.record(perf_counter() - start, len(interlocks), len(interlocks))
+				future.set_exception(error)
+			else:
+				self.record(perf_counter() - start, len(interlocks), sum(1 for state, error_message in replies.values() if state != command_type))
+				with self.commands_lock:
+					for interlock_id, (state, error_message) in replies.items():
+						if state == command_type:
+							self.last_succeeded[interlock_id] = max(future.sequence, self.last_succeeded.get(interlock_id, -1))
+				future.set_result(replies)
+			finally:
+				# Late replies are saved from this thread by the future callbacks
+				db_connection.close()
+
+	def send(self, implementation: Interlock, interlocks: List[Interlock_model], command_type: Interlock_model.State, deadline: float) -> Dict[int, Tuple[Interlock_model.State, str]]:
+		""" Returns the resulting state and error message of each interlock, keyed by id. """
+		if len(interlocks) > 1 and getattr(implementation, 'supports_batch_commands', False):
+			try:
+				states = self.exchange(implementation, interlocks[0], lambda connection: implementation._send_commands_on_connection(connection, interlocks, command_type), deadline)
+				return {interlock.id: (states.get(interlock.id, Interlock_model.State.UNKNOWN), '') for interlock in interlocks}
+			except Exception as error:
+				error_message = log_interlock_error(error)
+				return {interlock.id: (Interlock_model.State.UNKNOWN, error_message) for interlock in interlocks}
+		replies = {}
+		for interlock in interlocks:
+			try:
+				if isinstance(implementation, ConnectedInterlock):
+					state = self.exchange(implementation, interlock, lambda connection: implementation._send_command_on_connection(connection, interlock, command_type), deadline)
+				else:
+					state = implementation._send_command(interlock, command_type)
+				replies[interlock.id] = (state, '')
+			except Exception as error:
+				replies[interlock.id] = (Interlock_model.State.UNKNOWN, log_interlock_error(error))
+		return replies
+
+	def exchange(self, implementation: ConnectedInterlock, interlock: Interlock_model, send, deadline: float):
+		""" Calls send with the connection to the card, opening it first if needed. The connection and the exchange end before the deadline. """
+		connection_key = (implementation, interlock.card.server, interlock.card.port)
+		if connection_key != self.connection_key:
+			self.disconnect()
+		reused = self.connection is not None
+		if not reused:
+			self.connect(implementation, interlock, connection_key, deadline)
+		try:
+			implementation._set_connection_timeout(self.connection, self.time_left(interlock, deadline))
+			return send(self.connection)
+		except Exception:
+			self.disconnect()
+			if not reused or perf_counter() >= deadline:
+				raise
+		# The card may have closed a connection we kept open, try once more with a new one.
+		# Lock and unlock commands are idempotent so sending them twice is safe.
+		self.connect(implementation, interlock, connection_key, deadline)
+		try:
+			implementation._set_connection_timeout(self.connection, self.time_left(interlock, deadline))
+			return send(self.connection)
+		except Exception:
+			self.disconnect()
+			raise
+
+	@staticmethod
+	def time_left(interlock: Interlock_model, deadline: float) -> float:
+		time_left = deadline - perf_counter()
+		if time_left <= 0:
+			raise InterlockError(interlock=interlock, msg="The command could not be sent before the request gave up.")
+		return time_left
+
+	def connect(self, implementation: ConnectedInterlock, interlock: Interlock_model, connection_key, deadline: float):
+		self.connection = implementation._open_connection(interlock, self.time_left(interlock, deadline))
+		self.connection_key = connection_key
+		with self.statistics_lock:
+			self.connections_opened += 1
+
+	def disconnect(self):
+		if self.connection is not None:
+			try:
+				self.connection_key[0]._close_connection(self.connection)
+			except Exception as error:
+				interlocks_logger.debug(f"Error closing the connection to interlock card {self.card_id}: {error}")
+		self.connection = None
+		self.connection_key = None
+
+	def record(self, latency: float, commands: int, failures: int):
+		with self.statistics_lock:
+			self.exchanges += 1
+			self.commands_sent += commands
+			self.failures += failures
+			self.total_latency += latency
+			self.max_latency = max(self.max_latency, latency)
+			self.last_latency = latency
+
+	def record_timeout(self):
+		with self.statistics_lock:
+			self.timeouts += 1
+
+	def statistics(self) -> Dict:
+		""" Latencies are in seconds, per batch of commands sent to the card. """
+		with self.statistics_lock:
+			return {
+				'commands': self.commands_sent,
+				'failures': self.failures,
+				'timeouts': self.timeouts,
+				'batches': self.exchanges,
+				'connections_opened': self.connections_opened,
+				'queued': self.commands.qsize(),
+				'average_latency': self.total_latency / self.exchanges if self.exchanges else None,
+				'max_latency': self.max_latency,
+				'last_latency': self.last_latency,
+			}
+
+
+class InterlockCommand(Future):
+	""" Reply to a command queued for an interlock card, numbered in the order the commands were queued for the card. """
+
+	def __init__(self, sequence: int, interlock_ids: List[int]):
+		super().__init__()
+		self.sequence = sequence
+		self.interlock_ids = interlock_ids
+
+
+class InterlockDispatcher:
+	"""
+	Routes interlock commands to one queue per interlock card, so a slow or unreachable card only delays its own commands
+	and commands for different cards are sent in parallel.
+	Callers wait for the replies at most INTERLOCK_COMMAND_TIMEOUT seconds. Commands still queued when that time is up are dropped,
+	and the state of commands answered after that time is saved when the reply arrives.
+	"""
+
+	def __init__(self):
+		self.channels: Dict[int, InterlockCardChannel] = {}
+		self.lock = Lock()
+
+	def get_channel(self, card_id: int) -> InterlockCardChannel:
+		with self.lock:
+			channel = self.channels.get(card_id)
+			if channel is None:
+				channel = self.channels[card_id] = InterlockCardChannel(card_id)
+			return channel
+
+	def send_commands(self, batches: List[Tuple[Interlock, List[Interlock_model]]], command_type: Interlock_model.State, timeout: float = None) -> Dict[int, Tuple[Interlock_model.State, str]]:
+		"""
+		Sends the command to each batch of interlocks, a batch being the implementation and the interlocks of one card.
+		Returns the resulting state and error message of each interlock, keyed by id.
+		"""
+		timeout = get_command_timeout() if timeout is None else timeout
+		deadline = perf_counter() + timeout
+		submitted = []
+		for implementation, interlocks in batches:
+			channel = self.get_channel(interlocks[0].card_id)
+			submitted.append((channel, channel.submit(implementation, interlocks, command_type, deadline), implementation, interlocks))
+		replies = {}
+		for channel, future, implementation, interlocks in submitted:
+			try:
+				replies.update(future.result(max(0.0, deadline - perf_counter())))
+			except FutureTimeoutError:
+				channel.record_timeout()
+				if future.cancel():
+					error_message = f"The command was not sent because the interlock card was still busy after {timeout} seconds."
+				else:
+					error_message = f"No reply was received from the interlock card within {timeout} seconds."
+					future.add_done_callback(partial(self.save_late_reply, channel, implementation, command_type))
+				replies.update({interlock.id: (Interlock_model.State.UNKNOWN, error_message) for interlock in interlocks})
+			except Exception as error:
+				replies.update({interlock.id: (Interlock_model.State.UNKNOWN, log_interlock_error(error)) for interlock in interlocks})
+		return replies
+
+	def save_late_reply(self, channel: InterlockCardChannel, implementation: Interlock, command_type: Interlock_model.State, command: InterlockCommand):
+		"""
+		Saves the state of interlocks whose command was answered after the request gave up.
+		That request failed, so interlocks unlocked late are locked again: no tool is left powered without a usage event.
+		So are the interlocks whose reply was lost, the command may have reached the card anyway.
+		Interlocks with a newer command queued, being sent or succeeded are left to that command.
+		"""
+		try:
+			replies = command.result()
+		except Exception as error:
+			interlocks_logger.error(f"Late reply from interlock card {channel.card_id}: {error}")
+			return
+		superseded = channel.superseded(command)
+		replies = {interlock_id: reply for interlock_id, reply in replies.items() if interlock_id not in superseded}
+		save_replies(command_type, replies)
+		if command_type == Interlock_model.State.UNLOCKED:
+			unlocked = [interlock_id for interlock_id, (state, error_message) in replies.items() if state != Interlock_model.State.LOCKED]
+			if unlocked:
+				interlocks_logger.warning(f"Interlocks {unlocked} may have been unlocked after their request gave up, locking them again")
+				relock = channel.submit(implementation, list(Interlock_model.objects.filter(id__in=unlocked).select_related('card')), Interlock_model.State.LOCKED, perf_counter() + get_command_timeout())
+				relock.add_done_callback(partial(self.save_late_reply, channel, implementation, Interlock_model.State.LOCKED))
+
+	def statistics(self) -> Dict[int, Dict]:
+		""" Returns the command, failure and timeout counts and the latencies for each interlock card, keyed by card id. """
+		with self.lock:
+			channels = list(self.channels.values())
+		return {channel.card_id: channel.statistics() for channel in channels}
+
+	def close(self):
+		""" Stops all the card threads and closes their connections. """
+		with self.lock:
+			channels = list(self.channels.values())
+			self.channels.clear()
+		for channel in channels:
+			channel.stop()
+
+
+def log_interlock_error(error: Exception) -> str:
+	interlocks_logger.error(error)
+	return error.message if isinstance(error, InterlockError) else str(error)
+
+
+def save_replies(command_type: Interlock_model.State, replies: Dict[int, Tuple[Interlock_model.State, str]]):
+	for interlock_id, (state, error_message) in replies.items():
+		state = state if state is not None else Interlock_model.State.UNKNOWN
+		Interlock_model.objects.filter(id=interlock_id).update(state=state, most_recent_reply=Interlock._create_reply_message(command_type, state, error_message))
+
+
+def issue_commands(interlocks: Iterable[Interlock_model], command_type: Interlock_model.State, implementation: Interlock = None) -> Dict[int, bool]:
+	"""
+	Sends the command to all the interlocks, grouped by card, and saves their new states with a single query.
+	Returns whether the command succeeded for each interlock, keyed by id.
+	The implementation is looked up from each card category, unless one is given.
+	"""
+	# the same interlock can be given more than once, for example by a parent tool and its child tool
+	interlocks = list({interlock.id: interlock for interlock in interlocks}.values())
+	if not interlocks:
+		return {}
+	interlocks_enabled = getattr(settings, 'INTERLOCKS_ENABLED', False)
+	batches: Dict[int, Tuple[Interlock, List[Interlock_model]]] = {}
+	for interlock in interlocks:
+		if interlocks_enabled and interlock.card.enabled:
+			if interlock.card_id not in batches:
+				batches[interlock.card_id] = (implementation or get(interlock.card.category, raise_exception=False), [])
+			batches[interlock.card_id][1].append(interlock)
+	replies = dispatcher.send_commands(list(batches.values()), command_type) if batches else {}
+
+	for interlock in interlocks:
+		if interlock.id not in replies:
+			interlock.most_recent_reply = "Interlock interface mocked out because settings.INTERLOCKS_ENABLED = False or interlock card is disabled. Interlock last set on " + format_datetime(timezone.now()) + "."
+			interlock.state = command_type
+			continue
+		state, error_message = replies[interlock.id]
+		interlock.state = state if state is not None else Interlock_model.State.UNKNOWN
+		interlock.most_recent_reply = Interlock._create_reply_message(command_type, interlock.state, error_message)
+		# log some useful information
+		if interlock.state == interlock.State.UNKNOWN:
+			interlocks_logger.error(f"Interlock {interlock.id} is in an unknown state. {interlock.most_recent_reply}")
+		elif interlock.state == interlock.State.LOCKED:
+			interlocks_logger.debug(f"Interlock {interlock.id} locked successfully at {format_datetime(timezone.now())}")
+		elif interlock.state == interlock.State.UNLOCKED:
+			interlocks_logger.debug(f"Interlock {interlock.id} unlocked successfully at {format_datetime(timezone.now())}")
+	Interlock_model.objects.bulk_update(interlocks, ['state', 'most_recent_reply'])
+
+	# If the command type equals the current state then the command worked:
+	return {interlock.id: interlock.state == command_type for interlock in interlocks}
+
+
+def bulk_lock(interlocks: Iterable[Interlock_model]) -> Dict[int, bool]:
+	""" Locks all the interlocks, sending one batch of commands per card and all the cards in parallel. """
+	return issue_commands(interlocks, Interlock_model.State.LOCKED)
+
+
+def bulk_unlock(interlocks: Iterable[Interlock_model]) -> Dict[int, bool]:
+	""" Unlocks all the interlocks, sending one batch of commands per card and all the cards in parallel. """
+	return issue_commands(interlocks, Interlock_model.State.UNLOCKED)
 
 
 def get(category: InterlockCardCategory, raise_exception=True):
@@ -337,3 +779,5 @@ interlocks: Dict[str, Interlock] = {
 	'web_relay_http': WebRelayHttpInterlock(),
 	'proxr': ProXrInterlock(),
 }
+
+dispatcher = InterlockDispatcher()
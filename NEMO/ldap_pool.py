@@ -0,0 +1,265 @@
+from _ssl import PROTOCOL_TLSv1_2, CERT_REQUIRED
+from logging import getLogger
+from queue import LifoQueue, Empty, Full
+from threading import Lock
+from time import perf_counter, monotonic
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from ldap3 import Tls, Server, Connection, AUTO_BIND_TLS_BEFORE_BIND, SIMPLE, AUTO_BIND_NO_TLS, ANONYMOUS
+from ldap3.core.exceptions import LDAPBindError, LDAPException
+
+ldap_logger = getLogger(__name__)
+
+
+def get_dn_cache_timeout():
+	""" Number of seconds a user's distinguished name found by a search is remembered. """
+	return getattr(settings, 'LDAP_DN_CACHE_TIMEOUT', 300)
+
+
+def get_circuit_breaker_threshold():
+	""" Number of consecutive failures after which a server is skipped. """
+	return getattr(settings, 'LDAP_CIRCUIT_BREAKER_THRESHOLD', 3)
+
+
+def get_circuit_breaker_timeout():
+	""" Number of seconds a failing server is skipped before it is tried again. """
+	return getattr(settings, 'LDAP_CIRCUIT_BREAKER_TIMEOUT', 60)
+
+
+def get_pool_size():
+	""" Maximum number of idle service connections kept open for each server. """
+	return getattr(settings, 'LDAP_POOL_SIZE', 4)
+
+
+def server_key(server: dict) -> Tuple[str, int]:
+	return server['url'], server.get('port', 636)
+
+
+# ldap3 servers (and their TLS settings) can be shared by connections, so they are only built once per LDAP_SERVERS entry.
+ldap3_servers: Dict[Tuple[str, int], Server] = {}
+
+
+def connect(server: dict, user: Optional[str], password: Optional[str], authentication) -> Connection:
+	""" Opens a connection to the server described by an entry of LDAP_SERVERS and binds it as the user. """
+	key = server_key(server)
+	use_ssl = server.get('use_ssl', True)
+	if key not in ldap3_servers:
+		tls = Tls(validate=CERT_REQUIRED, version=PROTOCOL_TLSv1_2, ca_certs_file=server.get('certificate'))
+		ldap3_servers[key] = Server(server['url'], port=key[1], use_ssl=use_ssl, tls=tls, connect_timeout=server.get('connect_timeout'))
+	auto_bind = AUTO_BIND_TLS_BEFORE_BIND if use_ssl else AUTO_BIND_NO_TLS
+	return Connection(ldap3_servers[key], user=user, password=password, auto_bind=auto_bind, authentication=authentication, raise_exceptions=True)
+
+
+def close(connection):
+	try:
+		connection.unbind()
+	except Exception:
+		pass
+
+
+class LDAPServerState:
+	""" Health, speed and idle service connections of one LDAP server. """
+
+	def __init__(self):
+		self.lock = Lock()
+		self.consecutive_failures = 0
+		self.skip_until = 0.0
+		self.latency = None
+		self.failures = 0
+		self.connections_opened = 0
+		self.idle_connections = LifoQueue()
+
+	def record_success(self, latency: float):
+		with self.lock:
+			self.consecutive_failures = 0
+			self.skip_until = 0.0
+			# Moving average, so one slow answer doesn't reorder the servers
+			self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+	def record_failure(self):
+		with self.lock:
+			self.failures += 1
+			self.consecutive_failures += 1
+			if self.consecutive_failures >= get_circuit_breaker_threshold():
+				self.skip_until = monotonic() + get_circuit_breaker_timeout()
+		# The idle connections are most likely broken too
+		self.close_idle_connections()
+
+	def is_available(self) -> bool:
+		return monotonic() >= self.skip_until
+
+	def take_idle_connection(self):
+		try:
+			return self.idle_connections.get_nowait()
+		except Empty:
+			return None
+
+	def release_connection(self, connection):
+		if self.idle_connections.qsize() >= get_pool_size():
+			close(connection)
+			return
+		try:
+			self.idle_connections.put_nowait(connection)
+		except Full:
+			close(connection)
+
+	def close_idle_connections(self):
+		while True:
+			connection = self.take_idle_connection()
+			if connection is None:
+				return
+			close(connection)
+
+
+class LDAPDirectory:
+	"""
+	Authenticates users against the servers in settings.LDAP_SERVERS.
+	Servers are tried fastest first, and a server that keeps failing is skipped for a while (circuit breaking).
+	For servers that need a search to find the user (bind_as_authentication set to False), the service account
+	connections are kept open and reused, and the distinguished name found for each user is cached.
+	The connection factory can be replaced, for example by a local test double standing in for the directory.
+	"""
+
+	def __init__(self, connection_factory=connect):
+		self.connection_factory = connection_factory
+		self.lock = Lock()
+		self.states: Dict[Tuple[str, int], LDAPServerState] = {}
+		self.user_dns: Dict[Tuple[str, int, str], Tuple[str, float]] = {}
+
+	def get_state(self, server: dict) -> LDAPServerState:
+		key = server_key(server)
+		with self.lock:
+			if key not in self.states:
+				self.states[key] = LDAPServerState()
+			return self.states[key]
+
+	def ordered_servers(self) -> List[dict]:
+		""" Servers that answered recently come first, fastest first. Servers that keep failing are skipped, unless all of them are. """
+		servers = list(enumerate(settings.LDAP_SERVERS))
+		available = [(index, server) for index, server in servers if self.get_state(server).is_available()]
+
+		def speed(indexed_server):
+			index, server = indexed_server
+			state = self.get_state(server)
+			return state.consecutive_failures > 0, state.latency if state.latency is not None else float('inf'), index
+
+		return [server for index, server in sorted(available or servers, key=speed)]
+
+	def authenticate(self, username: str, password: str) -> bool:
+		errors = []
+		for server in self.ordered_servers():
+			state = self.get_state(server)
+			start = perf_counter()
+			try:
+				domain = server.get('domain')
+				ldap_bind_user = f"{domain}\\{username}" if domain else username
+				cached_dn = False
+				if not server.get('bind_as_authentication', True):
+					# search for the user first, then bind with the dn found
+					ldap_bind_user, cached_dn = self.get_user_dn(server, username)
+					if not ldap_bind_user:
+						state.record_success(perf_counter() - start)
+						errors.append(f"User {username} attempted to authenticate with LDAP ({server['url']}), but the search with dn:{server['base_dn']}, username_field:{server.get('search_username_field', 'uid')} and attribute:{server.get('search_attribute', 'cn')} did not return any results. The user was denied access")
+						continue
+				try:
+					self.bind(server, ldap_bind_user, password)
+				except LDAPBindError:
+					if not cached_dn:
+						raise
+					# The user may have been moved in the directory since the dn was cached
+					self.forget_user_dn(server, username)
+					found_dn, cached_dn = self.get_user_dn(server, username)
+					if not found_dn or found_dn == ldap_bind_user:
+						raise
+					self.bind(server, found_dn, password)
+				state.record_success(perf_counter() - start)
+				ldap_logger.debug(f"User {username} was successfully authenticated with LDAP ({server['url']})")
+				return True
+			except LDAPBindError as e:
+				# The server answered, so it is healthy
+				state.record_success(perf_counter() - start)
+				errors.append(f"User {username} attempted to authenticate with LDAP ({server['url']}), but entered an incorrect password. The user was denied access: {str(e)}")
+			except LDAPException as e:
+				state.record_failure()
+				errors.append(f"User {username} attempted to authenticate with LDAP ({server['url']}), but an error occurred. The user was denied access: {str(e)}")
+		for error in errors:
+			ldap_logger.warning(error)
+		return False
+
+	def bind(self, server: dict, user: str, password: str):
+		connection = self.connection_factory(server, user, password, SIMPLE)
+		close(connection)
+
+	def get_user_dn(self, server: dict, username: str) -> Tuple[Optional[str], bool]:
+		""" Returns the distinguished name of the user (or None if it wasn't found) and whether it came from the cache. """
+		key = (*server_key(server), username)
+		cached = self.user_dns.get(key)
+		if cached and cached[1] > monotonic():
+			return cached[0], True
+		dn = self.search_user_dn(server, username)
+		if dn:
+			self.user_dns[key] = (dn, monotonic() + get_dn_cache_timeout())
+		return dn, False
+
+	def forget_user_dn(self, server: dict, username: str):
+		self.user_dns.pop((*server_key(server), username), None)
+
+	def search_user_dn(self, server: dict, username: str) -> Optional[str]:
+		state = self.get_state(server)
+		connection = state.take_idle_connection()
+		if connection is not None:
+			try:
+				return self.search(state, connection, server, username)
+			except LDAPException:
+				# The server may have closed the idle connection, so try again with a new one
+				close(connection)
+		connection = self.open_service_connection(server, state)
+		try:
+			return self.search(state, connection, server, username)
+		except LDAPException:
+			close(connection)
+			raise
+
+	def open_service_connection(self, server: dict, state: LDAPServerState) -> Connection:
+		domain = server.get('domain')
+		bind_username = server.get('bind_username', None)
+		bind_username = f"{domain}\\{bind_username}" if domain and bind_username else bind_username
+		bind_password = server.get('bind_password', None)
+		authentication = SIMPLE if bind_username and bind_password else ANONYMOUS
+		connection = self.connection_factory(server, bind_username, bind_password, authentication)
+		with state.lock:
+			state.connections_opened += 1
+		return connection
+
+	def search(self, state: LDAPServerState, connection, server: dict, username: str) -> Optional[str]:
+		search_username_field = server.get('search_username_field', 'uid')
+		search_attribute = server.get('search_attribute', 'cn')
+		found = connection.search(server['base_dn'], f"({search_username_field}={username})", attributes=[search_attribute])
+		dn = connection.response[0]['dn'] if found and search_attribute in connection.response[0].get('attributes', []) else None
+		state.release_connection(connection)
+		return dn
+
+	def statistics(self) -> Dict[str, dict]:
+		with self.lock:
+			states = dict(self.states)
+		return {
+			f"{url}:{port}": {
+				'available': state.is_available(),
+				'latency': state.latency,
+				'failures': state.failures,
+				'connections_opened': state.connections_opened,
+				'idle_connections': state.idle_connections.qsize(),
+			} for (url, port), state in states.items()
+		}
+
+	def close(self):
+		with self.lock:
+			states = list(self.states.values())
+			self.states = {}
+			self.user_dns = {}
+		for state in states:
+			state.close_idle_connections()
+
+
+directory = LDAPDirectory()
@@ -0,0 +1,100 @@
+from hashlib import md5
+from logging import getLogger
+from time import time
+from typing import Iterable, Set
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import Resolver404, resolve
+
+from NEMO.tasks import executor
+
+link_health_logger = getLogger(__name__)
+
+# Long enough for a probe to time out, so a link is never probed twice at the same time
+link_probe_lock_timeout = 60
+
+
+def get_link_health_ttl() -> int:
+	""" Number of seconds the reachability of an external landing page link is trusted before it is probed again. """
+	return getattr(settings, 'LANDING_LINK_HEALTH_TTL', 600)
+
+
+def get_probe_timeout() -> float:
+	""" Number of seconds a probe waits for an external link to answer. """
+	return getattr(settings, 'LANDING_LINK_PROBE_TIMEOUT', 3)
+
+
+def link_health_cache_key(url: str) -> str:
+	return 'NEMO.link_health.' + md5(url.encode()).hexdigest()
+
+
+def link_probe_lock_cache_key(url: str) -> str:
+	return 'NEMO.link_probe_lock.' + md5(url.encode()).hexdigest()
+
+
+def is_internal(url: str) -> bool:
+	return url.startswith("/")
+
+
+def probe_link(url: str) -> bool:
+	""" Internal URLs must resolve, and external URLs must answer a HEAD request with a status of 400 or less. """
+	if is_internal(url):
+		try:
+			resolve(url)
+		except Resolver404:
+			return False
+		return True
+	try:
+		response = requests.head(url, timeout=get_probe_timeout())
+	except Exception:
+		return False
+	return response.status_code <= 400
+
+
+def probe_and_save(url: str):
+	try:
+		reachable = probe_link(url)
+		if not reachable:
+			link_health_logger.warning(f"The landing page link {url} is unreachable, it is hidden from the landing page")
+		# Kept longer than the TTL, so the landing page uses the last verdict while a stale link is probed again
+		cache.set(link_health_cache_key(url), (reachable, time()), get_link_health_ttl() * 10)
+	finally:
+		cache.delete(link_probe_lock_cache_key(url))
+
+
+def schedule_probe(url: str):
+	"""
+	Probes the external link in the background with the postponed tasks executor, unless it is already being probed.
+	The probe is dropped when the executor is busy, the page being rendered must not wait for it. A later page will probe the link.
+	"""
+	if is_internal(url) or not cache.add(link_probe_lock_cache_key(url), True, link_probe_lock_timeout):
+		return
+	if not executor.submit(probe_and_save, [url], retries=0, drop_when_full=True):
+		cache.delete(link_probe_lock_cache_key(url))
+
+
+def get_reachable_urls(urls: Iterable[str]) -> Set[str]:
+	"""
+	Returns the URLs that are reachable, without any network request: internal URLs are resolved, and external URLs use
+	the verdict of their last probe. Links that were never probed, or whose verdict is older than LANDING_LINK_HEALTH_TTL,
+	are probed in the background. Links never probed are considered reachable until then.
+	"""
+	urls = set(urls)
+	external_urls = {url for url in urls if not is_internal(url)}
+	keys = {link_health_cache_key(url): url for url in external_urls}
+	health = {keys[key]: verdict for key, verdict in cache.get_many(keys).items()}
+	now = time()
+	reachable = set()
+	for url in urls:
+		if is_internal(url):
+			if probe_link(url):
+				reachable.add(url)
+			continue
+		verdict = health.get(url)
+		if verdict is None or now - verdict[1] > get_link_health_ttl():
+			schedule_probe(url)
+		if verdict is None or verdict[0]:
+			reachable.add(url)
+	return reachable
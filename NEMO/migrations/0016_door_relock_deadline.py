@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NEMO', '0015_area_maximum_capacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='door',
+            name='relock_deadline',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the door, unlocked by a badge swipe, is due to be locked again.', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NEMO', '0016_door_relock_deadline'),
+    ]
+
+    def mark_reminders_already_sent(apps, schema_editor):
+        # Reminders used to be sent for the reservations starting in the two hours after each run, so the reservations starting
+        # before the window of the next run already got theirs (the 5 minutes allow for time skew between the runs).
+        Reservation = apps.get_model("NEMO", "Reservation")
+        Reservation.objects.filter(reminder_sent=None, start__lte=timezone.now() + timedelta(minutes=115)).update(reminder_sent=timezone.now())
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='reminder_sent',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the reservation reminder email was sent to the user.', null=True),
+        ),
+        migrations.RunPython(mark_reminders_already_sent, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.10 on 2026-10-18 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NEMO', '0019_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimedServiceRun',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('last_run', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
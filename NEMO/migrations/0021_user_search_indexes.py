@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NEMO', '0020_timedservicerun'),
+    ]
+
+    user_search_columns = ['first_name', 'last_name', 'username']
+
+    def create_user_search_indexes(apps, schema_editor):
+        # On PostgreSQL, istartswith is UPPER(column) LIKE 'TERM%', which only an index on the same expression can serve.
+        # The other databases compare case insensitively with the column indexes.
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        table = apps.get_model("NEMO", "User")._meta.db_table
+        for column in Migration.user_search_columns:
+            index = schema_editor.quote_name(f"{table}_{column}_upper_like")
+            schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {schema_editor.quote_name(table)} (UPPER({schema_editor.quote_name(column)}::text) text_pattern_ops)")
+
+    def drop_user_search_indexes(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        table = apps.get_model("NEMO", "User")._meta.db_table
+        for column in Migration.user_search_columns:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(f'{table}_{column}_upper_like')}")
+
+    operations = [
+        migrations.RunPython(create_user_search_indexes, drop_user_search_indexes),
+    ]
@@ -1,15 +1,22 @@
 import datetime
 import os
 from datetime import timedelta
+from threading import local
+from time import monotonic
+from typing import Callable, Optional, Set, TypeVar
+from uuid import uuid4
 
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.models import BaseUserManager, Group, Permission
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction, connection, DEFAULT_DB_ALIAS
 from django.db.models import Q
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
+from django.test.signals import setting_changed
 from django.urls import reverse
 from django.utils import timezone
 
@@ -28,10 +35,14 @@ class CalendarDisplay(models.Model):
 	end = None
 
 	def get_visual_end(self):
-		if self.end is None:
-			return max(self.start + timedelta(minutes=15), timezone.now())
+		return CalendarDisplay.visual_end(self.start, self.end)
+
+	@staticmethod
+	def visual_end(start, end):
+		if end is None:
+			return max(start + timedelta(minutes=15), timezone.now())
 		else:
-			return max(self.start + timedelta(minutes=15), self.end)
+			return max(start + timedelta(minutes=15), end)
 
 	class Meta:
 		abstract = True
@@ -79,8 +90,8 @@ class UserType(models.Model):
 class User(models.Model):
 	# Personal information:
 	username = models.CharField(max_length=100, unique=True)
-	first_name = models.CharField(max_length=100)
-	last_name = models.CharField(max_length=100)
+	first_name = models.CharField(max_length=100, db_index=True)
+	last_name = models.CharField(max_length=100, db_index=True)
 	email = models.EmailField(verbose_name='email address')
 	type = models.ForeignKey(UserType, null=True, on_delete=models.SET_NULL)
 	domain = models.CharField(max_length=100, blank=True, help_text="The Active Directory domain that the account resides on")
@@ -184,13 +195,13 @@ class User(models.Model):
 		return self.first_name
 
 	def in_area(self):
-		return AreaAccessRecord.objects.filter(customer=self, staff_charge=None, end=None).exists()
+		return get_area_occupancy().get_area_id(self.id) is not None
 
 	def area_access_record(self):
-		try:
-			return AreaAccessRecord.objects.get(customer=self, staff_charge=None, end=None)
-		except AreaAccessRecord.DoesNotExist:
+		record_id = get_area_occupancy().get_record_id(self.id)
+		if record_id is None:
 			return None
+		return AreaAccessRecord.objects.filter(id=record_id, staff_charge=None, end=None).select_related('area', 'project').first()
 
 	def billing_to_project(self):
 		access_record = self.area_access_record()
@@ -517,29 +528,27 @@ class Tool(models.Model):
 		return self.name
 
 	def is_child_tool(self):
-		return self.parent_tool != None
+		if self.parent_tool_id is None:
+			return False
+		# Resolve the parent from the tool family map, so the delegating properties don't query it
+		if not Tool.parent_tool.is_cached(self):
+			parent_tool = get_tool_family().get_tool(self.parent_tool_id)
+			if parent_tool is not None:
+				Tool.parent_tool.field.set_cached_value(self, parent_tool)
+		return True
 
 	def is_parent_tool(self, parent_ids = None):
-		if not parent_ids:
-			parent_ids = Tool.objects.filter(parent_tool__isnull=False).values_list('parent_tool_id', flat=True)
-		return self.id in parent_ids
+		if parent_ids is not None:
+			return self.id in parent_ids
+		return get_tool_family().is_parent_tool(self.id)
 
 	def tool_or_parent_id(self):
 		""" This method returns the tool id or the parent tool id if tool is a child """
-		if self.is_child_tool():
-			return self.parent_tool.id
-		else:
-			return self.id
+		return self.parent_tool_id if self.parent_tool_id is not None else self.id
 
 	def get_family_tool_ids(self):
 		""" this method returns a list of children tool ids, parent and self id """
-		tool_ids = list(self.tool_children_set.values_list('id', flat=True))
-		# parent tool
-		if self.is_child_tool():
-			tool_ids.append(self.parent_tool.id)
-		# self
-		tool_ids.append(self.id)
-		return tool_ids
+		return get_tool_family().get_family_tool_ids(self.id, self.parent_tool_id)
 
 	def raise_setter_error_if_child_tool(self, field):
 		if self.is_child_tool():
@@ -667,7 +676,7 @@ class Tool(models.Model):
 	def get_current_usage_event(self):
 		""" Gets the usage event for the current user of this tool. """
 		try:
-			return UsageEvent.objects.get(end=None, tool_id__in=self.get_family_tool_ids())
+			return UsageEvent.objects.select_related('operator', 'user', 'project', 'tool').get(end=None, tool_id__in=self.get_family_tool_ids())
 		except UsageEvent.DoesNotExist:
 			return None
 
@@ -889,6 +898,7 @@ class Reservation(CalendarDisplay):
 	additional_information = models.TextField(null=True, blank=True)
 	self_configuration = models.BooleanField(default=False, help_text="When checked, indicates that the user will perform their own tool configuration (instead of requesting that the NanoFab staff configure it for them).")
 	title = models.TextField(default='', blank=True, max_length=200, help_text="Shows a custom title for this reservation on the calendar. Leave this field blank to display the reservation's user name as the title (which is the default behaviour).")
+	reminder_sent = models.DateTimeField(null=True, blank=True, editable=False, help_text="When the reservation reminder email was sent to the user.")
 
 	def duration(self):
 		return self.end - self.start
@@ -1348,6 +1358,7 @@ class Door(models.Model):
 	name = models.CharField(max_length=100)
 	area = models.ForeignKey(Area, related_name='doors', on_delete=models.PROTECT)
 	interlock = models.OneToOneField(Interlock, on_delete=models.PROTECT)
+	relock_deadline = models.DateTimeField(null=True, blank=True, editable=False, help_text="When the door, unlocked by a badge swipe, is due to be locked again.")
 
 	def __str__(self):
 		return str(self.name)
@@ -1374,12 +1385,17 @@ class PhysicalAccessLevel(models.Model):
 	allow_staff_access = models.BooleanField(blank=False, null=False, default=False, help_text="Check this box to allow access to Staff users without explicitly granting them access")
 
 	def accessible(self):
+		return self.schedule_is_accessible(self.schedule)
+
+	@classmethod
+	def schedule_is_accessible(cls, schedule) -> bool:
+		""" Returns whether the schedule allows access at the current time. """
 		now = timezone.localtime(timezone.now())
 		saturday = 6
 		sunday = 7
-		if self.schedule == self.Schedule.ALWAYS:
+		if schedule == cls.Schedule.ALWAYS:
 			return True
-		elif self.schedule == self.Schedule.WEEKDAYS_7AM_TO_MIDNIGHT:
+		elif schedule == cls.Schedule.WEEKDAYS_7AM_TO_MIDNIGHT:
 			if now.isoweekday() == saturday or now.isoweekday() == sunday:
 				return False
 			seven_am = datetime.time(hour=7, tzinfo=timezone.get_current_timezone())
@@ -1387,7 +1403,7 @@ class PhysicalAccessLevel(models.Model):
 			current_time = now.time()
 			if seven_am < current_time < midnight:
 				return True
-		elif self.schedule == self.Schedule.WEEKENDS:
+		elif schedule == cls.Schedule.WEEKENDS:
 			if now.isoweekday() == saturday or now.isoweekday() == sunday:
 				return True
 		return False
@@ -1589,6 +1605,291 @@ class News(models.Model):
 		verbose_name_plural = 'News'
 
 
+def clear_tool_summary_cache(sender, **kwargs):
+	""" Clear the cached tool status summary (used by the status dashboard, sidebar and kiosk) when something it displays changes. """
+	from NEMO.views.status_dashboard import invalidate_tool_summary
+	invalidate_tool_summary()
+
+
+# Call the function "clear_tool_summary_cache" every time a tool, task, resource, scheduled outage or usage event is saved or deleted:
+for tool_status_model in [Tool, Task, Resource, ScheduledOutage, UsageEvent]:
+	post_save.connect(clear_tool_summary_cache, sender=tool_status_model)
+	post_delete.connect(clear_tool_summary_cache, sender=tool_status_model)
+m2m_changed.connect(clear_tool_summary_cache, sender=Resource.fully_dependent_tools.through)
+m2m_changed.connect(clear_tool_summary_cache, sender=Resource.partially_dependent_tools.through)
+
+
+class CacheVersion(models.Model):
+	""" Version of data cached in memory by every NEMO process, changed when that data changes so that each process loads it again. """
+	name = models.CharField(max_length=100, primary_key=True)
+	version = models.CharField(max_length=32)
+
+
+class TimedServiceRun(models.Model):
+	""" When a timed service last ran. The row is locked while the service runs, so overlapping runs wait for each other. """
+	name = models.CharField(max_length=100, primary_key=True)
+	last_run = models.DateTimeField(null=True, blank=True)
+
+	@staticmethod
+	def lock(name: str) -> 'TimedServiceRun':
+		""" Returns the run of the service, locked until the end of the transaction. Must be called in a transaction. """
+		TimedServiceRun.objects.get_or_create(name=name)
+		return TimedServiceRun.objects.select_for_update().get(name=name)
+
+
+# The versions last read by this process, with the time they were read
+cache_versions = {}
+
+
+def get_cache_version_max_age() -> float:
+	""" Number of seconds a process uses the version of cached data before reading it from the database again. """
+	return getattr(settings, 'CACHE_VERSION_MAX_AGE', 2)
+
+
+@receiver(setting_changed)
+def clear_cache_versions(setting, **kwargs):
+	""" The versions are read from the database again when tests change how long they are used. """
+	if setting == 'CACHE_VERSION_MAX_AGE':
+		cache_versions.clear()
+
+
+def get_cache_version(name: str, max_age: float = None) -> str:
+	"""
+	Returns the version of the cached data, read from the database at most every max_age seconds (CACHE_VERSION_MAX_AGE
+	by default), so changes made by other processes are picked up even without a shared cache.
+	"""
+	max_age = get_cache_version_max_age() if max_age is None else max_age
+	now = monotonic()
+	read = cache_versions.get(name)
+	if read is not None and now - read[0] < max_age:
+		return read[1]
+	version = CacheVersion.objects.filter(name=name).values_list('version', flat=True).first()
+	if version is None:
+		version = CacheVersion.objects.get_or_create(name=name, defaults={'version': uuid4().hex})[0].version
+	cache_versions[name] = (now, version)
+	return version
+
+
+def change_cache_version(name: str):
+	""" Changes the version of the cached data right away. Use invalidate_cache_version instead. """
+	cache_versions.pop(name, None)
+	version = uuid4().hex
+	if not CacheVersion.objects.filter(name=name).update(version=version):
+		CacheVersion.objects.get_or_create(name=name, defaults={'version': version})
+
+
+# The names of the cached data changed by the open transaction of each thread
+uncommitted_changes = local()
+
+
+def get_uncommitted_changes() -> Set[str]:
+	if not connection.in_atomic_block or not hasattr(uncommitted_changes, 'names'):
+		# Outside of a transaction, the changes were either committed or rolled back
+		uncommitted_changes.names = set()
+	return uncommitted_changes.names
+
+
+def invalidate_cache_version(name: str):
+	"""
+	Changes the version of the cached data so every process loads it again. In a transaction, the version only changes once
+	the transaction is committed, so the row of the version isn't locked while the transaction runs.
+	"""
+	changes = get_uncommitted_changes()
+	if name not in changes:
+		if connection.in_atomic_block:
+			changes.add(name)
+		transaction.on_commit(lambda: change_cache_version(name))
+
+
+CachedData = TypeVar('CachedData')
+
+
+def get_cached_data(name: str, get: Callable[[str], Optional[CachedData]], load: Callable[[], CachedData], put: Callable[[str, CachedData], None], max_age: float = None) -> CachedData:
+	"""
+	Returns the data cached for the current version (see get_cache_version) with get, or loads it and caches it with put.
+	A transaction that changed the data loads it every time without caching it: the other processes only see the new version
+	once the transaction is committed, and the changes might be rolled back.
+	"""
+	if name in get_uncommitted_changes():
+		return load()
+	# Read before loading the data, so a change made while it loads triggers another load next time
+	version = get_cache_version(name, max_age)
+	data = get(version)
+	if data is None:
+		data = load()
+		put(version, data)
+	return data
+
+
+tool_family_version_name = 'tool_family'
+tool_family = None
+
+
+class ToolFamily:
+	"""
+	Process-wide map of the tool families: the children of each parent tool, and the field values of every tool
+	so that child tools can resolve their parent (and the attributes they inherit from it) without querying the database.
+	"""
+
+	def __init__(self):
+		self.version = None
+		self.field_names = [field.attname for field in Tool._meta.concrete_fields]
+		self.tool_values = {}
+		self.children = {}
+		for values in Tool.objects.order_by().values_list(*self.field_names):
+			tool = dict(zip(self.field_names, values))
+			self.tool_values[tool['id']] = values
+			if tool['parent_tool_id'] is not None:
+				self.children.setdefault(tool['parent_tool_id'], []).append(tool['id'])
+
+	def get_tool(self, tool_id):
+		""" Returns a new Tool instance (so cached relations are never shared between requests) or None if the tool doesn't exist. """
+		values = self.tool_values.get(tool_id)
+		return Tool.from_db(DEFAULT_DB_ALIAS, self.field_names, values) if values is not None else None
+
+	def is_parent_tool(self, tool_id) -> bool:
+		return tool_id in self.children
+
+	def get_family_tool_ids(self, tool_id, parent_tool_id=None):
+		""" Returns the children tool ids, the parent tool id and the tool id itself. """
+		tool_ids = list(self.children.get(tool_id, []))
+		if parent_tool_id is not None:
+			tool_ids.append(parent_tool_id)
+		tool_ids.append(tool_id)
+		return tool_ids
+
+
+def get_tool_family() -> ToolFamily:
+	"""
+	Returns the tool family map, loading it the first time and again after any tool was saved or deleted.
+	The version is kept in the database so changes made by another process are also picked up.
+	"""
+	return get_cached_data(tool_family_version_name, get_loaded_tool_family, ToolFamily, set_loaded_tool_family)
+
+
+def get_loaded_tool_family(version: str) -> Optional[ToolFamily]:
+	current_family = tool_family
+	return current_family if current_family is not None and current_family.version == version else None
+
+
+def set_loaded_tool_family(version: str, family: ToolFamily):
+	global tool_family
+	family.version = version
+	tool_family = family
+
+
+def invalidate_tool_family():
+	invalidate_cache_version(tool_family_version_name)
+
+
+def clear_tool_family_cache(sender, **kwargs):
+	""" Reload the tool family map when a tool is saved or deleted. """
+	invalidate_tool_family()
+
+
+post_save.connect(clear_tool_family_cache, sender=Tool)
+post_delete.connect(clear_tool_family_cache, sender=Tool)
+
+
+area_occupancy_version_name = 'area_occupancy'
+area_occupancy_cache_timeout = 60
+
+
+class AreaOccupancy:
+	"""
+	Who is currently logged in to each area: the open area access record (area access charged to a staff member excluded)
+	of each user, and the number of people in each area. It is kept in the cache so the badge readers, the capacity checks
+	and the occupancy pages don't have to count the open records again.
+	"""
+
+	def __init__(self):
+		self.records = {}
+		self.counts = {}
+		for record_id, customer_id, area_id in AreaAccessRecord.objects.filter(end=None, staff_charge=None).order_by().values_list('id', 'customer_id', 'area_id'):
+			self.records[customer_id] = (record_id, area_id)
+			self.counts[area_id] = self.counts.get(area_id, 0) + 1
+
+	def get_record_id(self, user_id):
+		record = self.records.get(user_id)
+		return record[0] if record else None
+
+	def get_area_id(self, user_id):
+		record = self.records.get(user_id)
+		return record[1] if record else None
+
+	def get_count(self, area_id) -> int:
+		return self.counts.get(area_id, 0)
+
+
+def get_area_occupancy() -> AreaOccupancy:
+	""" Returns the area occupancy, loading it again after any area access record was saved or deleted. """
+	return get_cached_data(
+		area_occupancy_version_name,
+		lambda version: cache.get(f'NEMO.area_occupancy.{version}'),
+		AreaOccupancy,
+		lambda version, occupancy: cache.set(f'NEMO.area_occupancy.{version}', occupancy, area_occupancy_cache_timeout),
+	)
+
+
+def invalidate_area_occupancy():
+	invalidate_cache_version(area_occupancy_version_name)
+
+
+def clear_area_occupancy_cache(sender, **kwargs):
+	""" Reload the area occupancy when an area access record is saved or deleted. """
+	invalidate_area_occupancy()
+
+
+post_save.connect(clear_area_occupancy_cache, sender=AreaAccessRecord)
+post_delete.connect(clear_area_occupancy_cache, sender=AreaAccessRecord)
+
+
+def clear_area_access_profile_cache(sender, **kwargs):
+	""" Reload the area access profiles when a user, their projects, their physical access levels or a resource changes. """
+	if kwargs.get('update_fields') == frozenset(['last_login']):
+		# Saved every time a user logs in, and not part of the profile
+		return
+	from NEMO.views.policy import invalidate_area_access_profiles
+	invalidate_area_access_profiles()
+
+
+# Call the function "clear_area_access_profile_cache" every time something the area access policy checks is saved or deleted:
+for area_access_profile_model in [User, Account, Project, Area, PhysicalAccessLevel, Resource]:
+	post_save.connect(clear_area_access_profile_cache, sender=area_access_profile_model)
+	post_delete.connect(clear_area_access_profile_cache, sender=area_access_profile_model)
+m2m_changed.connect(clear_area_access_profile_cache, sender=User.projects.through)
+m2m_changed.connect(clear_area_access_profile_cache, sender=User.physical_access_levels.through)
+m2m_changed.connect(clear_area_access_profile_cache, sender=Resource.dependent_areas.through)
+
+
+def probe_landing_page_link(sender, instance, **kwargs):
+	""" Probe the link of a landing page choice once it is saved, so it is known to work before the landing page is displayed. """
+	from NEMO.link_health import schedule_probe
+	url = instance.url
+	transaction.on_commit(lambda: schedule_probe(url))
+
+
+post_save.connect(probe_landing_page_link, sender=LandingPageChoice)
+
+
+def clear_customization_cache(sender, **kwargs):
+	""" Reload the customizations in every process when one is saved or deleted. """
+	from NEMO.views.customization import invalidate_customization_cache
+	invalidate_customization_cache()
+
+
+post_save.connect(clear_customization_cache, sender=Customization)
+post_delete.connect(clear_customization_cache, sender=Customization)
+
+
+@receiver(setting_changed)
+def clear_customization_cache_for_media_root(setting, **kwargs):
+	""" The media files are cached, so they are read again when tests change the media directory. """
+	if setting in ['MEDIA_ROOT', 'DEFAULT_FILE_STORAGE']:
+		from NEMO.views.customization import reset_customization_cache
+		reset_customization_cache()
+
+
 def record_remote_many_to_many_changes_and_save(request, obj, form, change, many_to_many_field, save_function_pointer):
 	"""
 	Record the changes in a many-to-many field that the model does not own. Then, save the many-to-many field.
@@ -1621,23 +1922,10 @@ def record_remote_many_to_many_changes_and_save(request, obj, form, change, many
 	obj.user_set.set(form.cleaned_data[many_to_many_field])
 	save_function_pointer(request, obj, form, change)
 
-	# Record which members were added to the object.
-	for user in added_members:
-		new_member = MembershipHistory()
-		new_member.authorizer = request.user
-		new_member.parent_content_object = obj
-		new_member.child_content_object = user
-		new_member.action = MembershipHistory.Action.ADDED
-		new_member.save()
-
-	# Record which members were removed from the object.
-	for user in removed_members:
-		ex_member = MembershipHistory()
-		ex_member.authorizer = request.user
-		ex_member.parent_content_object = obj
-		ex_member.child_content_object = user
-		ex_member.action = MembershipHistory.Action.REMOVED
-		ex_member.save()
+	# Record which members were added to and removed from the object.
+	history = [MembershipHistory(authorizer=request.user, parent_content_object=obj, child_content_object=user, action=MembershipHistory.Action.ADDED) for user in added_members]
+	history += [MembershipHistory(authorizer=request.user, parent_content_object=obj, child_content_object=user, action=MembershipHistory.Action.REMOVED) for user in removed_members]
+	MembershipHistory.objects.bulk_create(history)
 
 
 def record_local_many_to_many_changes(request, obj, form, many_to_many_field):
@@ -1648,21 +1936,10 @@ def record_local_many_to_many_changes(request, obj, form, many_to_many_field):
 		original_members = set(getattr(obj, many_to_many_field).all())
 		current_members = set(form.cleaned_data[many_to_many_field])
 		added_members = set(current_members) - set(original_members)
-		for a in added_members:
-			p = MembershipHistory()
-			p.action = MembershipHistory.Action.ADDED
-			p.authorizer = request.user
-			p.child_content_object = obj
-			p.parent_content_object = a
-			p.save()
 		removed_members = set(original_members) - set(current_members)
-		for a in removed_members:
-			p = MembershipHistory()
-			p.action = MembershipHistory.Action.REMOVED
-			p.authorizer = request.user
-			p.child_content_object = obj
-			p.parent_content_object = a
-			p.save()
+		history = [MembershipHistory(action=MembershipHistory.Action.ADDED, authorizer=request.user, child_content_object=obj, parent_content_object=a) for a in added_members]
+		history += [MembershipHistory(action=MembershipHistory.Action.REMOVED, authorizer=request.user, child_content_object=obj, parent_content_object=a) for a in removed_members]
+		MembershipHistory.objects.bulk_create(history)
 
 
 def record_active_state(request, obj, form, field_name, is_initial_creation):
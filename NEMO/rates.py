@@ -1,11 +1,12 @@
 import json
+import os
 from abc import ABC, abstractmethod
 from logging import getLogger
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 
 from django.conf import settings
 
-from NEMO.models import Consumable, Tool
+from NEMO.models import Consumable, Tool, ToolFamily, get_tool_family
 
 logger = getLogger(__name__)
 
@@ -44,41 +45,86 @@ class NISTRates(Rates):
 	full_cost_rate_class = 'full cost'
 	shared_cost_rate_class = 'cost shared'
 
+	# Rates by (table_id, rate_class, item_id), and the modification time of the rates file they were loaded from.
+	rates_index: Dict[Tuple[str, str, int], float] = {}
+	rates_modified_time = None
+
+	def get_rates_file(self):
+		return getattr(settings, 'RATES_FILE', settings.MEDIA_ROOT + '/rates.json')
+
+	def get_rates_modified_time(self):
+		try:
+			return os.path.getmtime(self.get_rates_file())
+		except (AttributeError, OSError):
+			return None
+
 	def load_rates(self):
-		if not self.rates:
-			json_data = None
-			try:
-				rates_file = getattr(settings, 'RATES_FILE', settings.MEDIA_ROOT + '/rates.json')
-				json_data = open(rates_file)
-				self.rates = json.load(json_data)
-				logger.info("found rates file and loaded rates")
-			except AttributeError:
-				logger.info("no rates file, skipping loading rates")
-			except Exception as e:
-				logger.error("error loading rates")
-				logger.exception(e)
-			finally:
-				if json_data:
-					json_data.close()
+		json_data = None
+		self.rates_modified_time = self.get_rates_modified_time()
+		try:
+			json_data = open(self.get_rates_file())
+			rates = json.load(json_data)
+			rates_index = {}
+			for rate in rates:
+				# Keep the first rate when there are duplicates
+				rates_index.setdefault((rate['table_id'], rate['rate_class'], rate['item_id']), rate['rate'])
+			self.rates, self.rates_index = rates, rates_index
+			logger.info("found rates file and loaded rates")
+		except (AttributeError, FileNotFoundError):
+			self.rates, self.rates_index = None, {}
+			logger.info("no rates file, skipping loading rates")
+		except Exception as e:
+			logger.error("error loading rates")
+			logger.exception(e)
+		finally:
+			if json_data:
+				json_data.close()
+
+	def reload_rates_if_modified(self):
+		""" Loads the rates again when the rates file was uploaded or changed since they were last loaded. """
+		if self.get_rates_modified_time() != self.rates_modified_time:
+			self.load_rates()
+
+	def get_consumable_rates(self, consumables: List[Consumable]) -> Dict[str, str]:
+		self.reload_rates_if_modified()
+		if self.rates:
+			return {consumable.name: self._format_consumable_rate(consumable) for consumable in consumables}
 
 	def get_consumable_rate(self, consumable) -> str:
+		self.reload_rates_if_modified()
+		return self._format_consumable_rate(consumable)
+
+	def _format_consumable_rate(self, consumable: Consumable) -> str:
 		full_cost_rate = self._get_rate_by_table_id_and_class(consumable, self.consumable_rate_class, self.full_cost_rate_class)
 		if full_cost_rate:
 			return "Cost <b>${:0,.2f}</b>".format(full_cost_rate)
 
+	def get_tool_rates(self, tools: List[Tool]) -> Dict[str, str]:
+		""" Formats the rates of all the tools in one pass, using the tool family map to find the child tools. """
+		self.reload_rates_if_modified()
+		if self.rates:
+			family = get_tool_family()
+			return {tool.name: self._format_tool_rate(tool, family) for tool in tools}
+
 	def get_tool_rate(self, tool: Tool) -> str:
+		self.reload_rates_if_modified()
+		return self._format_tool_rate(tool, get_tool_family())
+
+	def _format_tool_rate(self, tool: Tool, family: ToolFamily) -> str:
 		full_cost_rate = self._get_rate_by_table_id_and_class(tool, self.tool_rate_class, self.full_cost_rate_class)
 		shared_cost_rate = self._get_rate_by_table_id_and_class(tool, self.tool_rate_class, self.shared_cost_rate_class)
 		if full_cost_rate or shared_cost_rate:
 			result = "Tool rates:"
-			if tool.is_parent_tool():
+			is_parent_tool = family.is_parent_tool(tool.id)
+			if is_parent_tool:
 				result += "<br> " + tool.name + ":"
 			if full_cost_rate:
 				result += " Full Cost <b>${:0,.2f}</b>".format(full_cost_rate)
 			if shared_cost_rate:
 				result += " Shared Cost <b>${:0,.2f}</b>".format(shared_cost_rate)
-			if tool.is_parent_tool():
-				for child_tool in tool.tool_children_set.all():
+			if is_parent_tool:
+				child_tools = sorted((family.get_tool(child_tool_id) for child_tool_id in family.children[tool.id]), key=lambda child_tool: child_tool.name)
+				for child_tool in child_tools:
 					child_full_cost_rate = self._get_rate_by_table_id_and_class(child_tool, self.tool_rate_class, self.full_cost_rate_class)
 					child_shared_cost_rate = self._get_rate_by_table_id_and_class(child_tool, self.tool_rate_class, self.shared_cost_rate_class)
 					if child_full_cost_rate or child_shared_cost_rate:
@@ -97,13 +143,9 @@ class NISTRates(Rates):
 					result += " Group <b>${:0,.2f}</b>".format(training_group_rate)
 			return result
 
-
 	def _get_rate_by_table_id_and_class(self, item: Union[Consumable, Tool], table_id, rate_claz) -> float:
-		if self.rates:
-			matching_rates = list(filter(lambda rate: rate['table_id'] == table_id and rate['rate_class'] == rate_claz and rate['item_id'] == item.id, self.rates))
-			if matching_rates:
-				return matching_rates[0]['rate']
+		return self.rates_index.get((table_id, rate_claz, item.id))
 
 
 rate_class = NISTRates()
-rate_class.load_rates()
\ No newline at end of file
+rate_class.load_rates()
@@ -301,6 +301,18 @@ function matcher(items, search_fields)
 	};
 }
 
+// Searches on the server instead: the URL must return the matches for the "query" parameter as {"results": [...]}
+function remote_matcher(url)
+{
+	return function find_matches(query, callback)
+	{
+		$.getJSON(url, {'query': query}, function(response)
+		{
+			callback(response['results']);
+		});
+	};
+}
+
 // This jQuery plugin integrates Twitter Typeahead directly with default parameters & search function.
 //
 // Example usage:
@@ -309,6 +321,7 @@ function matcher(items, search_fields)
 //     ... called when an item is selected ...
 // }
 // $('#search').autocomplete('fruits', on_select, [{name:'apple', id:1}, {name:'banana', id:2}, {name:'cherry', id:3}]);
+// Instead of the items to search, the URL of a server side search can be given (see remote_matcher).
 (function($)
 {
 	$.fn.autocomplete = function(dataset_name, select_callback, items_to_search)
@@ -316,7 +329,7 @@ function matcher(items, search_fields)
 		let search_fields = ['name', 'application_identifier'];
 		let datasets =
 		{
-				source: matcher(items_to_search, search_fields),
+				source: typeof items_to_search === 'string' ? remote_matcher(items_to_search) : matcher(items_to_search, search_fields),
 				name: dataset_name,
 				displayKey: 'name'
 		};
@@ -1,12 +1,195 @@
+from heapq import heappush, heappop
+from itertools import count
 from logging import getLogger
-from threading import Thread
+from queue import Queue, Full
+from threading import Thread, Lock, Condition
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
 
 postponed_tasks_logger = getLogger("NEMO.PostponedTasks")
 
 
+def get_worker_count() -> int:
+	""" Number of threads running the postponed jobs in each process. """
+	return getattr(settings, 'POSTPONED_TASKS_WORKERS', 4)
+
+
+def get_queue_size() -> int:
+	""" Maximum number of postponed jobs waiting for a thread. """
+	return getattr(settings, 'POSTPONED_TASKS_QUEUE_SIZE', 1000)
+
+
+def get_retry_count() -> int:
+	""" Number of times a failing job is tried again. """
+	return getattr(settings, 'POSTPONED_TASKS_RETRIES', 2)
+
+
+def get_retry_delay() -> float:
+	""" Number of seconds before a failing job is tried again the first time. The delay doubles with each retry. """
+	return getattr(settings, 'POSTPONED_TASKS_RETRY_DELAY', 1)
+
+
+class Job:
+	def __init__(self, function: Callable, arguments, named_arguments, retries: int, drop_when_full: bool = False):
+		self.function = function
+		self.arguments = arguments
+		self.named_arguments = named_arguments
+		self.retries = retries
+		self.drop_when_full = drop_when_full
+		self.attempts = 0
+		self.submitted = monotonic()
+
+	def __str__(self):
+		return getattr(self.function, '__qualname__', str(self.function))
+
+
+class JobExecutor:
+	"""
+	Runs jobs in a fixed number of threads, fed by a bounded queue.
+	When the queue is full, the job runs in the calling thread instead, which slows down the callers rather than dropping the job,
+	unless it was submitted with drop_when_full because it can be done later.
+	A job that raises an exception is tried again after a delay that doubles with each retry.
+	The threads close their database connections after each job, and are only started when the first job is submitted.
+	"""
+
+	def __init__(self, worker_count: int = None, queue_size: int = None):
+		self.worker_count = worker_count
+		self.queue_size = queue_size
+		self.queue: Optional[Queue] = None
+		self.threads: List[Thread] = []
+		self.lock = Lock()
+		# Jobs waiting to be tried again, as (due time, sequence, job)
+		self.retry_condition = Condition(self.lock)
+		self.retry_heap: List[Tuple[float, int, Job]] = []
+		self.sequence = count()
+		self.stopping = False
+		self.submitted = 0
+		self.completed = 0
+		self.retried = 0
+		self.failures = 0
+		self.ran_in_caller = 0
+		self.dropped = 0
+		self.total_latency = 0.0
+		self.max_latency = 0.0
+
+	def start(self):
+		with self.lock:
+			if self.queue is not None:
+				return
+			self.stopping = False
+			self.queue = Queue(self.queue_size or get_queue_size())
+			self.threads = [Thread(target=self.work, name=f"postponed_tasks_{i}", daemon=True) for i in range(self.worker_count or get_worker_count())]
+			self.threads.append(Thread(target=self.run_retries, name="postponed_tasks_retries", daemon=True))
+		for thread in self.threads:
+			thread.start()
+
+	def submit(self, function: Callable, arguments=(), named_arguments=None, retries: int = None, drop_when_full: bool = False) -> bool:
+		""" Runs the function with the arguments in the background. Returns False when the job was dropped because the queue is full. """
+		self.start()
+		job = Job(function, arguments, named_arguments or {}, get_retry_count() if retries is None else retries, drop_when_full)
+		with self.lock:
+			self.submitted += 1
+		return self.enqueue(job)
+
+	def enqueue(self, job: Job) -> bool:
+		try:
+			self.queue.put_nowait(job)
+		except Full:
+			if job.drop_when_full:
+				postponed_tasks_logger.warning(f"The postponed tasks queue is full, dropping {job}")
+				with self.lock:
+					self.dropped += 1
+				return False
+			postponed_tasks_logger.warning(f"The postponed tasks queue is full, running {job} in the calling thread")
+			with self.lock:
+				self.ran_in_caller += 1
+			self.run(job)
+		return True
+
+	def work(self):
+		while True:
+			job = self.queue.get()
+			if job is None:
+				return
+			try:
+				self.run(job)
+			finally:
+				connections.close_all()
+
+	def run(self, job: Job):
+		job.attempts += 1
+		try:
+			job.function(*job.arguments, **job.named_arguments)
+		except Exception:
+			if job.attempts <= job.retries:
+				delay = get_retry_delay() * 2 ** (job.attempts - 1)
+				postponed_tasks_logger.warning(f"{job} failed, trying again in {delay} seconds", exc_info=True)
+				with self.retry_condition:
+					self.retried += 1
+					heappush(self.retry_heap, (monotonic() + delay, next(self.sequence), job))
+					self.retry_condition.notify()
+				return
+			postponed_tasks_logger.exception(f"{job} failed after {job.attempts} attempts")
+			with self.lock:
+				self.failures += 1
+		latency = monotonic() - job.submitted
+		with self.lock:
+			self.completed += 1
+			self.total_latency += latency
+			self.max_latency = max(self.max_latency, latency)
+
+	def run_retries(self):
+		while True:
+			with self.retry_condition:
+				while not self.stopping and (not self.retry_heap or self.retry_heap[0][0] > monotonic()):
+					self.retry_condition.wait(self.retry_heap[0][0] - monotonic() if self.retry_heap else None)
+				if self.stopping:
+					return
+				due, sequence, job = heappop(self.retry_heap)
+			self.enqueue(job)
+
+	def statistics(self) -> Dict[str, float]:
+		""" Returns the queue depth, the job counts and the latencies from submission to completion (in seconds). """
+		with self.lock:
+			return {
+				'queue_depth': self.queue.qsize() if self.queue else 0,
+				'waiting_for_retry': len(self.retry_heap),
+				'submitted': self.submitted,
+				'completed': self.completed,
+				'retried': self.retried,
+				'failures': self.failures,
+				'ran_in_caller': self.ran_in_caller,
+				'dropped': self.dropped,
+				'average_latency': self.total_latency / self.completed if self.completed else 0.0,
+				'max_latency': self.max_latency,
+			}
+
+	def stop(self):
+		""" Stops the threads once the queued jobs are done. Jobs waiting to be tried again are dropped. """
+		with self.retry_condition:
+			if self.queue is None:
+				return
+			queue, threads = self.queue, self.threads
+			self.stopping = True
+			self.retry_condition.notify()
+		for i in range(len(threads) - 1):
+			queue.put(None)
+		for thread in threads:
+			thread.join()
+		with self.lock:
+			self.queue = None
+			self.threads = []
+			self.retry_heap = []
+
+
+executor = JobExecutor()
+
+
 def postpone(function):
+	""" Decorator running the function in the background with the postponed tasks executor instead of waiting for it. """
 	def decorator(*arguments, **named_arguments):
-		t = Thread(target=function, args=arguments, kwargs=named_arguments)
-		t.daemon = True
-		t.start()
+		executor.submit(function, arguments, named_arguments)
 	return decorator
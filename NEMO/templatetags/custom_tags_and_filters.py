@@ -1,6 +1,9 @@
 from datetime import timedelta
+from json import dumps
+from urllib.parse import urlencode
 
 from django import template
+from django.conf import settings
 from django.urls import reverse, NoReverseMatch
 from django.utils import timezone
 from django.utils.html import escape, format_html
@@ -55,6 +58,24 @@ def json_search_base_with_extra_fields(items_to_search, *extra_fields):
 	return mark_safe(result)
 
 
+@register.simple_tag
+def user_search_base(users, active_only=False, exclude=None):
+	"""
+	The users to search in an autocomplete box. With the SERVER_SIDE_USER_SEARCH setting, the autocomplete searches the users
+	on the server instead, and only the URL of the search is given (so the users are never loaded to render the page).
+	Otherwise this is the same as the json_search_base filter. The search parameters must match the users given.
+	"""
+	if not getattr(settings, 'SERVER_SIDE_USER_SEARCH', False):
+		return json_search_base(users)
+	parameters = {}
+	if active_only:
+		parameters['active'] = 'true'
+	if exclude is not None:
+		parameters['exclude'] = exclude
+	url = reverse('search_users') + ('?' + urlencode(parameters) if parameters else '')
+	return mark_safe(dumps(url))
+
+
 @register.simple_tag
 def navigation_url(url_name, description):
 	try:
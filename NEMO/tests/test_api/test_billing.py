@@ -1,10 +1,13 @@
+import csv
+import json
 from datetime import datetime
+from io import StringIO
 
 from django.contrib.auth.models import Permission
 from django.test import TestCase
 from django.utils import timezone
 
-from NEMO.models import User, Tool, UsageEvent, Project, Account
+from NEMO.models import User, Tool, UsageEvent, Project, Account, Consumable, ConsumableWithdraw
 from NEMO.tests.test_utilities import login_as_staff
 from NEMO.views import api
 
@@ -74,3 +77,43 @@ class BillingAPITestCase(TestCase):
 			self.assertEqual(datetime.now().date(), end.date())
 			self.assertEqual(billing_item.get(result_attribute_name), attribute_value)
 
+
+	def test_billing_stream_with_cursor(self):
+		staff_user = login_as_staff(self.client)
+		staff_user.user_permissions.add(Permission.objects.get(codename='use_billing_api'))
+		consumer = User.objects.get(username='mctest1')
+		project = Project.objects.get(name="Test Project")
+		ConsumableWithdraw.objects.create(customer=consumer, merchant=staff_user, consumable=Consumable.objects.create(name="Gloves", quantity=10, reminder_threshold=1, reminder_email="test@example.com"), quantity=2, project=project)
+		data = {
+			'start': datetime.now().strftime('%m/%d/%Y'),
+			'end': datetime.now().strftime('%m/%d/%Y'),
+			'stream': 'json',
+		}
+		response = self.client.get('/api/billing', data, follow=True)
+		self.assertEqual(response.status_code, 200)
+		everything = json.loads(b''.join(response.streaming_content))
+		self.assertEqual(len(everything['results']), 4)
+		self.assertIsNone(everything['next_cursor'])
+		self.assertEqual(sorted([item['type'] for item in everything['results']]), ['consumable', 'tool_usage', 'tool_usage', 'tool_usage'])
+
+		# Page through the same items two at a time
+		data['limit'] = 2
+		pages = []
+		while True:
+			page = json.loads(b''.join(self.client.get('/api/billing', data, follow=True).streaming_content))
+			pages.extend(page['results'])
+			if not page['next_cursor']:
+				break
+			data['cursor'] = page['next_cursor']
+		self.assertEqual(pages, everything['results'])
+
+		data['stream'] = 'csv'
+		data['cursor'] = everything['results'][0]['cursor']
+		del data['limit']
+		response = self.client.get('/api/billing', data, follow=True)
+		rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+		self.assertEqual([row['cursor'] for row in rows], [item['cursor'] for item in everything['results'][1:]])
+
+		data['cursor'] = 'not a cursor'
+		response = self.client.get('/api/billing', data, follow=True)
+		self.assertEqual(response.status_code, 400)
@@ -0,0 +1,133 @@
+from logging import getLogger
+from time import perf_counter
+from unittest import mock
+
+from django.contrib.auth.models import Permission
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from NEMO.exceptions import NoActiveProjectsForUserError, NoPhysicalAccessUserError, NoAccessiblePhysicalAccessUserError, UnavailableResourcesUserError
+from NEMO.models import User, Area, Account, Project, PhysicalAccessLevel, Resource, InterlockCardCategory, InterlockCard, Interlock, Door, AreaAccessRecord, CacheVersion, get_area_occupancy
+from NEMO.tests.test_utilities import login_as
+from NEMO.views.policy import check_policy_to_enter_any_area, check_policy_to_enter_this_area, get_area_access_profile, invalidate_area_access_profiles
+
+benchmark_logger = getLogger(__name__)
+
+
+class AreaAccessProfileTestCase(TestCase):
+
+	def setUp(self):
+		self.area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		self.user = User.objects.create(username='user', first_name='Testy', last_name='User', badge_number=1)
+		self.staff = User.objects.create(username='staff', first_name='Testy', last_name='Staff', badge_number=2, is_staff=True)
+
+	def test_policy(self):
+		self.assertRaises(NoActiveProjectsForUserError, check_policy_to_enter_any_area, self.user)
+		self.user.projects.add(Project.objects.create(name='project1', account=Account.objects.create(name='account1')))
+		self.assertRaises(NoPhysicalAccessUserError, check_policy_to_enter_any_area, self.user)
+		weekends = PhysicalAccessLevel.objects.create(name='weekends', area=self.area, schedule=PhysicalAccessLevel.Schedule.WEEKENDS)
+		self.user.physical_access_levels.add(weekends)
+		check_policy_to_enter_any_area(self.user)
+		with mock.patch.object(PhysicalAccessLevel, 'schedule_is_accessible', return_value=False):
+			self.assertRaises(NoAccessiblePhysicalAccessUserError, check_policy_to_enter_this_area, self.area, self.user)
+		weekends.schedule = PhysicalAccessLevel.Schedule.ALWAYS
+		weekends.save()
+		check_policy_to_enter_this_area(self.area, self.user)
+		resource = Resource.objects.create(name='Air', available=False)
+		resource.dependent_areas.add(self.area)
+		self.assertRaises(UnavailableResourcesUserError, check_policy_to_enter_this_area, self.area, self.user)
+
+	def test_staff_access(self):
+		self.staff.projects.add(Project.objects.create(name='project1', account=Account.objects.create(name='account1')))
+		self.assertRaises(NoPhysicalAccessUserError, check_policy_to_enter_any_area, self.staff)
+		PhysicalAccessLevel.objects.create(name='staff', area=self.area, schedule=PhysicalAccessLevel.Schedule.ALWAYS, allow_staff_access=True)
+		check_policy_to_enter_any_area(self.staff)
+		check_policy_to_enter_this_area(self.area, self.staff)
+		# Only staff are exempt from being granted explicit access
+		self.user.projects.add(self.staff.projects.first())
+		self.assertRaises(NoPhysicalAccessUserError, check_policy_to_enter_any_area, self.user)
+
+
+class AreaAccessProfileCacheTestCase(TransactionTestCase):
+
+	# The version changed by another process is read again right away
+	@override_settings(CACHE_VERSION_MAX_AGE=0)
+	def test_access_revoked_by_another_process_applies_right_away(self):
+		area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		user.projects.add(Project.objects.create(name='project1', account=Account.objects.create(name='account1')))
+		user.physical_access_levels.add(PhysicalAccessLevel.objects.create(name='cleanroom access', area=area, schedule=PhysicalAccessLevel.Schedule.ALWAYS))
+		check_policy_to_enter_this_area(area, user)
+		# Revoked by another process: the database changes but the signals are not received here
+		User.physical_access_levels.through.objects.filter(user=user).delete()
+		self.assertTrue(get_area_access_profile(user).has_physical_access())
+		CacheVersion.objects.filter(name='area_access_profile').update(version='changed')
+		self.assertRaises(NoAccessiblePhysicalAccessUserError, check_policy_to_enter_this_area, area, user)
+
+	@override_settings(CACHE_VERSION_MAX_AGE=60)
+	def test_version_changes_once_the_transaction_is_committed(self):
+		user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		get_area_access_profile(user)
+		version = CacheVersion.objects.get(name='area_access_profile').version
+		with transaction.atomic():
+			user.physical_access_levels.add(PhysicalAccessLevel.objects.create(name='cleanroom access', area=Area.objects.create(name='Cleanroom', welcome_message='Welcome'), schedule=PhysicalAccessLevel.Schedule.ALWAYS))
+			# The new profile is seen inside the transaction, but not published to the other processes yet
+			self.assertTrue(get_area_access_profile(user).has_physical_access())
+			self.assertEqual(CacheVersion.objects.get(name='area_access_profile').version, version)
+		self.assertNotEqual(CacheVersion.objects.get(name='area_access_profile').version, version)
+		self.assertTrue(get_area_access_profile(user).has_physical_access())
+
+
+# The versions changed by other processes are not read again while the swipes run, so the query counts are the same every time
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class BadgeSwipeBenchmarkTestCase(TransactionTestCase):
+	user_count = 20
+
+	def setUp(self):
+		category, created = InterlockCardCategory.objects.get_or_create(key='stanford', defaults={'name': 'Stanford'})
+		card = InterlockCard.objects.create(server='server.com', port=80, number=1, even_port=1, odd_port=2, category=category)
+		area = Area.objects.create(name='Cleanroom', welcome_message='Welcome', maximum_capacity=self.user_count)
+		self.door = Door.objects.create(name='test_door', area=area, interlock=Interlock.objects.create(card=card, channel=1))
+		access = PhysicalAccessLevel.objects.create(name='cleanroom access', area=area, schedule=PhysicalAccessLevel.Schedule.ALWAYS)
+		Resource.objects.create(name='Air').dependent_areas.add(area)
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		self.users = []
+		for i in range(self.user_count):
+			user = User.objects.create(username=f'user{i}', first_name='Testy', last_name=f'User{i}', badge_number=100 + i)
+			user.projects.add(project)
+			user.physical_access_levels.add(access)
+			self.users.append(user)
+		tablet = User.objects.create(username='tablet', first_name='Door', last_name='Tablet')
+		tablet.user_permissions.add(Permission.objects.get(codename='add_areaaccessrecord'))
+		login_as(self.client, tablet)
+
+	def swipe_everybody(self, invalidate):
+		# Both runs start with the occupancy loaded
+		get_area_occupancy()
+		if not invalidate:
+			for user in self.users:
+				get_area_access_profile(user)
+		with CaptureQueriesContext(connection) as queries:
+			begin = perf_counter()
+			for user in self.users:
+				if invalidate:
+					invalidate_area_access_profiles()
+				response = self.client.post(reverse('login_to_area', args=[self.door.id]), {'badge_number': user.badge_number})
+				self.assertContains(response, "You're logged in to the ")
+			elapsed = perf_counter() - begin
+		AreaAccessRecord.objects.all().delete()
+		return len(queries) / self.user_count, 1000 * elapsed / self.user_count
+
+	@mock.patch('NEMO.apps.area_access.views.unlock_door')
+	def test_benchmark_swipe_to_unlock(self, unlock_door):
+		results = {
+			'profile loaded': self.swipe_everybody(invalidate=True),
+			'profile cached': self.swipe_everybody(invalidate=False),
+		}
+		for name, (query_count, latency) in results.items():
+			benchmark_logger.debug(f"badge swipe, {name}: {query_count:.1f} queries, {latency:.2f} ms per swipe")
+		self.assertEqual(unlock_door.call_count, 2 * self.user_count)
+		# The three queries loading the profile, and the new version written by the invalidation and read again
+		self.assertAlmostEqual(results['profile loaded'][0] - results['profile cached'][0], 5)
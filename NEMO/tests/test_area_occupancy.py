@@ -0,0 +1,107 @@
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from NEMO.exceptions import MaximumCapacityReachedError
+from NEMO.models import User, Area, Account, Project, AreaAccessRecord, StaffCharge, PhysicalAccessLevel, CacheVersion, get_area_occupancy, invalidate_area_occupancy
+from NEMO.views.policy import check_policy_to_enter_this_area
+
+
+class AreaOccupancyTestCase(TestCase):
+
+	def setUp(self):
+		self.cleanroom = Area.objects.create(name='Cleanroom', welcome_message='Welcome', maximum_capacity=2)
+		self.lab = Area.objects.create(name='Lab', welcome_message='Welcome')
+		self.project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		self.users = [User.objects.create(username=f'user{i}', first_name='Testy', last_name=f'User{i}') for i in range(3)]
+		self.staff = User.objects.create(username='staff', first_name='Testy', last_name='Staff', is_staff=True)
+
+	def test_occupancy(self):
+		self.assertFalse(self.users[0].in_area())
+		self.assertIsNone(self.users[0].area_access_record())
+		record = AreaAccessRecord.objects.create(area=self.cleanroom, customer=self.users[0], project=self.project)
+		AreaAccessRecord.objects.create(area=self.lab, customer=self.users[1], project=self.project)
+		# Area access charged to a staff member doesn't count
+		staff_charge = StaffCharge.objects.create(staff_member=self.staff, customer=self.users[2], project=self.project)
+		AreaAccessRecord.objects.create(area=self.cleanroom, customer=self.users[2], project=self.project, staff_charge=staff_charge)
+		self.assertTrue(self.users[0].in_area())
+		self.assertEqual(self.users[0].area_access_record(), record)
+		self.assertFalse(self.users[2].in_area())
+		self.assertEqual(get_area_occupancy().get_count(self.cleanroom.id), 1)
+		self.assertEqual(get_area_occupancy().get_count(self.lab.id), 1)
+		record.end = timezone.now()
+		record.save()
+		self.assertFalse(self.users[0].in_area())
+		self.assertEqual(get_area_occupancy().get_count(self.cleanroom.id), 0)
+
+	def test_maximum_capacity(self):
+		access = PhysicalAccessLevel.objects.create(name='cleanroom access', area=self.cleanroom, schedule=PhysicalAccessLevel.Schedule.ALWAYS)
+		for user in self.users:
+			user.physical_access_levels.add(access)
+		for user in self.users[:2]:
+			check_policy_to_enter_this_area(self.cleanroom, user)
+			AreaAccessRecord.objects.create(area=self.cleanroom, customer=user, project=self.project)
+		self.assertRaises(MaximumCapacityReachedError, check_policy_to_enter_this_area, self.cleanroom, self.users[2])
+		AreaAccessRecord.objects.filter(customer=self.users[0]).delete()
+		check_policy_to_enter_this_area(self.cleanroom, self.users[2])
+
+
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class AreaOccupancyCacheTestCase(TransactionTestCase):
+
+	def test_occupancy_is_cached_until_a_record_changes(self):
+		invalidate_area_occupancy()
+		area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		self.assertFalse(user.in_area())
+		with CaptureQueriesContext(connection) as queries:
+			self.assertFalse(user.in_area())
+			self.assertIsNone(user.area_access_record())
+			self.assertEqual(get_area_occupancy().get_count(area.id), 0)
+		self.assertEqual(len(queries), 0)
+		record = AreaAccessRecord.objects.create(area=area, customer=user, project=project)
+		self.assertTrue(user.in_area())
+		with CaptureQueriesContext(connection) as queries:
+			self.assertTrue(user.in_area())
+			self.assertEqual(get_area_occupancy().get_count(area.id), 1)
+		self.assertEqual(len(queries), 0)
+		record.delete()
+		self.assertFalse(user.in_area())
+
+	def test_version_changes_once_the_transaction_is_committed(self):
+		area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		self.assertFalse(user.in_area())
+		version = CacheVersion.objects.get(name='area_occupancy').version
+		with transaction.atomic():
+			with CaptureQueriesContext(connection) as queries:
+				AreaAccessRecord.objects.create(area=area, customer=user, project=project)
+			# The row of the version isn't locked by the transaction
+			self.assertFalse([query for query in queries if '"NEMO_cacheversion"' in query['sql']])
+			# The transaction sees its own record
+			self.assertTrue(user.in_area())
+			self.assertEqual(CacheVersion.objects.get(name='area_occupancy').version, version)
+		self.assertNotEqual(CacheVersion.objects.get(name='area_occupancy').version, version)
+		self.assertTrue(user.in_area())
+		try:
+			with transaction.atomic():
+				AreaAccessRecord.objects.filter(customer=user).delete()
+				self.assertFalse(user.in_area())
+				raise ValueError('rolled back')
+		except ValueError:
+			pass
+		self.assertTrue(user.in_area())
+
+	@override_settings(CACHE_VERSION_MAX_AGE=0)
+	def test_records_saved_by_another_process_are_seen(self):
+		area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		self.assertFalse(user.in_area())
+		# Saved by another process: the database changes but the signals are not received here
+		AreaAccessRecord.objects.bulk_create([AreaAccessRecord(area=area, customer=user, project=project, start=timezone.now())])
+		CacheVersion.objects.filter(name='area_occupancy').update(version='changed')
+		self.assertTrue(user.in_area())
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, Tool, Reservation, UsageEvent, AreaAccessRecord, Area, Account, Project, ScheduledOutage, StaffCharge
+from NEMO.tests.test_utilities import login_as_user, login_as_staff
+
+
+class EventFeedTestCase(TestCase):
+
+	def setUp(self):
+		self.owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		self.tool = Tool.objects.create(name='test_tool', primary_owner=self.owner)
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		self.area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		self.start = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+	def feed(self, event_type, **parameters):
+		parameters.update({'event_type': event_type, 'start': (self.start - timedelta(days=7)).strftime('%Y-%m-%d'), 'end': (self.start + timedelta(days=7)).strftime('%Y-%m-%d')})
+		return reverse('event_feed') + '?' + '&'.join(f'{key}={value}' for key, value in parameters.items())
+
+	def create_reservations(self, user, count):
+		for i in range(count):
+			start = self.start + timedelta(hours=i)
+			Reservation.objects.create(tool=self.tool, user=user, creator=user, start=start, end=start + timedelta(minutes=30), short_notice=False)
+
+	def test_reservation_feed(self):
+		user = login_as_user(self.client)
+		self.create_reservations(user, 2)
+		self.create_reservations(self.owner, 1)
+		ScheduledOutage.objects.create(title="Outage", tool=self.tool, start=self.start, end=self.start + timedelta(hours=1), creator=self.owner)
+		response = self.client.get(self.feed('reservations', tool_id=self.tool.id))
+		self.assertEqual(response.status_code, 200)
+		events = response.json()
+		self.assertEqual(len(events), 4)
+		reservations = [event for event in events if event['id'].startswith('Reservation')]
+		self.assertEqual(len([event for event in reservations if event.get('editable')]), 2)
+		self.assertTrue(all(event['title'] in [str(user), str(self.owner)] for event in reservations))
+		outage = next(event for event in events if event['id'].startswith('Outage'))
+		self.assertEqual(outage['color'], '#ff0000')
+		self.assertFalse('editable' in outage)
+
+		response = self.client.get(self.feed('reservations', personal_schedule='true'))
+		self.assertEqual([event['title'] for event in response.json()], ['test_tool', 'test_tool'])
+
+	def test_usage_and_specific_user_feeds(self):
+		staff = login_as_staff(self.client)
+		UsageEvent.objects.create(user=self.owner, operator=staff, project=self.project, tool=self.tool, start=self.start, end=self.start + timedelta(minutes=5))
+		staff_charge = StaffCharge.objects.create(staff_member=staff, customer=self.owner, project=self.project)
+		AreaAccessRecord.objects.create(area=self.area, customer=self.owner, project=self.project, start=self.start, staff_charge=staff_charge)
+		Reservation.objects.create(tool=self.tool, user=self.owner, creator=self.owner, start=self.start, end=self.start + timedelta(hours=1), short_notice=False, title='Etching')
+		Reservation.objects.create(tool=self.tool, user=self.owner, creator=self.owner, start=self.start - timedelta(hours=2), end=self.start - timedelta(hours=1), short_notice=False, missed=True)
+
+		events = self.client.get(self.feed('nanofab usage', tool_id=self.tool.id)).json()
+		self.assertEqual(sorted(event['title'] for event in events), [f"Missed reservation by {self.owner}", f"{staff} on behalf of {self.owner}"])
+		usage = next(event for event in events if 'behalf' in event['title'])
+		# Short usage events are lengthened so they can be seen on the calendar
+		self.assertEqual(usage['end'], timezone.localtime(self.start + timedelta(minutes=15)).isoformat())
+
+		events = self.client.get(self.feed('specific user', user=self.owner.id)).json()
+		self.assertEqual(sorted(event['title'] for event in events), sorted([
+			"Usage of the test_tool",
+			f"Cleanroom access billed to project project1 by {staff}",
+			'Reservation for the test_tool, titled "Etching"',
+			"Missed reservation for the test_tool",
+		]))
+
+	def test_feed_query_count_does_not_depend_on_event_count(self):
+		user = login_as_user(self.client)
+		self.create_reservations(user, 2)
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(self.feed('reservations', tool_id=self.tool.id))
+		self.create_reservations(self.owner, 20)
+		with CaptureQueriesContext(connection) as more_events_queries:
+			response = self.client.get(self.feed('reservations', tool_id=self.tool.id))
+		self.assertEqual(len(response.json()), 22)
+		self.assertEqual(len(queries), len(more_events_queries))
+
+	def test_unchanged_feed_is_not_modified(self):
+		user = login_as_user(self.client)
+		self.create_reservations(user, 3)
+		url = self.feed('reservations', tool_id=self.tool.id)
+		response = self.client.get(url)
+		etag = response['ETag']
+		self.assertTrue(etag.startswith('"'))
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response.content, b'')
+		Reservation.objects.filter(user=user).first().delete()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		self.assertEqual(len(response.json()), 2)
+
+	def test_feed_is_modified_when_a_displayed_name_changes(self):
+		login_as_staff(self.client)
+		self.create_reservations(self.owner, 1)
+		url = self.feed('reservations', tool_id=self.tool.id)
+		etag = self.client.get(url)['ETag']
+		self.owner.first_name = 'Renamed'
+		self.owner.save()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('Renamed', response.json()[0]['title'])
+
+	def test_feed_with_usage_in_progress_is_not_modified(self):
+		staff = login_as_staff(self.client)
+		usage = UsageEvent.objects.create(user=self.owner, operator=staff, project=self.project, tool=self.tool, start=self.start)
+		url = self.feed('nanofab usage', tool_id=self.tool.id)
+		with mock.patch('NEMO.views.calendar.timezone.now', return_value=self.start + timedelta(minutes=20)):
+			etag = self.client.get(url)['ETag']
+			self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		usage.end = self.start + timedelta(minutes=30)
+		usage.save()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()[0]['end'], timezone.localtime(usage.end).isoformat())
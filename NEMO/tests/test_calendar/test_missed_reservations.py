@@ -0,0 +1,119 @@
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, Tool, Reservation, UsageEvent, Account, Project, ScheduledOutage, Resource, TimedServiceRun
+from NEMO.tests.test_utilities import login_as_user_with_permissions
+from NEMO.views.calendar import missed_reservation_service_name, mark_missed_reservations
+from NEMO.views.customization import store_media_file
+
+
+class MissedReservationTestCase(TestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+		self.media_settings.enable()
+		store_media_file(ContentFile('Missed reservation for {{ reservation.tool }}'), 'missed_reservation_email.html')
+		self.owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester', email='mctest@example.org')
+		self.staff = User.objects.create(username='staff', first_name='Staff', last_name='Member', is_staff=True)
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		self.now = timezone.now()
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def create_tool(self, name, threshold=15) -> Tool:
+		return Tool.objects.create(name=name, primary_owner=self.owner, _operational=True, _missed_reservation_threshold=threshold)
+
+	def reserve(self, tool, minutes_ago, user=None) -> Reservation:
+		user = user or self.owner
+		start = self.now - timedelta(minutes=minutes_ago)
+		return Reservation.objects.create(tool=tool, user=user, creator=user, start=start, end=start + timedelta(hours=1), short_notice=False)
+
+	def assert_missed(self, reservation, missed=True):
+		reservation.refresh_from_db()
+		self.assertEqual(reservation.missed, missed, reservation.tool.name)
+
+	def test_missed_reservations_since_the_last_run(self):
+		unused_tool = self.create_tool('unused_tool')
+		used_tool = self.create_tool('used_tool')
+		child_tool = Tool.objects.create(name='child_tool', parent_tool=used_tool, visible=False)
+		busy_tool = self.create_tool('busy_tool')
+		outage_tool = self.create_tool('outage_tool')
+		resource_tool = self.create_tool('resource_tool')
+		missed = self.reserve(unused_tool, 20)
+		too_early = self.reserve(unused_tool, 10)
+		already_checked = self.reserve(unused_tool, 40)
+		staff_reservation = self.reserve(self.create_tool('staff_tool'), 20, self.staff)
+		used = self.reserve(used_tool, 20)
+		busy = self.reserve(busy_tool, 20)
+		outage = self.reserve(outage_tool, 20)
+		unavailable_resource = self.reserve(resource_tool, 20)
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=child_tool, start=self.now - timedelta(minutes=25), end=self.now - timedelta(minutes=5))
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=busy_tool, start=self.now - timedelta(hours=2))
+		ScheduledOutage.objects.create(title="Outage", tool=outage_tool, start=self.now - timedelta(minutes=5), end=self.now + timedelta(hours=1), creator=self.owner)
+		Resource.objects.create(name='power', available=False).fully_dependent_tools.add(resource_tool)
+
+		# The last run was ten minutes ago, the reservations that reached the threshold since then are caught up
+		self.assertEqual(mark_missed_reservations(self.now - timedelta(minutes=10), self.now), [missed])
+		self.assert_missed(missed)
+		for reservation in [too_early, already_checked, staff_reservation, used, busy, outage, unavailable_resource]:
+			self.assert_missed(reservation, False)
+
+	def test_usage_of_a_tool_counts_for_every_reservation_of_its_family(self):
+		parent_tool = self.create_tool('parent_tool')
+		child_tool = Tool.objects.create(name='child_tool', parent_tool=parent_tool, _operational=True, _missed_reservation_threshold=15)
+		parent_reservation = self.reserve(parent_tool, 20)
+		child_reservation = self.reserve(child_tool, 20)
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=child_tool, start=self.now - timedelta(minutes=10), end=self.now - timedelta(minutes=5))
+		self.assertEqual(mark_missed_reservations(self.now - timedelta(minutes=10), self.now), [])
+		self.assert_missed(parent_reservation, False)
+		self.assert_missed(child_reservation, False)
+
+	def test_outages_and_resources_of_the_parent_tool_count_for_its_children(self):
+		outage_tool = self.create_tool('outage_tool')
+		resource_tool = self.create_tool('resource_tool')
+		outage = self.reserve(Tool.objects.create(name='outage_child_tool', parent_tool=outage_tool, _operational=True, _missed_reservation_threshold=15), 20)
+		unavailable_resource = self.reserve(Tool.objects.create(name='resource_child_tool', parent_tool=resource_tool, _operational=True, _missed_reservation_threshold=15), 20)
+		ScheduledOutage.objects.create(title="Outage", tool=outage_tool, start=self.now - timedelta(minutes=5), end=self.now + timedelta(hours=1), creator=self.owner)
+		Resource.objects.create(name='power', available=False).fully_dependent_tools.add(resource_tool)
+		self.assertEqual(mark_missed_reservations(self.now - timedelta(minutes=10), self.now), [])
+		self.assert_missed(outage, False)
+		self.assert_missed(unavailable_resource, False)
+
+	def test_query_count_does_not_depend_on_tools(self):
+		for i in range(2):
+			self.reserve(self.create_tool(f'tool_{i}'), 20)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(len(mark_missed_reservations(self.now - timedelta(minutes=10), self.now)), 2)
+		for i in range(2, 12):
+			self.reserve(self.create_tool(f'tool_{i}'), 20)
+		with CaptureQueriesContext(connection) as more_tools_queries:
+			self.assertEqual(len(mark_missed_reservations(self.now - timedelta(minutes=10), self.now)), 10)
+		self.assertEqual(len(queries), len(more_tools_queries))
+
+	def test_runs_catch_up_from_the_last_run(self):
+		login_as_user_with_permissions(self.client, ['trigger_timed_services'])
+		reservation = self.reserve(self.create_tool('test_tool'), 15)
+		# The last run is kept in the database, so it is shared by all the processes
+		TimedServiceRun.objects.create(name=missed_reservation_service_name, last_run=self.now - timedelta(minutes=30))
+		response = self.client.get(reverse('cancel_unused_reservations'))
+		self.assertEqual(response.status_code, 200)
+		self.assert_missed(reservation)
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertEqual(mail.outbox[0].body, 'Missed reservation for test_tool')
+		last_run = TimedServiceRun.objects.get(name=missed_reservation_service_name).last_run
+		self.assertGreaterEqual(last_run, self.now)
+
+		self.client.get(reverse('cancel_unused_reservations'))
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertGreater(TimedServiceRun.objects.get(name=missed_reservation_service_name).last_run, last_run)
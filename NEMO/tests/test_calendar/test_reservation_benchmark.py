@@ -0,0 +1,106 @@
+from datetime import timedelta
+from logging import getLogger
+from time import perf_counter
+
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from NEMO.models import User, Tool, ScheduledOutage, Reservation, Account, Project
+from NEMO.views.policy import ReservationConflictIndex, check_policy_to_save_reservation
+
+benchmark_logger = getLogger(__name__)
+
+
+def per_rule_conflicts(new_reservation, user, buffer_time):
+	""" The conflict and quota checks as they were done before the interval index: one query per policy rule. """
+	tool = new_reservation.tool
+	start_of_day = new_reservation.start.replace(hour=0, minute=0, second=0, microsecond=0)
+	coincident = Reservation.objects.filter(tool=tool, cancelled=False, missed=False, shortened=False)
+	coincident = coincident.exclude(start__lt=new_reservation.start, end__lte=new_reservation.start)
+	coincident = coincident.exclude(start__gte=new_reservation.end, end__gt=new_reservation.end)
+	outages = ScheduledOutage.objects.filter(Q(tool=tool) | Q(resource__fully_dependent_tools__in=[tool]))
+	outages = outages.exclude(start__lt=new_reservation.start, end__lte=new_reservation.start)
+	outages = outages.exclude(start__gte=new_reservation.end, end__gt=new_reservation.end)
+	per_day = Reservation.objects.filter(cancelled=False, shortened=False, start__gte=start_of_day, end__lte=start_of_day + timedelta(days=1), user=user, tool=tool)
+	ends_too_close = Reservation.objects.filter(cancelled=False, shortened=False, user=user, end__gt=new_reservation.start - buffer_time, start__lt=new_reservation.start, tool=tool)
+	begins_too_close = Reservation.objects.filter(cancelled=False, shortened=False, user=user, start__lt=new_reservation.end + buffer_time, end__gt=new_reservation.start, tool=tool)
+	future_time = timedelta()
+	for r in Reservation.objects.filter(cancelled=False, user=user, tool=tool, start__gte=timezone.now()):
+		future_time += r.duration()
+	return coincident.count() > 0, outages.count() > 0, per_day.count(), ends_too_close.exists(), begins_too_close.exists(), future_time
+
+
+def indexed_conflicts(new_reservation, user, buffer_time):
+	index = ReservationConflictIndex(new_reservation, user)
+	return index.coincident_reservation_exists(), index.coincident_outage_exists(), index.user_reservation_count_for_the_day(), index.user_reservation_ends_too_close(buffer_time), index.user_reservation_begins_too_close(buffer_time), index.user_future_reserved_time()
+
+
+class ReservationConflictIndexTestCase(TestCase):
+	reservation_count = 200
+
+	def setUp(self):
+		self.staff = User.objects.create(username='staff', first_name='Staff', last_name='Member', is_staff=True)
+		self.consumer = User.objects.create(username='jsmith', first_name='John', last_name='Smith', training_required=False)
+		self.other = User.objects.create(username='jdoe', first_name='Jane', last_name='Doe', training_required=False)
+		self.tool = Tool.objects.create(name='busy_tool', primary_owner=self.staff, _minimum_time_between_reservations=30, _maximum_reservations_per_day=3, _maximum_future_reservation_time=600, _reservation_horizon=None)
+		project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		for user in [self.consumer, self.other]:
+			user.qualifications.add(self.tool)
+			user.projects.add(project)
+		# A busy tool: back to back one hour reservations alternating between two users, some of them missed or shortened.
+		self.base_start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+		reservations = []
+		for i in range(self.reservation_count):
+			start = self.base_start + timedelta(hours=2 * i)
+			user = self.consumer if i % 2 else self.other
+			reservations.append(Reservation(tool=self.tool, user=user, creator=user, start=start, end=start + timedelta(hours=1), short_notice=False, missed=i % 7 == 0, shortened=i % 11 == 0))
+		Reservation.objects.bulk_create(reservations)
+		outage_start = self.base_start + timedelta(hours=11)
+		ScheduledOutage.objects.create(title="Outage", tool=self.tool, start=outage_start, end=outage_start + timedelta(hours=2), creator=self.staff)
+
+	def proposed_reservations(self):
+		for offset in range(0, 48, 1):
+			for length in [30, 60, 180]:
+				start = self.base_start + timedelta(minutes=30 * offset)
+				yield Reservation(tool=self.tool, user=self.consumer, creator=self.consumer, start=start, end=start + timedelta(minutes=length), short_notice=False)
+
+	def test_same_answers_as_per_rule_queries(self):
+		buffer_time = timedelta(minutes=self.tool.minimum_time_between_reservations)
+		for new_reservation in self.proposed_reservations():
+			self.assertEqual(indexed_conflicts(new_reservation, self.consumer, buffer_time), per_rule_conflicts(new_reservation, self.consumer, buffer_time))
+
+	def test_cancelled_reservation_is_excluded(self):
+		reservation = Reservation.objects.filter(user=self.consumer, missed=False, shortened=False).order_by('start').first()
+		moved = Reservation(tool=self.tool, user=self.consumer, creator=self.consumer, start=reservation.start + timedelta(minutes=15), end=reservation.end + timedelta(minutes=15), short_notice=False)
+		self.assertTrue(ReservationConflictIndex(moved, self.consumer).coincident_reservation_exists())
+		self.assertFalse(ReservationConflictIndex(moved, self.consumer, reservation).coincident_reservation_exists())
+
+	def test_benchmark_query_count_and_latency(self):
+		buffer_time = timedelta(minutes=self.tool.minimum_time_between_reservations)
+		proposed = list(self.proposed_reservations())
+		results = {}
+		for name, check in [('per rule queries', per_rule_conflicts), ('interval index', indexed_conflicts)]:
+			with CaptureQueriesContext(connection) as queries:
+				begin = perf_counter()
+				for new_reservation in proposed:
+					check(new_reservation, self.consumer, buffer_time)
+				elapsed = perf_counter() - begin
+			results[name] = (len(queries) / len(proposed), 1000 * elapsed / len(proposed))
+		for name, (query_count, latency) in results.items():
+			benchmark_logger.debug(f"{name}: {query_count:.1f} queries, {latency:.2f} ms per reservation check ({self.reservation_count} reservations)")
+		self.assertEqual(results['interval index'][0], 2)
+		self.assertLess(results['interval index'][0], results['per rule queries'][0])
+
+	def test_policy_check_query_count_does_not_depend_on_future_reservations(self):
+		start = self.base_start + timedelta(hours=3)
+		new_reservation = Reservation(tool=self.tool, user=self.consumer, creator=self.consumer, start=start, end=start + timedelta(minutes=30), short_notice=False)
+		with CaptureQueriesContext(connection) as queries:
+			policy_problems, overridable = check_policy_to_save_reservation(None, new_reservation, self.consumer, False)
+		self.assertTrue("You may only reserve up to 600 minutes of time on this tool, starting from the current time onward." in policy_problems)
+		Reservation.objects.filter(user=self.consumer, start__gt=self.base_start + timedelta(days=2)).delete()
+		with CaptureQueriesContext(connection) as fewer_reservations_queries:
+			check_policy_to_save_reservation(None, new_reservation, self.consumer, False)
+		self.assertEqual(len(queries), len(fewer_reservations_queries))
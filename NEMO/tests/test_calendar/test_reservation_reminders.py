@@ -0,0 +1,136 @@
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from NEMO.models import Account, Project, Reservation, Resource, Task, Tool, User
+from NEMO.email_delivery import deliver
+from NEMO.views.calendar import send_reservation_reminders
+from NEMO.views.customization import get_media_file_template, store_media_file
+
+
+class ReservationReminderTestCase(TestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+		self.media_settings.enable()
+		store_media_file(ContentFile('Reminder for {{ reservation.tool }}'), 'reservation_reminder_email.html')
+		store_media_file(ContentFile('Warning for {{ reservation.tool }}'), 'reservation_warning_email.html')
+		self.user = User.objects.create(username='mctest', first_name='Testy', last_name='McTester', email='mctest@example.org')
+		self.project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		self.now = timezone.now()
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def reserve(self, tool, minutes_from_now, made_minutes_before=1440) -> Reservation:
+		start = self.now + timedelta(minutes=minutes_from_now)
+		return Reservation.objects.create(tool=tool, user=self.user, creator=self.user, project=self.project, creation_time=start - timedelta(minutes=made_minutes_before), start=start, end=start + timedelta(hours=1), short_notice=False)
+
+	def send_reminders(self, minutes_later=0):
+		return send_reservation_reminders(self.now + timedelta(minutes=minutes_later), get_media_file_template('reservation_reminder_email.html'), get_media_file_template('reservation_warning_email.html'))
+
+	def test_reminders_are_sent_once(self):
+		tool = Tool.objects.create(name='test_tool', _operational=True)
+		upcoming = self.reserve(tool, 100)
+		later = self.reserve(tool, 150)
+		just_made = self.reserve(tool, 60, made_minutes_before=30)
+		self.send_reminders()
+		self.assertEqual([message.subject for message in mail.outbox], ['test_tool reservation reminder'])
+		upcoming.refresh_from_db()
+		self.assertIsNotNone(upcoming.reminder_sent)
+		self.send_reminders()
+		self.assertEqual(len(mail.outbox), 1)
+		# A run later catches up on the reservation that entered the window in the meantime
+		self.send_reminders(minutes_later=45)
+		self.assertEqual(len(mail.outbox), 2)
+		later.refresh_from_db()
+		just_made.refresh_from_db()
+		self.assertIsNotNone(later.reminder_sent)
+		self.assertIsNone(just_made.reminder_sent)
+
+	def test_overlapping_run_does_not_send_the_claimed_reminders(self):
+		self.reserve(Tool.objects.create(name='test_tool', _operational=True), 100)
+		overlapping_reports = []
+
+		def deliver_during_an_overlapping_run(messages, description, progress):
+			if mocked_deliver.call_count == 1:
+				overlapping_reports.append(self.send_reminders())
+			return deliver(messages, description, progress=progress)
+
+		with mock.patch('NEMO.views.calendar.deliver', side_effect=deliver_during_an_overlapping_run) as mocked_deliver:
+			self.send_reminders()
+		self.assertEqual(overlapping_reports[0].sent, 0)
+		self.assertEqual(len(mail.outbox), 1)
+
+	@override_settings(EMAIL_BATCH_SIZE=1)
+	def test_failed_reminder_is_sent_by_the_next_run(self):
+		tool = Tool.objects.create(name='test_tool', _operational=True)
+		upcoming = self.reserve(tool, 100)
+		with mock.patch.object(EmailBackend, 'send_messages', side_effect=SMTPRecipientsRefused({})):
+			self.assertEqual(self.send_reminders().failed, 1)
+		upcoming.refresh_from_db()
+		self.assertIsNone(upcoming.reminder_sent)
+		self.assertEqual(self.send_reminders().sent, 1)
+		self.assertEqual(len(mail.outbox), 1)
+
+	def test_only_the_failed_reminders_are_sent_by_the_next_run(self):
+		tool = Tool.objects.create(name='test_tool', _operational=True)
+		sent = self.reserve(tool, 100)
+		refused = self.reserve(tool, 110)
+		refused.user = User.objects.create(username='refused', first_name='Testy', last_name='Refused', email='refused@example.org')
+		refused.save()
+		send_messages = EmailBackend.send_messages
+
+		def refuse(backend, messages):
+			if 'refused@example.org' in messages[0].recipients():
+				raise SMTPRecipientsRefused({})
+			return send_messages(backend, messages)
+
+		with mock.patch.object(EmailBackend, 'send_messages', autospec=True, side_effect=refuse):
+			report = self.send_reminders()
+		self.assertEqual((report.sent, report.failed, report.batches), (1, 1, 1))
+		sent.refresh_from_db()
+		refused.refresh_from_db()
+		self.assertIsNotNone(sent.reminder_sent)
+		self.assertIsNone(refused.reminder_sent)
+		self.assertEqual(self.send_reminders().sent, 1)
+		self.assertEqual([message.to for message in mail.outbox], [['mctest@example.org'], ['refused@example.org']])
+
+	def test_tool_health(self):
+		# Creates the lock
+		self.send_reminders()
+		healthy = Tool.objects.create(name='healthy', _operational=True)
+		broken = Tool.objects.create(name='broken', _operational=False)
+		problematic = Tool.objects.create(name='problematic', _operational=True)
+		Task.objects.create(tool=problematic, urgency=Task.Urgency.NORMAL, force_shutdown=False, safety_hazard=False, creator=self.user)
+		child = Tool.objects.create(name='child', parent_tool=problematic, visible=False)
+		degraded = Tool.objects.create(name='degraded', _operational=True)
+		Resource.objects.create(name='nitrogen', available=False).partially_dependent_tools.add(degraded)
+		missing_resource = Tool.objects.create(name='missing_resource', _operational=True)
+		Resource.objects.create(name='power', available=False).fully_dependent_tools.add(missing_resource)
+		for tool in [healthy, broken, problematic, child, degraded, missing_resource]:
+			self.reserve(tool, 100)
+		with CaptureQueriesContext(connection) as queries:
+			self.send_reminders()
+		subjects = sorted(message.subject for message in mail.outbox)
+		self.assertEqual(subjects, [
+			'broken reservation problem',
+			'child reservation warning',
+			'degraded reservation warning',
+			'healthy reservation reminder',
+			'missing_resource reservation problem',
+			'problematic reservation warning',
+		])
+		# The lock, the reservations, claiming them, the tool health and the customization, however many reminders are sent
+		self.assertLessEqual(len(queries), 11)
@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, Tool, Account, Project, UsageEvent, Configuration, ConfigurationHistory
+from NEMO.tests.test_utilities import login_as
+from NEMO.views.tool_control import get_tool_full_config_history
+from NEMO.widgets.configuration_editor import ConfigurationEditorContext
+
+
+class ConfigurationEditorTestCase(TestCase):
+
+	def setUp(self):
+		self.owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester', is_staff=True)
+		self.user = User.objects.create(username='user', first_name='Testy', last_name='User')
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		self.user.projects.add(self.project)
+		self.tool = Tool.objects.create(name='test_tool', primary_owner=self.owner, _operational=True)
+		self.child_tool = Tool.objects.create(name='child_tool', parent_tool=self.tool, visible=False)
+
+	def add_configurations(self, count, slots=1):
+		configurations = []
+		for i in range(count):
+			current_settings = ', '.join(['Empty'] * slots)
+			configurations.append(Configuration.objects.create(tool=self.tool, name=f'Config {i}', configurable_item_name='Holder', advance_notice_limit=0, display_priority=i, current_settings=current_settings, available_settings='Empty, A, B'))
+		return configurations
+
+	def add_history(self, configuration, count):
+		for i in range(count):
+			ConfigurationHistory.objects.create(configuration=configuration, user=self.owner, slot=0, setting='A' if i % 2 else 'B', modification_time=timezone.now() - timedelta(minutes=count - i))
+
+	def test_user_can_change_the_configurations_they_maintain(self):
+		maintained, qualified, other = self.add_configurations(3)
+		maintained.maintainers.add(self.user)
+		qualified.qualified_users_are_maintainers = True
+		qualified.save()
+		self.user.qualifications.add(self.tool)
+		html = self.tool.configuration_widget(self.user)
+		for configuration in [maintained, qualified]:
+			self.assertTrue(f'on_change_configuration({configuration.id}, 0, this.value)' in html)
+		self.assertFalse(f'on_change_configuration({other.id}, 0, this.value)' in html)
+		self.assertTrue('on_change_configuration(' in self.tool.configuration_widget(self.owner))
+		# Configurations can't be changed while a tool of the family is in use
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.child_tool)
+		self.assertFalse('on_change_configuration(' in self.tool.configuration_widget(self.owner))
+
+	def test_configurations_of_a_parent_and_its_child_tool(self):
+		self.child_tool.visible = True
+		self.child_tool.save()
+		parent_configuration = self.add_configurations(1)[0]
+		child_configuration = Configuration.objects.create(tool=self.child_tool, name='Child config', configurable_item_name='Holder', advance_notice_limit=0, display_priority=1, current_settings='Empty', available_settings='Empty, A, B')
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.child_tool)
+		context = ConfigurationEditorContext(self.owner, [parent_configuration, child_configuration])
+		self.assertFalse(context.can_change(parent_configuration))
+		self.assertFalse(context.can_change(child_configuration))
+
+	def test_history_snapshots(self):
+		single, multiple = self.add_configurations(1) + self.add_configurations(1, slots=2)
+		ConfigurationHistory.objects.create(configuration=single, user=self.owner, slot=0, setting='A', modification_time=timezone.now() - timedelta(minutes=2))
+		ConfigurationHistory.objects.create(configuration=multiple, user=self.owner, slot=1, setting='B', modification_time=timezone.now() - timedelta(minutes=1))
+		history = get_tool_full_config_history(self.tool)
+		self.assertEqual(len(history), 2)
+		self.assertTrue('Config 0: Empty' in history[0]['html'] and 'Holder #2: B' in history[0]['html'])
+		self.assertTrue('Config 0: A' in history[1]['html'] and 'Holder #2: B' in history[1]['html'])
+
+	def test_tool_status_query_count_does_not_depend_on_configurations(self):
+		login_as(self.client, self.user)
+		configurations = self.add_configurations(2)
+		self.add_history(configurations[0], 2)
+		self.client.get(reverse('tool_status', args=[self.tool.id]))
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('tool_status', args=[self.tool.id]))
+		for configuration in configurations + self.add_configurations(10, slots=3):
+			configuration.maintainers.add(self.owner)
+			self.add_history(configuration, 2)
+		with CaptureQueriesContext(connection) as more_configurations_queries:
+			response = self.client.get(reverse('tool_status', args=[self.tool.id]))
+		self.assertEqual(len(response.context['configs']), 20)
+		self.assertEqual(len(queries), len(more_configurations_queries))
@@ -0,0 +1,126 @@
+import os
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.template import Context
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import Account, CacheVersion, Customization, Project, Reservation, Tool, User
+from NEMO.tests.test_utilities import login_as_user
+from NEMO.views import customization
+from NEMO.views.calendar import send_reservation_reminders
+from NEMO.views.customization import get_customization, get_media_file_template, set_customization, store_media_file
+
+
+# Outside of a test transaction, so the templates compiled are cached
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class MediaFileTemplateTestCase(TransactionTestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+		self.media_settings.enable()
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def test_template_is_compiled_once(self):
+		self.assertIsNone(get_media_file_template('usage_reminder_email.html'))
+		store_media_file(ContentFile('Hello {{ name }}'), 'usage_reminder_email.html')
+		template = get_media_file_template('usage_reminder_email.html')
+		self.assertEqual(template.render(Context({'name': 'Testy'})), 'Hello Testy')
+		with mock.patch('NEMO.views.customization.get_media_file_contents') as get_media_file_contents:
+			self.assertIs(get_media_file_template('usage_reminder_email.html'), template)
+		get_media_file_contents.assert_not_called()
+
+	def test_small_files_are_read_once(self):
+		store_media_file(ContentFile('Welcome'), 'login_banner.html')
+		self.assertEqual(customization.get_media_file_contents('login_banner.html'), 'Welcome')
+		with mock.patch('NEMO.views.customization.get_storage_class') as get_storage_class:
+			self.assertEqual(customization.get_media_file_contents('login_banner.html'), 'Welcome')
+		get_storage_class.assert_not_called()
+
+	def test_template_is_reloaded_when_the_file_changes(self):
+		store_media_file(ContentFile('Hello {{ name }}'), 'usage_reminder_email.html')
+		get_media_file_template('usage_reminder_email.html')
+		store_media_file(ContentFile('Goodbye {{ name }}'), 'usage_reminder_email.html')
+		self.assertEqual(get_media_file_template('usage_reminder_email.html').render(Context({'name': 'Testy'})), 'Goodbye Testy')
+		# The file was changed by another process, which also changed the version
+		with open(os.path.join(self.media.name, 'usage_reminder_email.html'), 'w') as file:
+			file.write('Welcome {{ name }}')
+		self.assertEqual(get_media_file_template('usage_reminder_email.html').render(Context({'name': 'Testy'})), 'Goodbye Testy')
+		CacheVersion.objects.filter(name=customization.customization_version_name).update(version='saved by another process')
+		with override_settings(CACHE_VERSION_MAX_AGE=0):
+			self.assertEqual(get_media_file_template('usage_reminder_email.html').render(Context({'name': 'Testy'})), 'Welcome Testy')
+		store_media_file('', 'usage_reminder_email.html')
+		self.assertIsNone(get_media_file_template('usage_reminder_email.html'))
+
+
+class CustomizationCacheTestCase(TransactionTestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+		self.media_settings.enable()
+		set_customization('user_office_email_address', 'office@example.org')
+		set_customization('self_log_in', 'enabled')
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def customization_queries(self, queries):
+		return [query for query in queries.captured_queries if 'NEMO_customization' in query['sql']]
+
+	def test_customization_is_saved(self):
+		self.assertEqual(get_customization('user_office_email_address'), 'office@example.org')
+		set_customization('user_office_email_address', 'user_office@example.org')
+		self.assertEqual(get_customization('user_office_email_address'), 'user_office@example.org')
+		set_customization('user_office_email_address', '')
+		self.assertEqual(get_customization('user_office_email_address'), '')
+
+	@override_settings(CACHE_VERSION_MAX_AGE=0)
+	def test_customization_saved_by_another_process(self):
+		self.assertEqual(get_customization('user_office_email_address'), 'office@example.org')
+		Customization.objects.filter(name='user_office_email_address').update(value='user_office@example.org')
+		self.assertEqual(get_customization('user_office_email_address'), 'office@example.org')
+		CacheVersion.objects.filter(name=customization.customization_version_name).update(version='saved by another process')
+		self.assertEqual(get_customization('user_office_email_address'), 'user_office@example.org')
+
+	def test_customizations_are_loaded_again_after_the_ttl(self):
+		self.assertEqual(get_customization('user_office_email_address'), 'office@example.org')
+		Customization.objects.filter(name='user_office_email_address').update(value='user_office@example.org')
+		self.assertEqual(get_customization('user_office_email_address'), 'office@example.org')
+		with override_settings(CUSTOMIZATION_CACHE_TTL=0):
+			self.assertEqual(get_customization('user_office_email_address'), 'user_office@example.org')
+
+	def test_landing_page_does_not_read_the_customizations(self):
+		login_as_user(self.client)
+		self.client.get(reverse('landing'))
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('landing'))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.customization_queries(queries), [])
+
+	def test_reminders_do_not_read_the_customizations(self):
+		store_media_file(ContentFile('Reminder for {{ reservation.tool }}'), 'reservation_reminder_email.html')
+		store_media_file(ContentFile('Warning for {{ reservation.tool }}'), 'reservation_warning_email.html')
+		tool = Tool.objects.create(name='test_tool', _operational=True)
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		now = timezone.now()
+		for i in range(5):
+			user = User.objects.create(username=f'user{i}', first_name='Testy', last_name='McTester', email=f'user{i}@example.org')
+			start = now + timedelta(minutes=100 + i)
+			Reservation.objects.create(tool=tool, user=user, creator=user, project=project, creation_time=now - timedelta(days=1), start=start, end=start + timedelta(hours=1), short_notice=False)
+		get_customization('user_office_email_address')
+		with CaptureQueriesContext(connection) as queries:
+			report = send_reservation_reminders(now, get_media_file_template('reservation_reminder_email.html'), get_media_file_template('reservation_warning_email.html'))
+		self.assertEqual(report.sent, 5)
+		self.assertEqual(self.customization_queries(queries), [])
@@ -0,0 +1,194 @@
+from datetime import timedelta
+from threading import Event, Lock
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from NEMO.apps.area_access.door_scheduler import DoorScheduler, TimerWheel, recover_doors_left_unlocked
+from NEMO.models import Area, Door, Interlock, InterlockCard, InterlockCardCategory
+from NEMO.tests.test_utilities import wait_for
+
+
+class FakeClock:
+	""" Monotonic time and current date and time, moved forward by the tests. """
+
+	def __init__(self):
+		self.elapsed = 0.0
+		self.start = timezone.now()
+
+	def monotonic(self) -> float:
+		return 1000 + self.elapsed
+
+	def now(self):
+		return self.start + timedelta(seconds=self.elapsed)
+
+	def advance(self, seconds: float):
+		self.elapsed += seconds
+
+
+class TimerWheelTestCase(SimpleTestCase):
+
+	def test_expire(self):
+		wheel = TimerWheel(tick=1, slot_count=4)
+		now = wheel.next_tick * wheel.tick
+		wheel.schedule('soon', now + 0.5)
+		wheel.schedule('later', now + 2.5)
+		# More than a full turn away, in the same slot as "soon"
+		wheel.schedule('next turn', now + 4.5)
+		wheel.schedule('moved', now + 0.5)
+		wheel.schedule('moved', now + 3.5)
+		self.assertEqual(wheel.expire(now + 0.9), [])
+		self.assertEqual(wheel.expire(now + 1), ['soon'])
+		self.assertEqual(wheel.expire(now + 3.9), ['later'])
+		self.assertEqual(wheel.expire(now + 4), ['moved'])
+		self.assertEqual(len(wheel), 1)
+		self.assertEqual(wheel.expire(now + 10), ['next turn'])
+		# A deadline that already passed expires with the next tick
+		wheel.schedule('late', now)
+		self.assertEqual(wheel.expire(now + 11), ['late'])
+
+
+@override_settings(DOOR_UNLOCK_DURATION=8)
+@mock.patch.object(Interlock, 'lock', autospec=True, return_value=True)
+@mock.patch.object(Interlock, 'unlock', autospec=True, return_value=True)
+class DoorSchedulerTestCase(TransactionTestCase):
+
+	def setUp(self):
+		category, created = InterlockCardCategory.objects.get_or_create(key='stanford', defaults={'name': 'Stanford'})
+		self.card = InterlockCard.objects.create(server='server.com', port=80, number=1, even_port=1, odd_port=2, category=category)
+		self.area = Area.objects.create(name='Cleanroom', welcome_message='Welcome')
+		self.door = self.create_door('test_door', 1)
+		self.clock = FakeClock()
+		self.scheduler = DoorScheduler(tick=0.05, clock=self.clock.monotonic, now=self.clock.now)
+
+	def tearDown(self):
+		self.scheduler.stop()
+
+	def create_door(self, name, channel):
+		return Door.objects.create(name=name, area=self.area, interlock=Interlock.objects.create(card=self.card, channel=channel))
+
+	def swipe(self, door=None):
+		self.scheduler.unlock((door or self.door).id)
+		self.scheduler.join()
+
+	def advance(self, seconds):
+		""" Moves the clock forward and sends the relocks that are due. """
+		self.clock.advance(seconds)
+		self.scheduler.relock_due_doors()
+		self.scheduler.join()
+
+	def relock_deadline(self):
+		return Door.objects.get(id=self.door.id).relock_deadline
+
+	def test_door_is_locked_again(self, unlock, lock):
+		self.swipe()
+		self.assertEqual(unlock.call_count, 1)
+		self.assertEqual(self.relock_deadline(), self.clock.now() + timedelta(seconds=8))
+		self.advance(7.9)
+		self.assertEqual(lock.call_count, 0)
+		self.advance(0.2)
+		self.assertEqual(lock.call_count, 1)
+		self.assertIsNone(self.relock_deadline())
+		self.assertEqual(self.scheduler.pending_relocks(), 0)
+
+	def test_repeated_unlocks_are_coalesced(self, unlock, lock):
+		for i in range(5):
+			self.swipe()
+			self.advance(2)
+		self.assertEqual(unlock.call_count, 1)
+		# The door stays unlocked until 8 seconds after the last swipe
+		self.advance(5.9)
+		self.assertEqual(lock.call_count, 0)
+		self.advance(0.2)
+		self.assertEqual(lock.call_count, 1)
+		# The door is unlocked again by the next swipe
+		self.swipe()
+		self.assertEqual(unlock.call_count, 2)
+
+	def test_failed_unlock_is_sent_again(self, unlock, lock):
+		unlock.return_value = False
+		self.swipe()
+		self.swipe()
+		self.assertEqual(unlock.call_count, 2)
+		unlock.return_value = True
+		self.swipe()
+		self.swipe()
+		self.assertEqual(unlock.call_count, 3)
+		# The door is locked even though its state was unknown after the first swipes
+		self.advance(8.1)
+		self.assertEqual(lock.call_count, 1)
+
+	def test_relock_is_postponed_when_another_process_unlocked_the_door(self, unlock, lock):
+		self.swipe()
+		Door.objects.filter(id=self.door.id).update(relock_deadline=self.clock.now() + timedelta(seconds=20))
+		self.advance(8.1)
+		self.assertEqual(lock.call_count, 0)
+		self.advance(11.8)
+		self.assertEqual(lock.call_count, 0)
+		self.advance(0.2)
+		self.assertEqual(lock.call_count, 1)
+
+	def test_doors_left_unlocked_are_recovered(self, unlock, lock):
+		Door.objects.filter(id=self.door.id).update(relock_deadline=self.clock.now() - timedelta(minutes=1))
+		self.scheduler.recover()
+		self.advance(0.1)
+		self.assertEqual(lock.call_count, 1)
+		self.assertEqual(unlock.call_count, 0)
+		self.assertIsNone(self.relock_deadline())
+
+	def test_unreachable_door_does_not_delay_other_doors(self, unlock, lock):
+		other_door = self.create_door('other_door', 2)
+		card_answers = Event()
+		unlock.side_effect = lambda interlock: interlock.id != self.door.interlock_id or card_answers.wait(5)
+		self.scheduler.unlock(self.door.id)
+		# Waits for the first door to stop using the database, the test database can't be written by two threads at once
+		self.assertTrue(wait_for(lambda: unlock.call_count == 1))
+		self.scheduler.unlock(other_door.id)
+		self.assertTrue(wait_for(lambda: {call[0][0].id for call in unlock.call_args_list} == {self.door.interlock_id, other_door.interlock_id}))
+		card_answers.set()
+		self.scheduler.join()
+
+	def test_unreachable_doors_hold_up_a_bounded_number_of_threads(self, unlock, lock):
+		self.scheduler.stop()
+		self.scheduler = DoorScheduler(tick=0.05, clock=self.clock.monotonic, now=self.clock.now, worker_count=2)
+		card_answers = Event()
+		counter_lock = Lock()
+		sending = []
+		sent = []
+		most_sent_at_once = []
+
+		# Commands that don't use the database, which the tests share between threads
+		def unreachable(door_id, command):
+			with counter_lock:
+				sending.append(door_id)
+				most_sent_at_once.append(len(sending))
+			card_answers.wait(5)
+			with counter_lock:
+				sending.remove(door_id)
+				sent.append((door_id, command))
+
+		for door_id in range(5):
+			self.scheduler.submit(door_id, unreachable, 'unlock')
+			self.scheduler.submit(door_id, unreachable, 'lock')
+		self.assertTrue(wait_for(lambda: len(sending) == 2))
+		card_answers.set()
+		self.scheduler.join()
+		self.assertEqual(len(self.scheduler.threads), 2)
+		self.assertEqual(max(most_sent_at_once), 2)
+		self.assertEqual(len(sent), 10)
+		# The commands of each door are sent in order
+		for door_id in range(5):
+			self.assertEqual([command for sent_door_id, command in sent if sent_door_id == door_id], ['unlock', 'lock'])
+
+	def test_doors_left_unlocked_are_recovered_by_one_process(self, unlock, lock):
+		Door.objects.filter(id=self.door.id).update(relock_deadline=self.clock.now() + timedelta(seconds=5))
+		# Another process started with the server at the same time
+		other_scheduler = DoorScheduler(tick=0.05, clock=self.clock.monotonic, now=self.clock.now)
+		try:
+			recover_doors_left_unlocked(self.scheduler)
+			self.clock.advance(1)
+			recover_doors_left_unlocked(other_scheduler)
+			self.assertEqual((self.scheduler.pending_relocks(), other_scheduler.pending_relocks()), (1, 0))
+		finally:
+			other_scheduler.stop()
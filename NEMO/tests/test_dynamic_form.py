@@ -0,0 +1,59 @@
+from json import dumps
+
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from NEMO.models import User, Account, Project, Consumable, ConsumableWithdraw
+from NEMO.widgets.dynamic_form import get_dynamic_form
+
+
+def create_questions(count):
+	questions = [{'type': 'radio', 'title': 'Was the gas used?', 'choices': ['Yes'], 'name': 'gas', 'required': False, 'default_choice': 'Yes', 'consumable': 'Gas'}]
+	for i in range(count):
+		questions.append({'type': 'textbox', 'title': f'Wafers {i}', 'name': f'wafers_{i}', 'placeholder': '0', 'required': False, 'max-width': 100, 'consumable': f'Wafer {i}'})
+	return dumps(questions)
+
+
+class DynamicFormTestCase(TestCase):
+
+	def setUp(self):
+		self.user = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		for name in ['Gas'] + [f'Wafer {i}' for i in range(10)]:
+			Consumable.objects.create(name=name, quantity=10, reminder_threshold=1, reminder_email='test@example.org')
+
+	def test_form_is_compiled_once(self):
+		questions = create_questions(2)
+		form = get_dynamic_form(questions)
+		self.assertIs(get_dynamic_form(questions), form)
+		self.assertTrue('name="wafers_1"' in form.render())
+		self.assertIsNot(get_dynamic_form(create_questions(3)), form)
+		self.assertEqual(get_dynamic_form(None).render(), '')
+
+	def test_answers_are_extracted_when_the_form_cannot_be_rendered(self):
+		# The choices of the radio button are missing
+		questions = dumps([{'type': 'radio', 'title': 'Was the gas used?', 'name': 'gas'}, {'type': 'textbox', 'title': 'Wafers', 'name': 'wafers', 'max-width': 100}])
+		form = get_dynamic_form(questions)
+		self.assertEqual(form.extract(RequestFactory().post('/', {'wafers': '2'})), dumps({'wafers': '2'}, indent='\t'))
+		self.assertRaises(KeyError, form.render)
+
+	def test_consumables_are_charged_with_constant_queries(self):
+		query_counts = []
+		for count in [1, 10]:
+			form = get_dynamic_form(create_questions(count))
+			request = RequestFactory().post('/', {f'wafers_{i}': '2' for i in range(count)})
+			run_data = form.extract(request)
+			with CaptureQueriesContext(connection) as queries:
+				form.charge_for_consumable(self.user, self.user, self.project, run_data)
+			query_counts.append(len(queries))
+		self.assertEqual(query_counts[0], query_counts[1])
+		self.assertEqual(ConsumableWithdraw.objects.filter(consumable__name='Gas').count(), 2)
+		self.assertEqual(ConsumableWithdraw.objects.filter(consumable__name='Wafer 9', quantity=2).count(), 1)
+		self.assertEqual(ConsumableWithdraw.objects.count(), 13)
+
+	def test_ambiguous_consumables_are_not_charged(self):
+		Consumable.objects.create(name='Gas', quantity=10, reminder_threshold=1, reminder_email='test@example.org')
+		form = get_dynamic_form(create_questions(1))
+		form.charge_for_consumable(self.user, self.user, self.project, form.extract(RequestFactory().post('/', {'wafers_0': '1', 'gas': 'Yes'})))
+		self.assertEqual(list(ConsumableWithdraw.objects.values_list('consumable__name', flat=True)), ['Wafer 0'])
@@ -0,0 +1,130 @@
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+from tempfile import TemporaryDirectory
+from time import monotonic
+from unittest import mock
+
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.email_delivery import deliver
+from NEMO.tests.test_utilities import login_as_staff, wait_for
+from NEMO.models import Account, Project, Reservation, Tool, User
+from NEMO.utilities import create_email
+from NEMO.views.calendar import email_reservation_reminders
+from NEMO.views.customization import store_media_file
+
+
+class FakeConnection:
+	def __init__(self, refused=()):
+		self.refused = refused
+		self.opened = 0
+		self.sent = []
+
+	def open(self):
+		self.opened += 1
+
+	def close(self):
+		pass
+
+	def send_messages(self, messages):
+		for message in messages:
+			if any(recipient in self.refused for recipient in message.recipients()):
+				raise SMTPRecipientsRefused({})
+			self.sent.append(message.to[0])
+		return len(messages)
+
+
+def messages(count):
+	for i in range(count):
+		yield create_email('Subject', 'Message', 'nemo@example.org', [f'user{i}@example.org'])
+
+
+class DeliveryTestCase(SimpleTestCase):
+
+	def test_messages_are_sent_in_batches(self):
+		connection = FakeConnection()
+		progress = []
+		report = deliver(messages(5), batch_size=2, rate_limit=0, connection=connection, progress=lambda r: progress.append(r.sent))
+		self.assertEqual(len(connection.sent), 5)
+		self.assertEqual(progress, [2, 4, 5])
+		self.assertEqual((report.sent, report.failed, report.batches), (5, 0, 3))
+
+	def test_failed_message_does_not_stop_the_delivery(self):
+		connection = FakeConnection(refused={'user2@example.org'})
+		report = deliver(messages(6), batch_size=2, rate_limit=0, connection=connection)
+		self.assertEqual(connection.sent, ['user0@example.org', 'user1@example.org', 'user3@example.org', 'user4@example.org', 'user5@example.org'])
+		self.assertEqual((report.sent, report.failed), (5, 1))
+		# Only the recipients of the message that failed are reported, not the whole batch
+		self.assertEqual([message.recipients() for message, error in report.errors], [['user2@example.org']])
+
+	def test_rate_limit(self):
+		start = monotonic()
+		report = deliver(messages(6), batch_size=2, rate_limit=20, connection=FakeConnection())
+		# The third batch waits until 4 messages were sent at 20 messages per second
+		self.assertGreaterEqual(monotonic() - start, 0.2)
+		self.assertEqual(report.sent, 6)
+
+
+@override_settings(EMAIL_BATCH_SIZE=2)
+class ReservationRemindersTestCase(TestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+		self.media_settings.enable()
+		store_media_file(ContentFile('Reminder for {{ reservation.tool }}'), 'reservation_reminder_email.html')
+		store_media_file(ContentFile('Warning for {{ reservation.tool }}'), 'reservation_warning_email.html')
+		self.tool = Tool.objects.create(name='test_tool', _operational=True)
+		self.project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def test_reminders_are_sent_together(self):
+		start = timezone.now() + timedelta(hours=2)
+		for i in range(3):
+			user = User.objects.create(username=f'user{i}', first_name='Testy', last_name='McTester', email=f'user{i}@example.org')
+			Reservation.objects.create(tool=self.tool, user=user, creator=user, project=self.project, start=start, end=start + timedelta(hours=1), short_notice=False)
+		request = RequestFactory().get('/email_reservation_reminders/')
+		request.user = User.objects.create(username='service', first_name='Service', last_name='Account', is_superuser=True)
+		response = email_reservation_reminders(request)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['user0@example.org', 'user1@example.org', 'user2@example.org'])
+		self.assertEqual(mail.outbox[0].body, 'Reminder for test_tool')
+		self.assertEqual(mail.outbox[0].content_subtype, 'html')
+
+
+class BroadcastEmailTestCase(TestCase):
+
+	def setUp(self):
+		self.media = TemporaryDirectory()
+		self.media_settings = override_settings(MEDIA_ROOT=self.media.name, SERVER_EMAIL='nemo@example.org')
+		self.media_settings.enable()
+		store_media_file(ContentFile('{{ contents }}'), 'generic_email.html')
+
+	def tearDown(self):
+		self.media_settings.disable()
+		self.media.cleanup()
+
+	def test_sender_is_told_about_failed_recipients(self):
+		staff = login_as_staff(self.client)
+		staff.email = 'staff@example.org'
+		staff.save()
+		tool = Tool.objects.create(name='test_tool', _operational=True)
+		for i in range(3):
+			User.objects.create(username=f'user{i}', first_name='Testy', last_name='McTester', email=f'user{i}@example.org').qualifications.add(tool)
+		connection = FakeConnection(refused={'user1@example.org'})
+		with mock.patch('NEMO.email_delivery.get_connection', return_value=connection):
+			response = self.client.post(reverse('send_broadcast_email'), {'subject': 'Maintenance', 'color': '#5bc0de', 'contents': 'Tomorrow', 'copy_me': 'on', 'audience': 'tool', 'selection': tool.id, 'only_active_users': 'on'})
+			self.assertEqual(response.status_code, 200)
+			self.assertTrue(wait_for(lambda: len(mail.outbox) == 1))
+		self.assertEqual(connection.sent, ['staff@example.org', 'user0@example.org', 'user2@example.org'])
+		self.assertEqual(mail.outbox[0].to, ['staff@example.org'])
+		self.assertEqual(mail.outbox[0].subject, 'Undelivered email: Maintenance')
+		self.assertIn('could not be sent to 1 of its 4 recipients:<br>user1@example.org', mail.outbox[0].body)
@@ -0,0 +1,142 @@
+import struct
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingTCPServer, BaseRequestHandler
+from threading import Thread, Lock
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeRelayServer:
+	"""
+	Relay card listening on localhost, used to test the interlocks and their dispatcher without hardware.
+	The relay states, the number of connections accepted and the number of commands received are recorded.
+	Commands can be delayed to simulate a slow card, and the connection can be closed after each reply.
+	"""
+
+	def __init__(self, handler_class, delay: float = 0, close_after_reply=False):
+		self.relays = defaultdict(int)
+		self.connections = 0
+		self.commands = 0
+		self.delay = delay
+		self.close_after_reply = close_after_reply
+		self.lock = Lock()
+		ThreadingTCPServer.allow_reuse_address = True
+		self.server = ThreadingTCPServer(('127.0.0.1', 0), handler_class)
+		self.server.daemon_threads = True
+		self.server.fake = self
+		self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+	@property
+	def host(self):
+		return self.server.server_address[0]
+
+	@property
+	def port(self):
+		return self.server.server_address[1]
+
+	def record_connection(self):
+		with self.lock:
+			self.connections += 1
+
+	def record_command(self):
+		with self.lock:
+			self.commands += 1
+		if self.delay:
+			sleep(self.delay)
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+def receive_exactly(sock, size) -> bytes:
+	data = b''
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			return b''
+		data += chunk
+	return data
+
+
+class StanfordHandler(BaseRequestHandler):
+	command_schema = struct.Struct('!20siiiiiiiiibbbbb18s')
+	reply_schema = struct.Struct('!iiiiiiiiibbbbb')
+
+	def handle(self):
+		fake: FakeRelayServer = self.server.fake
+		fake.record_connection()
+		while True:
+			data = receive_exactly(self.request, self.command_schema.size)
+			if not data:
+				return
+			command = self.command_schema.unpack(data)
+			fake.record_command()
+			card_number, even_port, odd_port, channel, command_type = command[2], command[3], command[4], command[5], command[7]
+			fake.relays[channel] = command_type
+			self.request.sendall(self.reply_schema.pack(1, card_number, even_port, odd_port, channel, 1, 0, 0, 0, 0, 0, 0, 0, 0))
+			if fake.close_after_reply:
+				return
+
+
+class ProXrHandler(BaseRequestHandler):
+	PXR_ACK = 85
+
+	def handle(self):
+		fake: FakeRelayServer = self.server.fake
+		fake.record_connection()
+		while True:
+			data = receive_exactly(self.request, 3)
+			if not data:
+				return
+			fake.record_command()
+			command = data[1]
+			if 100 <= command <= 107:
+				fake.relays[command - 99] = 0
+				reply = self.PXR_ACK
+			elif 108 <= command <= 115:
+				fake.relays[command - 107] = 1
+				reply = self.PXR_ACK
+			elif 116 <= command <= 123:
+				reply = fake.relays[command - 115]
+			elif command == 124:
+				reply = sum(fake.relays[relay] << (relay - 1) for relay in range(1, 9))
+			else:
+				reply = 255
+			self.request.sendall(bytes([reply]))
+			if fake.close_after_reply and 116 <= command <= 124:
+				return
+
+
+class WebRelayHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def setup(self):
+		super().setup()
+		self.server.fake.record_connection()
+
+	def do_GET(self):
+		fake: FakeRelayServer = self.server.fake
+		fake.record_command()
+		for name, values in parse_qs(urlparse(self.path).query).items():
+			if name.startswith('relay') and name.endswith('State'):
+				relay = int(name[len('relay'):-len('State')])
+				fake.relays[relay] = int(values[0])
+		content = "<datavalues>" + "".join(f"<relay{relay}state>{state}</relay{relay}state>" for relay, state in fake.relays.items()) + "</datavalues>"
+		content = content.encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/xml')
+		self.send_header('Content-Length', str(len(content)))
+		if fake.close_after_reply:
+			self.send_header('Connection', 'close')
+			self.close_connection = True
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, format, *args):
+		pass
@@ -0,0 +1,173 @@
+from time import sleep
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from NEMO import interlocks
+from NEMO.exceptions import InterlockError
+from NEMO.models import Interlock, InterlockCard, InterlockCardCategory
+from NEMO.tests.test_interlocks.fake_relay_server import FakeRelayServer, StanfordHandler, ProXrHandler, WebRelayHandler
+from NEMO.tests.test_utilities import wait_for
+
+
+@override_settings(INTERLOCKS_ENABLED=True)
+class InterlockDispatcherTestCase(TestCase):
+
+	def tearDown(self):
+		interlocks.dispatcher.close()
+
+	def create_interlock(self, fake: FakeRelayServer, category_key: str, channel: int) -> Interlock:
+		return self.create_interlocks(fake, category_key, [channel])[0]
+
+	def create_interlocks(self, fake: FakeRelayServer, category_key: str, channels) -> [Interlock]:
+		category = InterlockCardCategory.objects.get(key=category_key)
+		card = InterlockCard.objects.create(server=fake.host, port=fake.port, number=1, even_port=124, odd_port=125, category=category)
+		return [Interlock.objects.create(card=card, channel=channel) for channel in channels]
+
+	def lock_and_unlock(self, fake: FakeRelayServer, interlock: Interlock, times: int):
+		for i in range(times):
+			self.assertTrue(interlock.unlock(), interlock.most_recent_reply)
+			self.assertEqual(interlock.state, Interlock.State.UNLOCKED)
+			self.assertEqual(fake.relays[interlock.channel], 1)
+			self.assertTrue(interlock.lock(), interlock.most_recent_reply)
+			self.assertEqual(interlock.state, Interlock.State.LOCKED)
+
+	def test_connection_is_kept_open_between_commands(self):
+		for handler, category_key in [(StanfordHandler, 'stanford'), (ProXrHandler, 'proxr'), (WebRelayHandler, 'web_relay_http')]:
+			with FakeRelayServer(handler) as fake:
+				interlock = self.create_interlock(fake, category_key, 2)
+				self.lock_and_unlock(fake, interlock, 3)
+				self.assertEqual(fake.connections, 1, category_key)
+				statistics = interlocks.dispatcher.statistics()[interlock.card_id]
+				self.assertEqual(statistics['commands'], 6)
+				self.assertEqual(statistics['failures'], 0)
+				self.assertEqual(statistics['connections_opened'], 1)
+				self.assertGreater(statistics['max_latency'], 0)
+
+	def test_reconnects_when_the_card_closes_the_connection(self):
+		for handler, category_key in [(StanfordHandler, 'stanford'), (ProXrHandler, 'proxr'), (WebRelayHandler, 'web_relay_http')]:
+			with FakeRelayServer(handler, close_after_reply=True) as fake:
+				interlock = self.create_interlock(fake, category_key, 3)
+				self.lock_and_unlock(fake, interlock, 2)
+				self.assertEqual(fake.connections, 4, category_key)
+				self.assertEqual(interlocks.dispatcher.statistics()[interlock.card_id]['failures'], 0)
+
+	def test_unreachable_card_failure_is_counted(self):
+		with FakeRelayServer(StanfordHandler) as fake:
+			interlock = self.create_interlock(fake, 'stanford', 1)
+		self.assertFalse(interlock.unlock())
+		self.assertTrue('Socket error' in interlock.most_recent_reply)
+		self.assertEqual(interlocks.dispatcher.statistics()[interlock.card_id]['failures'], 1)
+
+	def test_bulk_lock_sends_one_batch_per_card_in_parallel(self):
+		with FakeRelayServer(ProXrHandler, delay=0.05) as proxr_fake, FakeRelayServer(WebRelayHandler, delay=0.3) as web_relay_fake, FakeRelayServer(StanfordHandler, delay=0.1) as stanford_fake:
+			all_interlocks = self.create_interlocks(proxr_fake, 'proxr', range(1, 5)) + self.create_interlocks(web_relay_fake, 'web_relay_http', range(1, 4)) + self.create_interlocks(stanford_fake, 'stanford', range(1, 3))
+			proxr_fake.relays[8] = 1
+			unlocked = interlocks.bulk_unlock(Interlock.objects.filter(id__in=[interlock.id for interlock in all_interlocks]).select_related('card__category'))
+			self.assertTrue(all(unlocked.values()))
+			self.assertEqual(len(unlocked), 9)
+			with CaptureQueriesContext(connection) as queries:
+				locked = interlocks.bulk_lock(all_interlocks)
+			self.assertTrue(all(locked.values()))
+			self.assertEqual(len(queries), 1)
+			self.assertFalse(Interlock.objects.exclude(state=Interlock.State.LOCKED).exists())
+			# The web relay sets its relays in one exchange per command
+			self.assertEqual(web_relay_fake.commands, 2)
+			# ProXR: one command per relay and one bank status read, the relay outside the batch is left alone
+			self.assertEqual(proxr_fake.commands, 10)
+			self.assertEqual(proxr_fake.relays[8], 1)
+			self.assertEqual(stanford_fake.commands, 4)
+			for fake in [proxr_fake, web_relay_fake, stanford_fake]:
+				self.assertEqual(fake.connections, 1)
+			# Each card received one batch per command, sent by its own channel
+			statistics = interlocks.dispatcher.statistics()
+			for card_interlocks in [all_interlocks[:4], all_interlocks[4:7], all_interlocks[7:]]:
+				card_statistics = statistics[card_interlocks[0].card_id]
+				self.assertEqual(card_statistics['batches'], 2)
+				self.assertEqual(card_statistics['commands'], 2 * len(card_interlocks))
+				self.assertEqual(card_statistics['failures'], 0)
+				self.assertEqual(card_statistics['timeouts'], 0)
+
+	def test_bulk_lock_reports_each_failure(self):
+		with FakeRelayServer(StanfordHandler) as fake:
+			interlock = self.create_interlock(fake, 'stanford', 1)
+			unreachable_interlock = self.create_interlock(fake, 'stanford', 2)
+		with FakeRelayServer(StanfordHandler) as fake:
+			interlock.card.port = fake.port
+			interlock.card.save()
+			locked = interlocks.bulk_lock([interlock, unreachable_interlock])
+			self.assertEqual(locked, {interlock.id: True, unreachable_interlock.id: False})
+			unreachable_interlock.refresh_from_db()
+			self.assertEqual(unreachable_interlock.state, Interlock.State.UNKNOWN)
+			self.assertTrue('Socket error' in unreachable_interlock.most_recent_reply)
+
+
+class SlowInterlock(interlocks.Interlock):
+	""" Answers each command after a delay, or loses the reply of the unlock commands. """
+
+	def __init__(self, delay: float, lose_unlock_replies=False):
+		self.delay = delay
+		self.lose_unlock_replies = lose_unlock_replies
+		self.commands = []
+
+	def _send_command(self, interlock: Interlock, command_type: Interlock.State) -> Interlock.State:
+		self.commands.append(command_type)
+		sleep(self.delay)
+		if self.lose_unlock_replies and command_type == Interlock.State.UNLOCKED:
+			raise InterlockError(interlock=interlock, msg="No reply")
+		return command_type
+
+
+@override_settings(INTERLOCKS_ENABLED=True, INTERLOCK_COMMAND_TIMEOUT=0.2)
+class InterlockLateReplyTestCase(TransactionTestCase):
+
+	def tearDown(self):
+		interlocks.dispatcher.close()
+
+	def create_interlock(self, server='server.com', port=80) -> Interlock:
+		category, created = InterlockCardCategory.objects.get_or_create(key='stanford', defaults={'name': 'Stanford'})
+		card = InterlockCard.objects.create(server=server, port=port, number=1, even_port=124, odd_port=125, category=category)
+		return Interlock.objects.create(card=card, channel=1)
+
+	def test_interlock_unlocked_after_the_timeout_is_locked_again(self):
+		implementation = SlowInterlock(0.5)
+		interlock = self.create_interlock()
+		self.assertFalse(implementation.unlock(interlock))
+		self.assertEqual(Interlock.objects.get(id=interlock.id).state, Interlock.State.UNKNOWN)
+		self.assertTrue(wait_for(lambda: Interlock.objects.get(id=interlock.id).state == Interlock.State.LOCKED))
+		self.assertEqual(implementation.commands, [Interlock.State.UNLOCKED, Interlock.State.LOCKED])
+		self.assertTrue('Lock command succeeded' in Interlock.objects.get(id=interlock.id).most_recent_reply)
+
+	def test_interlock_whose_unlock_reply_was_lost_is_locked_again(self):
+		implementation = SlowInterlock(0.5, lose_unlock_replies=True)
+		interlock = self.create_interlock()
+		self.assertFalse(implementation.unlock(interlock))
+		self.assertTrue(wait_for(lambda: Interlock.objects.get(id=interlock.id).state == Interlock.State.LOCKED))
+		self.assertEqual(implementation.commands, [Interlock.State.UNLOCKED, Interlock.State.LOCKED])
+
+	def test_late_unlock_is_not_locked_again_when_a_newer_command_is_queued(self):
+		implementation = SlowInterlock(0.5)
+		interlock = self.create_interlock()
+		self.assertFalse(implementation.unlock(interlock))
+		# Queued while the unlock is still being sent, so it is answered after the late reply
+		replies = interlocks.dispatcher.send_commands([(implementation, [interlock])], Interlock.State.UNLOCKED, timeout=2)
+		self.assertEqual(replies, {interlock.id: (Interlock.State.UNLOCKED, '')})
+		self.assertEqual(implementation.commands, [Interlock.State.UNLOCKED, Interlock.State.UNLOCKED])
+		self.assertEqual(interlocks.dispatcher.statistics()[interlock.card_id]['queued'], 0)
+
+	def test_slow_card_does_not_block_other_cards(self):
+		with FakeRelayServer(StanfordHandler, delay=1) as slow_fake, FakeRelayServer(StanfordHandler) as fake:
+			slow_interlock = self.create_interlock(slow_fake.host, slow_fake.port)
+			interlock = self.create_interlock(fake.host, fake.port)
+			implementation = interlocks.get(interlock.card.category)
+			replies = interlocks.dispatcher.send_commands([(implementation, [slow_interlock]), (implementation, [interlock])], Interlock.State.UNLOCKED)
+			self.assertEqual(replies[interlock.id], (Interlock.State.UNLOCKED, ''))
+			self.assertEqual(replies[slow_interlock.id][0], Interlock.State.UNKNOWN)
+			self.assertEqual(fake.commands, 1)
+			# The exchange with the slow card ends when the request gives up, before the card replies
+			self.assertTrue(wait_for(lambda: interlocks.dispatcher.statistics()[slow_interlock.card_id]['failures'] >= 1, timeout=0.5))
+			statistics = interlocks.dispatcher.statistics()
+			self.assertEqual(statistics[interlock.card_id]['batches'], 1)
+			self.assertEqual(statistics[interlock.card_id]['failures'], 0)
+			self.assertEqual(statistics[slow_interlock.card_id]['batches'], 1)
@@ -24,7 +24,7 @@ def web_relay_response(relayNumber, state):
 		   f"</datavalues>"
 
 
-# This method will be used by the mock to replace requests.get
+# This method will be used by the mock to replace requests.Session.get
 # In the web relay case, it will return a xml file with the relay statuses
 def mocked_requests_get(*args, **kwargs):
 	from requests import Response
@@ -79,7 +79,7 @@ class WebRelayInterlockTestCase(TestCase):
 		owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
 		tool = Tool.objects.create(name='test_tool', primary_owner=owner, interlock=interlock)
 
-	@mock.patch('NEMO.interlocks.requests.get', side_effect=mocked_requests_get)
+	@mock.patch('NEMO.interlocks.requests.Session.get', side_effect=mocked_requests_get)
 	def test_disabled_card(self, mock_args):
 		self.assertTrue(disabled_interlock.unlock())
 		self.assertEqual(disabled_interlock.state, Interlock.State.UNLOCKED)
@@ -88,14 +88,14 @@ class WebRelayInterlockTestCase(TestCase):
 		self.assertEqual(disabled_interlock.state, Interlock.State.LOCKED)
 		self.assertTrue('Interlock interface mocked out' in disabled_interlock.most_recent_reply)
 
-	@mock.patch('NEMO.interlocks.requests.get', side_effect=mocked_requests_get)
+	@mock.patch('NEMO.interlocks.requests.Session.get', side_effect=mocked_requests_get)
 	def test_all_good(self, mock_args):
 		self.assertTrue(tool.interlock.unlock())
 		self.assertEqual(tool.interlock.state, Interlock.State.UNLOCKED)
 		self.assertTrue(tool.interlock.lock())
 		self.assertEqual(tool.interlock.state, Interlock.State.LOCKED)
 
-	@mock.patch('NEMO.interlocks.requests.get', side_effect=mocked_requests_get)
+	@mock.patch('NEMO.interlocks.requests.Session.get', side_effect=mocked_requests_get)
 	def test_error_response_from_interlock(self, mock_args):
 		self.assertFalse(bad_interlock.unlock())
 		self.assertTrue(ERROR_500 in bad_interlock.most_recent_reply)
@@ -107,14 +107,14 @@ class WebRelayInterlockTestCase(TestCase):
 		self.assertTrue(LOCK_ERROR in bad_interlock.most_recent_reply)
 		self.assertEqual(bad_interlock.state, Interlock.State.UNKNOWN)
 
-	@mock.patch('NEMO.interlocks.requests.get', side_effect=mocked_requests_get)
+	@mock.patch('NEMO.interlocks.requests.Session.get', side_effect=mocked_requests_get)
 	def test_wrong_response_from_interlock(self, mock_args):
 		self.assertFalse(wrong_response_interlock.unlock())
 		self.assertTrue('General exception' in wrong_response_interlock.most_recent_reply)
 		self.assertTrue('syntax error' in wrong_response_interlock.most_recent_reply)
 		self.assertEqual(wrong_response_interlock.state, Interlock.State.UNKNOWN)
 
-	@mock.patch('NEMO.interlocks.requests.get', side_effect=mocked_requests_get)
+	@mock.patch('NEMO.interlocks.requests.Session.get', side_effect=mocked_requests_get)
 	def test_wrong_state_from_interlock(self, mock_args):
 		self.assertFalse(wrong_state_interlock.unlock())
 		self.assertTrue('General exception' in wrong_state_interlock.most_recent_reply)
@@ -0,0 +1,70 @@
+import re
+from threading import Lock
+from time import sleep
+from typing import Dict
+
+from ldap3 import ANONYMOUS
+from ldap3.core.exceptions import LDAPBindError, LDAPSocketOpenError, LDAPSocketReceiveError
+
+
+class FakeDirectory:
+	"""
+	In-memory stand-in for the LDAP servers, used as the connection factory of an LDAPDirectory to test it without a network.
+	Each server url can be given a delay to simulate a slow server, or be marked down to simulate a dead one.
+	The number of connections opened, binds and searches are recorded for each server.
+	"""
+
+	def __init__(self, users: Dict[str, str], service_password='service'):
+		# Users by dn, with their password. The username is the uid in the dn.
+		self.users = users
+		self.service_password = service_password
+		self.delays = {}
+		self.down = set()
+		self.lock = Lock()
+		self.connections = {}
+		self.binds = {}
+		self.searches = {}
+
+	def count(self, counter, url):
+		with self.lock:
+			counter[url] = counter.get(url, 0) + 1
+
+	def connect(self, server: dict, user, password, authentication):
+		url = server['url']
+		sleep(self.delays.get(url, 0))
+		if url in self.down:
+			raise LDAPSocketOpenError(f'unable to open socket to {url}')
+		self.count(self.connections, url)
+		self.count(self.binds, url)
+		if authentication != ANONYMOUS and user != server.get('bind_username'):
+			dn = user if user in self.users else next((dn for dn in self.users if self.username(dn) == user.partition('\\')[2] or self.username(dn) == user), None)
+			if dn is None or self.users[dn] != password:
+				raise LDAPBindError('invalidCredentials')
+		elif authentication != ANONYMOUS and password != self.service_password:
+			raise LDAPBindError('invalidCredentials')
+		return FakeConnection(self, url)
+
+	@staticmethod
+	def username(dn):
+		return dn.split(',')[0].partition('=')[2]
+
+
+class FakeConnection:
+
+	def __init__(self, directory: FakeDirectory, url):
+		self.directory = directory
+		self.url = url
+		self.response = []
+		self.closed = False
+
+	def search(self, base_dn, search_filter, attributes):
+		if self.closed or self.url in self.directory.down:
+			raise LDAPSocketReceiveError('connection closed')
+		sleep(self.directory.delays.get(self.url, 0))
+		self.directory.count(self.directory.searches, self.url)
+		username = re.match(r'\(\w+=(.*)\)', search_filter).group(1)
+		self.response = [{'dn': dn, 'attributes': {attribute: username for attribute in attributes}} for dn in self.directory.users if dn.endswith(base_dn) and self.directory.username(dn) == username]
+		return bool(self.response)
+
+	def unbind(self):
+		self.closed = True
@@ -0,0 +1,99 @@
+from time import perf_counter
+from unittest import mock
+
+from django.test import TestCase, override_settings, RequestFactory
+
+from NEMO.ldap_pool import LDAPDirectory
+from NEMO.models import User
+from NEMO.tests.test_ldap.fake_directory import FakeDirectory
+from NEMO.views.authentication import LDAPAuthenticationBackend
+
+users = {'uid=mctest,ou=people,dc=example,dc=org': 'secret', 'uid=other,ou=people,dc=example,dc=org': 'other'}
+search_server = {'url': 'search.example.org', 'bind_as_authentication': False, 'bind_username': 'service', 'bind_password': 'service', 'base_dn': 'dc=example,dc=org', 'search_attribute': 'uid'}
+dead_server = {'url': 'dead.example.org'}
+bind_server = {'url': 'bind.example.org', 'domain': 'EXAMPLE'}
+
+
+class LDAPDirectoryTestCase(TestCase):
+
+	def setUp(self):
+		self.fake = FakeDirectory(dict(users))
+		self.directory = LDAPDirectory(connection_factory=self.fake.connect)
+
+	def tearDown(self):
+		self.directory.close()
+
+	@override_settings(LDAP_SERVERS=[bind_server])
+	def test_bind_as_authentication(self):
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertFalse(self.directory.authenticate('mctest', 'wrong'))
+		self.assertFalse(self.directory.authenticate('nobody', 'secret'))
+		self.assertEqual(self.fake.binds['bind.example.org'], 3)
+
+	@override_settings(LDAP_SERVERS=[search_server], LDAP_DN_CACHE_TIMEOUT=0)
+	def test_service_connection_is_reused(self):
+		for i in range(3):
+			self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertFalse(self.directory.authenticate('nobody', 'secret'))
+		self.assertFalse(self.directory.authenticate('other', 'secret'))
+		self.assertEqual(self.fake.searches['search.example.org'], 5)
+		# One service connection, and one connection for each user bind
+		self.assertEqual(self.fake.connections['search.example.org'], 1 + 4)
+		self.assertEqual(self.directory.statistics()['search.example.org:636']['connections_opened'], 1)
+		# A service connection closed by the server is replaced
+		self.directory.get_state(search_server).idle_connections.queue[0].unbind()
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertEqual(self.directory.statistics()['search.example.org:636']['connections_opened'], 2)
+
+	@override_settings(LDAP_SERVERS=[search_server])
+	def test_dn_is_cached(self):
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertFalse(self.directory.authenticate('mctest', 'wrong'))
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertEqual(self.fake.searches['search.example.org'], 2)
+		# The user was moved in the directory, the cached dn no longer works
+		self.fake.users = {'uid=mctest,ou=staff,dc=example,dc=org': 'secret'}
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertEqual(self.fake.searches['search.example.org'], 3)
+
+	@override_settings(LDAP_SERVERS=[dead_server, bind_server], LDAP_CIRCUIT_BREAKER_THRESHOLD=2)
+	def test_dead_server_is_skipped(self):
+		self.fake.down.add('dead.example.org')
+		self.fake.delays['dead.example.org'] = 0.05
+		start = perf_counter()
+		for i in range(20):
+			self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		# The dead server only delays the logins until its circuit opens
+		self.assertLess(perf_counter() - start, 0.05 * 5)
+		self.assertEqual(self.directory.statistics()['dead.example.org:636']['failures'], 1)
+		self.assertTrue(self.directory.statistics()['bind.example.org:636']['available'])
+		self.assertEqual(self.directory.ordered_servers(), [bind_server, dead_server])
+
+	@override_settings(LDAP_SERVERS=[dead_server], LDAP_CIRCUIT_BREAKER_THRESHOLD=2)
+	def test_circuit_opens_after_consecutive_failures(self):
+		self.fake.down.add('dead.example.org')
+		self.assertFalse(self.directory.authenticate('mctest', 'secret'))
+		self.assertTrue(self.directory.statistics()['dead.example.org:636']['available'])
+		self.assertFalse(self.directory.authenticate('mctest', 'secret'))
+		self.assertFalse(self.directory.statistics()['dead.example.org:636']['available'])
+		# When every server is skipped, they are all tried anyway
+		self.fake.down.clear()
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertTrue(self.directory.statistics()['dead.example.org:636']['available'])
+
+	@override_settings(LDAP_SERVERS=[{'url': 'slow.example.org'}, {'url': 'fast.example.org'}])
+	def test_fastest_server_first(self):
+		self.fake.delays['slow.example.org'] = 0.05
+		# A wrong password is tried on every server, which measures them all
+		self.assertFalse(self.directory.authenticate('mctest', 'wrong'))
+		self.assertEqual([server['url'] for server in self.directory.ordered_servers()], ['fast.example.org', 'slow.example.org'])
+		self.assertTrue(self.directory.authenticate('mctest', 'secret'))
+		self.assertEqual(self.fake.binds, {'slow.example.org': 1, 'fast.example.org': 2})
+
+	@override_settings(LDAP_SERVERS=[search_server])
+	def test_authentication_backend(self):
+		User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		with mock.patch('NEMO.ldap_pool.directory', self.directory):
+			request = RequestFactory().post('/login/')
+			self.assertEqual(LDAPAuthenticationBackend().authenticate(request, 'mctest', 'secret').username, 'mctest')
+			self.assertIsNone(LDAPAuthenticationBackend().authenticate(request, 'mctest', 'wrong'))
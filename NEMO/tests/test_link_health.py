@@ -0,0 +1,55 @@
+from time import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from NEMO.link_health import get_reachable_urls, link_health_cache_key, link_probe_lock_cache_key
+from NEMO.tests.test_utilities import wait_for
+
+
+@mock.patch('NEMO.link_health.requests.head')
+class LinkHealthTestCase(SimpleTestCase):
+
+	def setUp(self):
+		cache.clear()
+
+	def probed(self, url):
+		return cache.get(link_health_cache_key(url)) is not None
+
+	def test_links_are_probed_in_the_background(self, head):
+		head.side_effect = lambda url, timeout: mock.Mock(status_code=404 if 'broken' in url else 200)
+		urls = ['https://example.org/', 'https://broken.example.org/', '/calendar/', '/not_a_page/']
+		# Not probed yet, the external links are displayed
+		self.assertEqual(get_reachable_urls(urls), {'https://example.org/', 'https://broken.example.org/', '/calendar/'})
+		self.assertTrue(wait_for(lambda: self.probed('https://example.org/') and self.probed('https://broken.example.org/')))
+		self.assertEqual(get_reachable_urls(urls), {'https://example.org/', '/calendar/'})
+		self.assertEqual(head.call_count, 2)
+
+	@override_settings(LANDING_LINK_HEALTH_TTL=60)
+	def test_stale_verdict_is_used_while_probing_again(self, head):
+		head.return_value = mock.Mock(status_code=200)
+		url = 'https://example.org/'
+		cache.set(link_health_cache_key(url), (False, time() - 120))
+		self.assertEqual(get_reachable_urls([url]), set())
+		self.assertTrue(wait_for(lambda: cache.get(link_health_cache_key(url))[0]))
+		self.assertEqual(get_reachable_urls([url]), {url})
+		self.assertEqual(head.call_count, 1)
+
+	def test_unreachable_server(self, head):
+		head.side_effect = ConnectionError('no route to host')
+		url = 'https://example.org/'
+		get_reachable_urls([url])
+		self.assertTrue(wait_for(lambda: self.probed(url)))
+		self.assertEqual(get_reachable_urls([url]), set())
+
+	@mock.patch('NEMO.link_health.executor.submit', return_value=False)
+	def test_probe_is_dropped_when_the_executor_is_busy(self, submit, head):
+		url = 'https://example.org/'
+		self.assertEqual(get_reachable_urls([url]), {url})
+		self.assertTrue(submit.call_args[1]['drop_when_full'])
+		# Probed by a later page
+		self.assertIsNone(cache.get(link_probe_lock_cache_key(url)))
+		get_reachable_urls([url])
+		self.assertEqual(submit.call_count, 2)
+		head.assert_not_called()
@@ -0,0 +1,52 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, News, SafetyIssue, Notification
+from NEMO.tests.test_utilities import login_as_user
+from NEMO.views.notifications import create_news_notification, create_safety_notification, get_notificaiton_counts
+
+
+class NotificationTestCase(TestCase):
+
+	def setUp(self):
+		for i in range(5):
+			User.objects.create(username=f'user_{i}', first_name='Testy', last_name=f'McTester {i}', is_staff=i < 2)
+		User.objects.create(username='inactive', first_name='Inactive', last_name='User', is_active=False)
+		now = timezone.now()
+		self.story = News.objects.create(title='News', created=now, original_content='News', all_content='News', last_updated=now, last_update_content='News', update_count=0)
+		self.issue = SafetyIssue.objects.create(location='Lab', concern='Spill')
+
+	@mock.patch('NEMO.views.notifications.notification_batch_size', 2)
+	def test_notifications_are_inserted_in_batches(self):
+		with CaptureQueriesContext(connection) as queries:
+			create_news_notification(self.story)
+		self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+		self.assertEqual(Notification.objects.count(), 5)
+		# Publishing the story again replaces its notifications
+		create_news_notification(self.story)
+		create_safety_notification(self.issue)
+		self.assertEqual(Notification.objects.count(), 7)
+		staff = User.objects.get(username='user_0')
+		self.assertEqual(get_notificaiton_counts(staff), {Notification.Types.NEWS: 1, Notification.Types.SAFETY: 1})
+		self.assertEqual(get_notificaiton_counts(User.objects.get(username='user_4')), {Notification.Types.NEWS: 1, Notification.Types.SAFETY: 0})
+
+	def test_counts_are_read_in_one_query(self):
+		user = login_as_user(self.client)
+		get_notificaiton_counts(user)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(get_notificaiton_counts(user), {Notification.Types.NEWS: 0, Notification.Types.SAFETY: 0})
+		self.assertEqual(len(queries), 1)
+		self.assertEqual(self.client.get(reverse('landing')).status_code, 200)
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('landing'))
+		create_news_notification(self.story)
+		create_safety_notification(self.issue)
+		with CaptureQueriesContext(connection) as more_notifications_queries:
+			response = self.client.get(reverse('landing'))
+		self.assertEqual(response.context['notification_counts'], {Notification.Types.NEWS: 1, Notification.Types.SAFETY: 0})
+		self.assertEqual(len(queries), len(more_notifications_queries))
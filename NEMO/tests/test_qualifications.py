@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from NEMO.models import Area, MembershipHistory, PhysicalAccessLevel, Tool, User
+from NEMO.tests.test_utilities import login_as_staff
+
+
+class QualificationsTestCase(TestCase):
+
+	def setUp(self):
+		self.staff = login_as_staff(self.client)
+		self.access_level = PhysicalAccessLevel.objects.create(name='cleanroom', area=Area.objects.create(name='Cleanroom', welcome_message='Welcome'), schedule=PhysicalAccessLevel.Schedule.ALWAYS)
+		self.saw = Tool.objects.create(name='Dicing Saw', _operational=True, _grant_physical_access_level_upon_qualification=self.access_level)
+		self.pecvd = Tool.objects.create(name='PECVD', _operational=True, _grant_badge_reader_access_upon_qualification='Deposition')
+		self.tools = [self.saw, self.pecvd]
+
+	def create_users(self, count, start=0):
+		return [User.objects.create(username=f'user{i}', first_name='Testy', last_name=f'McTester {i}', domain='example') for i in range(start, start + count)]
+
+	def modify_qualifications(self, action, users, tools):
+		return self.client.post(reverse('modify_qualifications'), {'action': action, 'chosen_user[]': [user.id for user in users], 'chosen_tool[]': [tool.id for tool in tools]})
+
+	def history(self, action):
+		return set(MembershipHistory.objects.filter(action=action).values_list('parent_object_id', 'child_object_id'))
+
+	def test_qualify_and_disqualify(self):
+		users = self.create_users(3)
+		users[0].qualifications.add(self.saw)
+		self.assertEqual(self.modify_qualifications('qualify', users, self.tools).status_code, 200)
+		for user in users:
+			self.assertEqual(set(user.qualifications.all()), {self.saw, self.pecvd})
+			self.assertEqual(list(user.physical_access_levels.all()), [self.access_level])
+		# Only the changes are recorded
+		added = {(self.saw.id, user.id) for user in users[1:]} | {(self.pecvd.id, user.id) for user in users} | {(self.access_level.id, user.id) for user in users}
+		self.assertEqual(self.history(MembershipHistory.Action.ADDED), added)
+		users[2].qualifications.remove(self.pecvd)
+		self.modify_qualifications('disqualify', users, [self.pecvd])
+		self.assertEqual(self.history(MembershipHistory.Action.REMOVED), {(self.pecvd.id, users[0].id), (self.pecvd.id, users[1].id)})
+		for user in users:
+			self.assertEqual(list(user.qualifications.all()), [self.saw])
+
+	def test_query_count_does_not_grow_with_the_users(self):
+		self.modify_qualifications('qualify', self.create_users(2), self.tools)
+		users = self.create_users(2, start=2)
+		with CaptureQueriesContext(connection) as queries:
+			self.modify_qualifications('qualify', users, self.tools)
+		query_count = len(queries)
+		users = self.create_users(20, start=4)
+		with CaptureQueriesContext(connection) as queries:
+			self.modify_qualifications('qualify', users, self.tools)
+		self.assertEqual(len(queries), query_count)
+
+	@override_settings(IDENTITY_SERVICE={'available': True, 'url': 'https://identity.example.org/', 'domains': [], 'timeout': 3})
+	@mock.patch('NEMO.views.qualifications.requests.Session.put')
+	def test_badge_reader_access_is_requested(self, put):
+		users = self.create_users(10)
+		self.modify_qualifications('qualify', users, self.tools)
+		self.assertEqual(put.call_count, 10)
+		self.assertEqual(sorted(call[1]['data']['username'] for call in put.call_args_list), sorted(user.username for user in users))
+		for call in put.call_args_list:
+			self.assertEqual(call[0][0], 'https://identity.example.org/add/')
+			self.assertEqual(call[1]['data']['requested_area'], 'Deposition')
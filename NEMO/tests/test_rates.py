@@ -0,0 +1,66 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from NEMO.models import User, Tool, Consumable, get_tool_family
+from NEMO.rates import NISTRates
+
+
+# Outside of a test transaction, so the tool family loaded is cached
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class NISTRatesTestCase(TransactionTestCase):
+
+	def setUp(self):
+		self.directory = TemporaryDirectory()
+		self.rates_file = os.path.join(self.directory.name, 'rates.json')
+		self.rates_settings = override_settings(RATES_FILE=self.rates_file)
+		self.rates_settings.enable()
+		owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		self.tool = Tool.objects.create(name='test_tool', primary_owner=owner)
+		self.child_tool = Tool.objects.create(name='child_tool', parent_tool=self.tool, visible=False)
+		self.other_tool = Tool.objects.create(name='other_tool', primary_owner=owner)
+		self.consumable = Consumable.objects.create(name='Gloves', quantity=10, reminder_threshold=1, reminder_email='test@example.org')
+
+	def tearDown(self):
+		self.rates_settings.disable()
+		self.directory.cleanup()
+
+	def write_rates(self, rates, modified_time):
+		with open(self.rates_file, 'w') as rates_file:
+			json.dump(rates, rates_file)
+		os.utime(self.rates_file, (modified_time, modified_time))
+
+	def tool_rate(self, tool, rate, rate_class='full cost', table_id='primetime_eq_hourly_rate'):
+		return {'table_id': table_id, 'rate_class': rate_class, 'item_id': tool.id, 'rate': rate}
+
+	def test_rates(self):
+		rates = NISTRates()
+		rates.load_rates()
+		self.assertIsNone(rates.get_tool_rates([self.tool]))
+		self.write_rates([
+			self.tool_rate(self.tool, 100),
+			self.tool_rate(self.tool, 50, 'cost shared'),
+			self.tool_rate(self.tool, 200),
+			self.tool_rate(self.child_tool, 150),
+			self.tool_rate(self.tool, 30, table_id='training_individual_hourly_rate'),
+			{'table_id': 'inventory_rate', 'rate_class': 'full cost', 'item_id': self.consumable.id, 'rate': 2.5},
+		], 1000)
+		get_tool_family()
+		with CaptureQueriesContext(connection) as queries:
+			tool_rates = rates.get_tool_rates([self.tool, self.other_tool])
+		self.assertEqual(len(queries), 0)
+		self.assertEqual(tool_rates[self.tool.name], "Tool rates:<br> test_tool: Full Cost <b>$100.00</b> Shared Cost <b>$50.00</b><br> child_tool: Full Cost <b>$150.00</b><br>Training rates: Individual <b>$30.00</b>")
+		self.assertIsNone(tool_rates[self.other_tool.name])
+		self.assertEqual(rates.get_tool_rate(self.tool), tool_rates[self.tool.name])
+		self.assertEqual(rates.get_consumable_rates([self.consumable]), {'Gloves': "Cost <b>$2.50</b>"})
+
+		# The rates are loaded again when a new rates file is uploaded
+		self.write_rates([self.tool_rate(self.other_tool, 10)], 2000)
+		self.assertEqual(rates.get_tool_rate(self.other_tool), "Tool rates: Full Cost <b>$10.00</b>")
+		self.assertIsNone(rates.get_tool_rate(self.tool))
+		os.remove(self.rates_file)
+		self.assertIsNone(rates.get_tool_rates([self.other_tool]))
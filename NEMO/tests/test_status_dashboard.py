@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, Tool, Account, Project, UsageEvent, Task, Resource, ScheduledOutage, CacheVersion
+from NEMO.tests.test_utilities import login_as_user
+from NEMO.views.status_dashboard import create_tool_summary, invalidate_tool_summary
+
+
+# Outside of a test transaction, so the summary built is cached
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class ToolSummaryTestCase(TransactionTestCase):
+
+	def setUp(self):
+		invalidate_tool_summary()
+		self.owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		self.tool = Tool.objects.create(name='test_tool', primary_owner=self.owner, _operational=True)
+		self.child_tool = Tool.objects.create(name='child_tool', parent_tool=self.tool, visible=False)
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+
+	def tearDown(self):
+		invalidate_tool_summary()
+
+	def get_tool_status(self):
+		return next(tool for tool in create_tool_summary() if tool['id'] == self.tool.id)
+
+	def test_summary_is_served_from_cache(self):
+		create_tool_summary()
+		with CaptureQueriesContext(connection) as queries:
+			create_tool_summary()
+		self.assertEqual(len(queries), 0)
+		login_as_user(self.client)
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('refresh_sidebar_icons'))
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse([query for query in queries if 'NEMO_usageevent' in query['sql']])
+
+	def test_summary_is_invalidated_on_save(self):
+		self.assertFalse(self.get_tool_status()['in_use'])
+		event = UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.child_tool)
+		self.assertTrue(self.get_tool_status()['in_use'])
+		self.assertEqual(self.get_tool_status()['name'], 'child_tool')
+		event.end = timezone.now()
+		event.save()
+		self.assertFalse(self.get_tool_status()['in_use'])
+		self.assertEqual(self.get_tool_status()['name'], 'test_tool')
+
+		task = Task.objects.create(tool=self.tool, urgency=Task.Urgency.HIGH, creator=self.owner, force_shutdown=False, safety_hazard=False)
+		self.assertTrue(self.get_tool_status()['problematic'])
+		task.delete()
+		self.assertFalse(self.get_tool_status()['problematic'])
+
+		resource = Resource.objects.create(name='power', available=False)
+		resource.fully_dependent_tools.add(self.tool)
+		self.assertTrue(self.get_tool_status()['required_resource_is_unavailable'])
+		resource.available = True
+		resource.save()
+		self.assertFalse(self.get_tool_status()['required_resource_is_unavailable'])
+
+		ScheduledOutage.objects.create(title="Outage", resource=resource, start=timezone.now() - timedelta(minutes=5), end=timezone.now() + timedelta(hours=1), creator=self.owner)
+		self.assertTrue(self.get_tool_status()['scheduled_outage'])
+
+	def test_summary_is_built_again_by_every_process(self):
+		self.assertFalse(self.get_tool_status()['in_use'])
+		# Changed by another process: the database changes but the signals are not received here
+		UsageEvent.objects.bulk_create([UsageEvent(user=self.owner, operator=self.owner, project=self.project, tool=self.tool)])
+		self.assertFalse(self.get_tool_status()['in_use'])
+		CacheVersion.objects.filter(name='tool_summary').update(version='changed')
+		with override_settings(CACHE_VERSION_MAX_AGE=0):
+			self.assertTrue(self.get_tool_status()['in_use'])
@@ -0,0 +1,79 @@
+from threading import Event, current_thread
+from time import monotonic
+
+from django.test import SimpleTestCase, override_settings
+
+from NEMO.tasks import JobExecutor
+from NEMO.tests.test_utilities import wait_for
+
+
+@override_settings(POSTPONED_TASKS_RETRY_DELAY=0.05)
+class JobExecutorTestCase(SimpleTestCase):
+
+	def setUp(self):
+		self.executor = JobExecutor(worker_count=2, queue_size=4)
+
+	def tearDown(self):
+		self.executor.stop()
+
+	def test_jobs_run_in_the_worker_threads(self):
+		threads = set()
+		for i in range(4):
+			self.executor.submit(lambda: threads.add(current_thread().name))
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['completed'] == 4))
+		self.assertTrue(threads <= {'postponed_tasks_0', 'postponed_tasks_1'})
+		self.assertEqual(self.executor.statistics()['failures'], 0)
+
+	def test_failing_job_is_tried_again(self):
+		attempts = []
+
+		def flaky(succeed_after):
+			attempts.append(monotonic())
+			if len(attempts) <= succeed_after:
+				raise ConnectionError('mail server unavailable')
+
+		self.executor.submit(flaky, [2])
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['completed'] == 1))
+		self.assertEqual(len(attempts), 3)
+		# The delay doubles with each retry
+		self.assertGreaterEqual(attempts[1] - attempts[0], 0.05)
+		self.assertGreaterEqual(attempts[2] - attempts[1], 0.1)
+		statistics = self.executor.statistics()
+		self.assertEqual(statistics['retried'], 2)
+		self.assertEqual(statistics['failures'], 0)
+		self.executor.submit(flaky, [100], retries=1)
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['completed'] == 2))
+		self.assertEqual(self.executor.statistics()['failures'], 1)
+		self.assertEqual(len(attempts), 5)
+
+	def test_full_queue_runs_the_job_in_the_caller(self):
+		release = Event()
+		callers = []
+		for i in range(2):
+			self.executor.submit(release.wait)
+		# Both threads are busy once the queue is empty again
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['queue_depth'] == 0))
+		for i in range(4):
+			self.executor.submit(release.wait)
+		self.executor.submit(lambda: callers.append(current_thread()))
+		self.assertEqual(callers, [current_thread()])
+		statistics = self.executor.statistics()
+		self.assertEqual(statistics['ran_in_caller'], 1)
+		self.assertGreater(statistics['queue_depth'], 0)
+		release.set()
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['completed'] == 7))
+
+	def test_full_queue_drops_the_job_that_can_be_dropped(self):
+		release = Event()
+		callers = []
+		for i in range(2):
+			self.executor.submit(release.wait)
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['queue_depth'] == 0))
+		for i in range(4):
+			self.assertTrue(self.executor.submit(release.wait, drop_when_full=True))
+		self.assertFalse(self.executor.submit(lambda: callers.append(current_thread()), drop_when_full=True))
+		release.set()
+		self.assertTrue(wait_for(lambda: self.executor.statistics()['completed'] == 6))
+		self.assertEqual(callers, [])
+		statistics = self.executor.statistics()
+		self.assertEqual((statistics['dropped'], statistics['ran_in_caller']), (1, 0))
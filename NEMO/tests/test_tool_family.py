@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from NEMO.models import User, Tool, Account, Project, UsageEvent, CacheVersion, get_tool_family, invalidate_tool_family
+from NEMO.tests.test_utilities import login_as
+
+
+# Outside of a test transaction, so the tool family loaded is cached and not read again while the tests run
+@override_settings(CACHE_VERSION_MAX_AGE=60)
+class ToolFamilyTestCase(TransactionTestCase):
+
+	def setUp(self):
+		self.owner = User.objects.create(username='mctest', first_name='Testy', last_name='McTester', is_staff=True)
+		self.project = Project.objects.create(name="project1", account=Account.objects.create(name="account1"))
+		self.owner.projects.add(self.project)
+		self.tool = Tool.objects.create(name='parent_tool', primary_owner=self.owner, _operational=True, _category='Imaging', _location='room 1', _allow_delayed_logoff=True)
+		self.child_tool = Tool.objects.create(name='child_tool', parent_tool=self.tool, visible=False)
+
+	def add_child_tools(self, count):
+		for i in range(count):
+			Tool.objects.create(name=f'alternate_tool_{i}', parent_tool=self.tool, visible=False)
+
+	def test_family_is_resolved_from_memory(self):
+		get_tool_family()
+		child_tool = Tool.objects.get(id=self.child_tool.id)
+		tool = Tool.objects.get(id=self.tool.id)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertTrue(child_tool.is_child_tool())
+			self.assertEqual(child_tool.operational, True)
+			self.assertEqual(child_tool.location, 'room 1')
+			self.assertEqual(child_tool.category, 'Imaging')
+			self.assertEqual(child_tool.tool_or_parent_id(), self.tool.id)
+			self.assertEqual(sorted(child_tool.get_family_tool_ids()), sorted([self.child_tool.id, self.tool.id]))
+			self.assertTrue(tool.is_parent_tool())
+			self.assertFalse(child_tool.is_parent_tool())
+			self.assertEqual(sorted(tool.get_family_tool_ids()), sorted([self.child_tool.id, self.tool.id]))
+		self.assertEqual(len(queries), 0)
+
+	def test_family_is_reloaded_when_a_tool_changes(self):
+		self.assertEqual(len(self.tool.get_family_tool_ids()), 2)
+		self.add_child_tools(1)
+		self.assertEqual(len(self.tool.get_family_tool_ids()), 3)
+		self.tool.location = 'room 2'
+		self.tool.save()
+		self.assertEqual(Tool.objects.get(id=self.child_tool.id).location, 'room 2')
+		Tool.objects.get(name='alternate_tool_0').delete()
+		self.assertEqual(len(self.tool.get_family_tool_ids()), 2)
+		# Tools changed without signals are picked up after an explicit invalidation
+		Tool.objects.filter(id=self.child_tool.id).update(parent_tool=None)
+		invalidate_tool_family()
+		self.assertFalse(self.tool.is_parent_tool())
+
+	def test_family_is_not_published_before_the_transaction_is_committed(self):
+		self.assertTrue(self.tool.is_parent_tool())
+		with transaction.atomic():
+			self.child_tool.parent_tool = None
+			self.child_tool.save()
+			self.assertFalse(self.tool.is_parent_tool())
+			transaction.set_rollback(True)
+		# The change was rolled back, so the family loaded in the transaction was never published
+		self.assertTrue(self.tool.is_parent_tool())
+
+	def test_family_is_reloaded_when_another_process_changes_a_tool(self):
+		self.assertTrue(self.tool.is_parent_tool())
+		# Saved by another process: the database changes but the signals are not received here
+		Tool.objects.filter(id=self.child_tool.id).update(parent_tool=None)
+		CacheVersion.objects.filter(name='tool_family').update(version='changed')
+		self.assertTrue(self.tool.is_parent_tool())
+		with override_settings(CACHE_VERSION_MAX_AGE=0):
+			self.assertFalse(self.tool.is_parent_tool())
+
+	def test_tool_status_shows_the_name_of_the_child_tool_in_use(self):
+		login_as(self.client, self.owner)
+		self.child_tool.visible = True
+		self.child_tool.save()
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.child_tool, start=timezone.now() - timedelta(hours=1))
+		self.assertContains(self.client.get(reverse('tool_status', args=[self.tool.id])), '<h1 class="pull-left" style="margin-right:20px; margin-top:0; margin-bottom:10px">child_tool</h1>')
+		UsageEvent.objects.all().delete()
+		# The child tool page keeps its own name while the parent tool is in use
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.tool, start=timezone.now() - timedelta(hours=1))
+		self.assertContains(self.client.get(reverse('tool_status', args=[self.child_tool.id])), '<h1 class="pull-left" style="margin-right:20px; margin-top:0; margin-bottom:10px">child_tool</h1>')
+
+	def test_tool_control_and_calendar_query_count(self):
+		login_as(self.client, self.owner)
+		UsageEvent.objects.create(user=self.owner, operator=self.owner, project=self.project, tool=self.child_tool, start=timezone.now() - timedelta(hours=1))
+		pages = [
+			reverse('tool_control', args=[self.tool.id]),
+			reverse('tool_status', args=[self.tool.id]),
+			reverse('calendar', args=[self.tool.id]),
+			reverse('event_feed') + f"?event_type=nanofab usage&tool_id={self.tool.id}&start={timezone.now().strftime('%Y-%m-%d')}&end={(timezone.now() + timedelta(days=7)).strftime('%Y-%m-%d')}",
+		]
+		query_counts = []
+		for child_tool_count in [0, 10]:
+			self.add_child_tools(child_tool_count)
+			get_tool_family()
+			counts = []
+			for page in pages:
+				with CaptureQueriesContext(connection) as queries:
+					response = self.client.get(page)
+				self.assertEqual(response.status_code, 200)
+				counts.append(len(queries))
+				# the tool family is never queried
+				self.assertFalse([query for query in queries if 'WHERE "NEMO_tool"."parent_tool_id"' in query['sql']], page)
+			query_counts.append(counts)
+		# Alternate tools don't add queries
+		self.assertEqual(query_counts[0], query_counts[1])
+		self.assertLessEqual(query_counts[0][1], 35)
@@ -0,0 +1,57 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from NEMO.models import Account, Project, Tool, UsageEvent, User
+from NEMO.widgets.tool_tree import ToolTree, get_tool_tree
+
+
+class ToolTreeTestCase(TestCase):
+
+	def setUp(self):
+		self.saw = Tool.objects.create(name='Dicing Saw', _category='Packaging', _operational=True)
+		self.pecvd = Tool.objects.create(name='PECVD', _category='Deposition/CVD', _operational=True)
+		self.sinter = Tool.objects.create(name='Sinter', _category='Gen Furnaces', _operational=True)
+		self.user = User.objects.create(username='mctest', first_name='Testy', last_name='McTester')
+		self.user.qualifications.add(self.saw)
+
+	def tools(self):
+		return Tool.objects.filter(visible=True).order_by('_category', 'name')
+
+	def render(self, user):
+		return ToolTree().render(None, {'tools': self.tools(), 'user': user})
+
+	def test_render(self):
+		html = self.render(self.user)
+		self.assertTrue(html.startswith('<ul class="nav nav-list" id="tool_tree" style="display:none"><li><label class="tree-toggler nav-header"><div>Deposition</div></label><ul class="nav nav-list tree" data-category="Deposition"><li><label class="tree-toggler nav-header"><div>CVD</div></label>'))
+		self.assertIn(f'data-tool-id="{self.saw.id}" data-type="tool link" >Dicing Saw</a>', html)
+		self.assertIn(f'data-tool-id="{self.pecvd.id}" data-type="tool link" class="disabled">PECVD</a>', html)
+		staff = User.objects.create(username='staff', first_name='Staff', last_name='Member', is_staff=True)
+		self.assertNotIn('disabled', self.render(staff))
+
+	def test_parent_tool_is_listed_under_the_name_of_the_child_in_use(self):
+		child = Tool.objects.create(name='Saw blade B', parent_tool=self.saw, visible=False)
+		project = Project.objects.create(name='project1', account=Account.objects.create(name='account1'))
+		UsageEvent.objects.create(user=self.user, operator=self.user, project=project, tool=child, start=timezone.now())
+		self.assertIn(f'data-tool-id="{self.saw.id}" data-type="tool link" >Saw blade B</a>', self.render(self.user))
+
+	def test_tree_is_built_once(self):
+		tree = get_tool_tree(list(self.tools()))
+		self.assertIs(get_tool_tree(list(self.tools())), tree)
+		self.sinter.name = 'Annealer'
+		self.sinter.save()
+		tree = get_tool_tree(list(self.tools()))
+		self.assertIn('Annealer', str(tree))
+		# Changed without saving the tool, by another process for example
+		Tool.objects.filter(id=self.sinter.id).update(_category='Furnaces')
+		tree = get_tool_tree(list(self.tools()))
+		self.assertIn('Furnaces', str(tree))
+		self.assertNotIn('Gen Furnaces', str(tree))
+		for i in range(20):
+			self.user.qualifications.add(Tool.objects.create(name=f'Tool {i}', _category=f'Category {i % 3}', _operational=True))
+		self.render(self.user)
+		# The tools, the qualifications and the tools in use, however many tools and qualifications there are
+		with CaptureQueriesContext(connection) as queries:
+			self.render(self.user)
+		self.assertEqual(len(queries), 3)
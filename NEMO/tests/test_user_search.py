@@ -0,0 +1,65 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from NEMO.models import User
+from NEMO.tests.test_utilities import login_as_staff, login_as_user, test_response_is_landing_page
+
+
+class UserSearchTestCase(TestCase):
+
+	def setUp(self):
+		self.ada = User.objects.create(username='alovelace', first_name='Ada', last_name='Lovelace', badge_number=1815)
+		self.alan = User.objects.create(username='aturing', first_name='Alan', last_name='Turing', badge_number=1912)
+		self.grace = User.objects.create(username='ghopper', first_name='Grace', last_name='Hopper', is_active=False)
+
+	def search(self, **parameters):
+		response = self.client.get(reverse('search_users'), parameters)
+		self.assertEqual(response.status_code, 200)
+		return response.json()
+
+	def names(self, **parameters):
+		return [result['name'] for result in self.search(**parameters)['results']]
+
+	def test_search(self):
+		staff = login_as_staff(self.client)
+		self.assertEqual(self.names(query='a'), ['Ada Lovelace (alovelace)', 'Alan Turing (aturing)'])
+		self.assertEqual(self.names(query='HOP'), ['Grace Hopper (ghopper)'])
+		self.assertEqual(self.names(query='ada love'), ['Ada Lovelace (alovelace)'])
+		self.assertEqual(self.names(query='1912'), ['Alan Turing (aturing)'])
+		# Too long to be a badge number, or not made of decimal digits
+		self.assertEqual(self.names(query='9' * 25), [])
+		self.assertEqual(self.names(query='²'), [])
+		# Prefixes only
+		self.assertEqual(self.names(query='uring'), [])
+		self.assertEqual(self.names(query=''), [])
+		self.assertEqual(self.names(query='g', active='true'), [])
+		self.assertEqual(self.names(query='test', exclude=staff.id), [])
+
+	def test_paging(self):
+		login_as_staff(self.client)
+		first_page = self.search(query='a', limit=1)
+		self.assertEqual(first_page['results'], [{'name': 'Ada Lovelace (alovelace)', 'id': self.ada.id}])
+		self.assertTrue(first_page['has_next'])
+		second_page = self.search(query='a', limit=1, page=2)
+		self.assertEqual(second_page['results'], [{'name': 'Alan Turing (aturing)', 'id': self.alan.id}])
+		self.assertFalse(second_page['has_next'])
+		self.assertEqual(self.client.get(reverse('search_users'), {'query': 'a', 'page': 'last'}).status_code, 400)
+
+	def test_names_are_escaped(self):
+		login_as_staff(self.client)
+		User.objects.create(username='mallory', first_name='<script>alert(1)</script>', last_name='Mallory')
+		self.assertEqual(self.names(query='<script>'), ['&lt;script&gt;alert(1)&lt;/script&gt; Mallory (mallory)'])
+
+	def test_search_is_only_for_staff(self):
+		login_as_user(self.client)
+		response = self.client.get(reverse('search_users'), {'query': 'a'}, follow=True)
+		test_response_is_landing_page(self, response)
+
+	def test_user_list_is_not_embedded(self):
+		login_as_staff(self.client)
+		response = self.client.get(reverse('qualifications'))
+		self.assertContains(response, 'Alan Turing')
+		with override_settings(SERVER_SIDE_USER_SEARCH=True):
+			response = self.client.get(reverse('qualifications'))
+		self.assertNotContains(response, 'Alan Turing')
+		self.assertContains(response, "autocomplete('user', create_entry, \"/search_users/?active=true\")")
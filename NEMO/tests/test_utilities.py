@@ -1,4 +1,5 @@
-from typing import List
+from time import monotonic, sleep
+from typing import Callable, List
 
 from django.contrib.auth.models import Permission
 from django.test import Client, TestCase
@@ -47,3 +48,11 @@ def test_response_is_failed_login(test_case: TestCase, response: Response):
 def test_response_is_landing_page(test_case: TestCase, response: Response):
 	test_case.assertEqual(response.status_code, 200)
 	test_case.assertEqual(response.request['PATH_INFO'], "/")
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 3.0) -> bool:
+	""" Waits for a condition met by another thread, returns whether it was met before the timeout. """
+	deadline = monotonic() + timeout
+	while not condition() and monotonic() < deadline:
+		sleep(0.01)
+	return condition()
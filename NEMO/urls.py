@@ -45,6 +45,7 @@ urlpatterns = [
 	url(r'^get_projects/$', get_projects.get_projects, name='get_projects'),
 	url(r'^get_projects_for_tool_control/$', get_projects.get_projects_for_tool_control, name='get_projects_for_tool_control'),
 	url(r'^get_projects_for_self/$', get_projects.get_projects_for_self, name='get_projects_for_self'),
+	url(r'^search_users/$', users.search_users, name='search_users'),
 
 	# Tool control:
 	url(r'^tool_control/(?P<tool_id>\d+)/$', tool_control.tool_control, name='tool_control'),
@@ -189,10 +189,14 @@ def end_of_the_day(t, in_local_timezone=True):
 	return localize(midnight) if in_local_timezone else midnight
 
 
-def send_mail(subject, message, from_email, recipient_list, attachments=None):
+def create_email(subject, message, from_email, recipient_list, attachments=None) -> EmailMessage:
 	mail = EmailMessage(subject=subject, body=message, from_email=from_email, to=recipient_list, attachments=attachments)
 	mail.content_subtype = "html"
-	mail.send()
+	return mail
+
+
+def send_mail(subject, message, from_email, recipient_list, attachments=None):
+	create_email(subject, message, from_email, recipient_list, attachments).send()
 
 
 def create_email_attachment(stream, filename) -> MIMEBase:
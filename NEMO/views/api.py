@@ -1,8 +1,17 @@
+import csv
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
+from io import StringIO
+from itertools import islice
 from typing import List, Dict
 
 from django import forms
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from pytz import utc
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -18,6 +27,7 @@ from NEMO.utilities import localize
 
 
 date_time_format = '%m/%d/%Y %H:%M:%S'
+billing_chunk_size = 2000
 
 class BillingFilterForm(forms.Form):
 	start = forms.DateField(required=True)
@@ -28,6 +38,9 @@ class BillingFilterForm(forms.Form):
 	application_name = forms.CharField(required=False)
 	project_name = forms.CharField(required=False)
 	project_id = forms.IntegerField(required=False)
+	stream = forms.ChoiceField(required=False, choices=[('', 'No'), ('json', 'JSON'), ('csv', 'CSV')])
+	cursor = forms.CharField(required=False)
+	limit = forms.IntegerField(required=False, min_value=1)
 
 	def get_start_date(self):
 		return localize(datetime.combine(self.cleaned_data['start'], datetime.min.time()))
@@ -53,6 +66,15 @@ class BillingFilterForm(forms.Form):
 	def get_application_name(self):
 		return self.cleaned_data['application_name']
 
+	def get_stream(self):
+		return self.cleaned_data['stream']
+
+	def get_cursor(self):
+		return self.cleaned_data['cursor']
+
+	def get_limit(self):
+		return self.cleaned_data['limit']
+
 
 class UserViewSet(ReadOnlyModelViewSet):
 	queryset = User.objects.all()
@@ -109,6 +131,13 @@ def billing(request):
 	if not form.is_valid():
 		return Response(status=status.HTTP_400_BAD_REQUEST, data=form.errors)
 
+	if form.get_stream():
+		try:
+			cursor = decode_billing_cursor(form.get_cursor())
+		except ValueError:
+			return Response(status=status.HTTP_400_BAD_REQUEST, data={'cursor': ['Invalid cursor.']})
+		return stream_billing(form, cursor)
+
 	data :List[Dict] = []
 	usage_events = get_usage_events_for_billing(form)
 	area_access = get_area_access_for_billing(form)
@@ -126,182 +155,185 @@ def billing(request):
 	return Response(serializer.data)
 
 
+billing_item_fields = ['type', 'details', 'account', 'account_id', 'project', 'project_id', 'application', 'username', 'user_id', 'start', 'end', 'quantity']
+
+
+class BillingSource(object):
+	""" Describes how one kind of billable item is fetched with a single joined values() query, and how its rows are turned into billing items. """
+
+	def __init__(self, item_type, model, start_field, end_field, user_field, details_field, quantity, **filters):
+		self.item_type = item_type
+		self.model = model
+		self.start_field = start_field
+		self.end_field = end_field
+		self.user_field = user_field
+		self.details_field = details_field
+		self.quantity = quantity
+		self.filters = filters
+
+	def get_queryset(self, billing_form: BillingFilterForm):
+		queryset = self.model.objects.filter(**self.filters)
+		start, end = billing_form.get_start_date(), billing_form.get_end_date()
+		if self.start_field == self.end_field:
+			queryset = queryset.filter(**{self.start_field + '__gte': start, self.start_field + '__lte': end})
+		else:
+			queryset = queryset.filter(**{self.start_field + '__gte': start, self.end_field + '__lte': end, self.start_field + '__lte': end, self.end_field + '__gte': start})
+		if billing_form.get_account_id():
+			queryset = queryset.filter(project__account_id=billing_form.get_account_id())
+		if billing_form.get_account_name():
+			queryset = queryset.filter(project__account__name=billing_form.get_account_name())
+		if billing_form.get_project_id():
+			queryset = queryset.filter(project__id=billing_form.get_project_id())
+		if billing_form.get_project_name():
+			queryset = queryset.filter(project__name=billing_form.get_project_name())
+		if billing_form.get_application_name():
+			queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
+		if billing_form.get_username():
+			queryset = queryset.filter(**{self.user_field + '__username': billing_form.get_username()})
+		return queryset
+
+	def get_values(self, queryset):
+		fields = ['id', self.start_field, self.end_field, self.details_field, 'project__account__name', 'project__account_id', 'project__name', 'project_id', 'project__application_identifier', self.user_field + '__username', self.user_field + '_id']
+		if isinstance(self.quantity, str):
+			fields.append(self.quantity)
+		return queryset.values(*fields)
+
+	def to_billing_item(self, row) -> Dict:
+		start, end = row[self.start_field], row[self.end_field]
+		return {
+			'type': self.item_type,
+			'details': row[self.details_field],
+			'account': row['project__account__name'],
+			'account_id': row['project__account_id'],
+			'project': row['project__name'],
+			'project_id': row['project_id'],
+			'application': row['project__application_identifier'],
+			'username': row[self.user_field + '__username'],
+			'user_id': row[self.user_field + '_id'],
+			'start': start.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
+			'end': end.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
+			'quantity': row[self.quantity] if isinstance(self.quantity, str) else self.quantity(start, end),
+		}
+
+	def get_billing_items(self, billing_form: BillingFilterForm) -> List[Dict]:
+		return [self.to_billing_item(row) for row in self.get_values(self.get_queryset(billing_form))]
+
+
+def duration_in_minutes(start, end):
+	diff = end - start
+	return str(round(diff.days*1440 + diff.seconds/60, 2))
+
+
+# The order of this list is part of the billing cursor: items with the same time are sorted by source, then by id.
+billing_sources = [
+	BillingSource('tool_usage', UsageEvent, 'start', 'end', 'user', 'tool__name', duration_in_minutes),
+	BillingSource('area_acess', AreaAccessRecord, 'start', 'end', 'customer', 'area__name', duration_in_minutes),
+	BillingSource('consumable', ConsumableWithdraw, 'date', 'date', 'customer', 'consumable__name', 'quantity'),
+	BillingSource('missed_reservation', Reservation, 'start', 'end', 'user', 'tool__name', lambda start, end: 1, missed=True),
+	BillingSource('training_session', TrainingSession, 'date', 'date', 'trainee', 'tool__name', 'duration'),
+]
+
+
 def get_usage_events_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
-	result = []
-	queryset = UsageEvent.objects.filter()
-	start, end = billing_form.get_start_date(), billing_form.get_end_date()
-	queryset = queryset.filter(start__gte=start, end__lte=end, start__lte=end, end__gte=start)
-	if billing_form.get_account_id():
-		queryset = queryset.filter(project__account_id=billing_form.get_account_id())
-	if billing_form.get_account_name():
-		queryset = queryset.filter(project__account__name=billing_form.get_account_name())
-	if billing_form.get_project_id():
-		queryset = queryset.filter(project__id=billing_form.get_project_id())
-	if billing_form.get_project_name():
-		queryset = queryset.filter(project__name=billing_form.get_project_name())
-	if billing_form.get_application_name():
-		queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
-	if billing_form.get_username():
-		queryset = queryset.filter(user__username=billing_form.get_username())
-	usage_event: UsageEvent
-	for usage_event in queryset:
-		diff = usage_event.end - usage_event.start
-		result.append({
-			'type': 'tool_usage',
-			'details': usage_event.tool.name,
-			'account': usage_event.project.account.name,
-			'account_id': usage_event.project.account_id,
-			'project': usage_event.project.name,
-			'project_id': usage_event.project_id,
-			'application': usage_event.project.application_identifier,
-			'username': usage_event.user.username,
-			'user_id': usage_event.user_id,
-			'start': usage_event.start.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'end': usage_event.end.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'quantity': str(round(diff.days*1440 + diff.seconds/60, 2))
-		})
-	return result
+	return billing_sources[0].get_billing_items(billing_form)
+
 
 def get_area_access_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
-	result = []
-	queryset = AreaAccessRecord.objects.filter()
-	start, end = billing_form.get_start_date(), billing_form.get_end_date()
-	queryset = queryset.filter(start__gte=start, end__lte=end, start__lte=end, end__gte=start)
-	if billing_form.get_account_id():
-		queryset = queryset.filter(project__account_id=billing_form.get_account_id())
-	if billing_form.get_account_name():
-		queryset = queryset.filter(project__account__name=billing_form.get_account_name())
-	if billing_form.get_project_id():
-		queryset = queryset.filter(project__id=billing_form.get_project_id())
-	if billing_form.get_project_name():
-		queryset = queryset.filter(project__name=billing_form.get_project_name())
-	if billing_form.get_application_name():
-		queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
-	if billing_form.get_username():
-		queryset = queryset.filter(customer__username=billing_form.get_username())
-	area_access_record: AreaAccessRecord
-	for area_access_record in queryset:
-		diff = area_access_record.end - area_access_record.start
-		result.append({
-			'type': 'area_acess',
-			'details': area_access_record.area.name,
-			'account': area_access_record.project.account.name,
-			'account_id': area_access_record.project.account_id,
-			'project': area_access_record.project.name,
-			'project_id': area_access_record.project_id,
-			'application': area_access_record.project.application_identifier,
-			'username': area_access_record.customer.username,
-			'user_id': area_access_record.customer_id,
-			'start': area_access_record.start.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'end': area_access_record.end.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'quantity': str(round(diff.days*1440 + diff.seconds/60, 2))
-		})
-	return result
+	return billing_sources[1].get_billing_items(billing_form)
 
 
-def get_missed_reservations_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
-	result = []
-	queryset = Reservation.objects.filter(missed=True)
-	start, end = billing_form.get_start_date(), billing_form.get_end_date()
-	queryset = queryset.filter(start__gte=start, end__lte=end, start__lte=end, end__gte=start)
-	if billing_form.get_account_id():
-		queryset = queryset.filter(project__account_id=billing_form.get_account_id())
-	if billing_form.get_account_name():
-		queryset = queryset.filter(project__account__name=billing_form.get_account_name())
-	if billing_form.get_project_id():
-		queryset = queryset.filter(project__id=billing_form.get_project_id())
-	if billing_form.get_project_name():
-		queryset = queryset.filter(project__name=billing_form.get_project_name())
-	if billing_form.get_application_name():
-		queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
-	if billing_form.get_username():
-		queryset = queryset.filter(user__username=billing_form.get_username())
-	missed_reservation: Reservation
-	for missed_reservation in queryset:
-		result.append({
-			'type': 'missed_reservation',
-			'details': missed_reservation.tool.name,
-			'account': missed_reservation.project.account.name,
-			'account_id': missed_reservation.project.account_id,
-			'project': missed_reservation.project.name,
-			'project_id': missed_reservation.project_id,
-			'application': missed_reservation.project.application_identifier,
-			'username': missed_reservation.user.username,
-			'user_id': missed_reservation.user_id,
-			'start': missed_reservation.start.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'end': missed_reservation.end.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'quantity': 1
-		})
-	return result
+def get_consumables_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
+	return billing_sources[2].get_billing_items(billing_form)
 
 
-def get_consumables_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
-	result = []
-	queryset = ConsumableWithdraw.objects.filter()
-	start, end = billing_form.get_start_date(), billing_form.get_end_date()
-	queryset = queryset.filter(date__gte=start, date__lte=end)
-	if billing_form.get_account_id():
-		queryset = queryset.filter(project__account_id=billing_form.get_account_id())
-	if billing_form.get_account_name():
-		queryset = queryset.filter(project__account__name=billing_form.get_account_name())
-	if billing_form.get_project_id():
-		queryset = queryset.filter(project__id=billing_form.get_project_id())
-	if billing_form.get_project_name():
-		queryset = queryset.filter(project__name=billing_form.get_project_name())
-	if billing_form.get_application_name():
-		queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
-	if billing_form.get_username():
-		queryset = queryset.filter(customer__username=billing_form.get_username())
-	consumable_withdrawal: ConsumableWithdraw
-	for consumable_withdrawal in queryset:
-		result.append({
-			'type': 'consumable',
-			'details': consumable_withdrawal.consumable.name,
-			'account': consumable_withdrawal.project.account.name,
-			'account_id': consumable_withdrawal.project.account_id,
-			'project': consumable_withdrawal.project.name,
-			'project_id': consumable_withdrawal.project_id,
-			'application': consumable_withdrawal.project.application_identifier,
-			'username': consumable_withdrawal.customer.username,
-			'user_id': consumable_withdrawal.customer_id,
-			'start': consumable_withdrawal.date.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'end': consumable_withdrawal.date.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'quantity': consumable_withdrawal.quantity
-		})
-	return result
+def get_missed_reservations_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
+	return billing_sources[3].get_billing_items(billing_form)
 
 
 def get_training_sessions_for_billing(billing_form: BillingFilterForm) -> List[Dict]:
-	result = []
-	queryset = TrainingSession.objects.filter()
-	start, end = billing_form.get_start_date(), billing_form.get_end_date()
-	queryset = queryset.filter(date__gte=start, date__lte=end)
-	if billing_form.get_account_id():
-		queryset = queryset.filter(project__account_id=billing_form.get_account_id())
-	if billing_form.get_account_name():
-		queryset = queryset.filter(project__account__name=billing_form.get_account_name())
-	if billing_form.get_project_id():
-		queryset = queryset.filter(project__id=billing_form.get_project_id())
-	if billing_form.get_project_name():
-		queryset = queryset.filter(project__name=billing_form.get_project_name())
-	if billing_form.get_application_name():
-		queryset = queryset.filter(project__application_identifier=billing_form.get_application_name())
-	if billing_form.get_username():
-		queryset = queryset.filter(trainee__username=billing_form.get_username())
-	training_session: TrainingSession
-	for training_session in queryset:
-		result.append({
-			'type': 'training_session',
-			'details': training_session.tool.name,
-			'account': training_session.project.account.name,
-			'account_id': training_session.project.account_id,
-			'project': training_session.project.name,
-			'project_id': training_session.project_id,
-			'application': training_session.project.application_identifier,
-			'username': training_session.trainee.username,
-			'user_id': training_session.trainee.id,
-			'start': training_session.date.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'end': training_session.date.astimezone(timezone.get_current_timezone()).strftime(date_time_format),
-			'quantity': training_session.duration
-		})
-	return result
+	return billing_sources[4].get_billing_items(billing_form)
+
+
+def encode_billing_cursor(time: datetime, source_index: int, item_id: int) -> str:
+	value = f"{time.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%S.%f')}|{source_index}|{item_id}"
+	return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_billing_cursor(cursor: str):
+	""" Returns the (time, source index, item id) position of the last billing item of the previous page, or None. Raises ValueError if the cursor is invalid. """
+	if not cursor:
+		return None
+	try:
+		time, source_index, item_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+		position = utc.localize(datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.%f')), int(source_index), int(item_id)
+	except Exception as e:
+		raise ValueError(str(e))
+	if not 0 <= position[1] < len(billing_sources):
+		raise ValueError('Invalid billing source')
+	return position
+
+
+def iterate_billing_source(source_index: int, billing_form: BillingFilterForm, cursor=None):
+	""" Yields the (time, source index, id) position and the billing item of each row of one billing source, in time order, fetched in chunks. """
+	source = billing_sources[source_index]
+	queryset = source.get_queryset(billing_form)
+	if cursor:
+		time, cursor_source_index, cursor_id = cursor
+		# Only keep items after the cursor position. Items at the same time are ordered by source, then by id.
+		after_cursor = Q(**{source.start_field + '__gt': time})
+		if source_index > cursor_source_index:
+			after_cursor |= Q(**{source.start_field: time})
+		elif source_index == cursor_source_index:
+			after_cursor |= Q(**{source.start_field: time, 'id__gt': cursor_id})
+		queryset = queryset.filter(after_cursor)
+	rows = source.get_values(queryset.order_by(source.start_field, 'id'))
+	for row in rows.iterator(chunk_size=billing_chunk_size):
+		yield (row[source.start_field], source_index, row['id']), source.to_billing_item(row)
+
+
+def stream_billing(billing_form: BillingFilterForm, cursor=None):
+	"""
+	Streams the billing items of all sources merged in time order, as JSON or CSV.
+	Every item comes with the cursor to pass in the next request in order to resume after it.
+	When a limit is given, the JSON output also contains the cursor of the next page (null when there is none).
+	"""
+	sources = [iterate_billing_source(index, billing_form, cursor) for index in range(len(billing_sources))]
+	items = heapq.merge(*sources, key=lambda item: item[0])
+	limit = billing_form.get_limit()
+	if limit:
+		items = islice(items, limit)
+
+	def items_with_cursor():
+		for position, item in items:
+			item['cursor'] = encode_billing_cursor(*position)
+			yield item
+
+	if billing_form.get_stream() == 'csv':
+		response = StreamingHttpResponse(stream_billing_csv(items_with_cursor()), content_type='text/csv')
+		response['Content-Disposition'] = 'attachment; filename="billing.csv"'
+	else:
+		response = StreamingHttpResponse(stream_billing_json(items_with_cursor(), limit), content_type='application/json')
+	return response
+
+
+def stream_billing_json(items, limit):
+	yield '{"results": ['
+	count = 0
+	item = None
+	for item in items:
+		yield (',' if count else '') + json.dumps(item)
+		count += 1
+	next_cursor = item['cursor'] if limit and count == limit else None
+	yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
+
+def stream_billing_csv(items):
+	buffer = StringIO()
+	writer = csv.DictWriter(buffer, fieldnames=billing_item_fields + ['cursor'])
+	writer.writeheader()
+	for item in items:
+		writer.writerow(item)
+		yield buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate(0)
+	yield buffer.getvalue()
@@ -1,29 +1,41 @@
 import io
 from collections import Iterable
 from datetime import timedelta, datetime
+from hashlib import md5
 from http import HTTPStatus
+from json import dumps
 from re import match
-from typing import Union
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 from dateutil import rrule
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required, permission_required
-from django.db.models import Q
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import F, Q, Max, QuerySet
 from django.http import HttpResponseBadRequest, HttpResponse, HttpResponseNotFound
 from django.shortcuts import render, get_object_or_404, redirect
-from django.template import Template, Context
+from django.template import Context
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils.timezone import localtime
 from django.views.decorators.http import require_GET, require_POST
 
 from NEMO.decorators import disable_session_expiry_refresh
-from NEMO.models import Tool, Reservation, Configuration, UsageEvent, AreaAccessRecord, StaffCharge, User, Project, ScheduledOutage, ScheduledOutageCategory
-from NEMO.utilities import bootstrap_primary_color, extract_times, extract_dates, format_datetime, parse_parameter_string, send_mail, create_email_attachment, localize
+from NEMO.email_delivery import DeliveryReport, deliver
+from NEMO.models import CalendarDisplay, Tool, get_tool_family, Reservation, Configuration, UsageEvent, AreaAccessRecord, StaffCharge, User, Project, ScheduledOutage, ScheduledOutageCategory, Task, TimedServiceRun
+from NEMO.utilities import bootstrap_primary_color, extract_times, extract_dates, format_datetime, parse_parameter_string, create_email, create_email_attachment, localize
 from NEMO.views.constants import ADDITIONAL_INFORMATION_MAXIMUM_LENGTH
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_template
 from NEMO.views.policy import check_policy_to_save_reservation, check_policy_to_cancel_reservation, check_policy_to_create_outage
 from NEMO.widgets.tool_tree import ToolTree
 
 
+missed_reservation_service_name = 'cancel_unused_reservations'
+reservation_reminder_service_name = 'email_reservation_reminders'
+
 recurrence_frequency_display = {
 	'DAILY': 'Day(s)',
 	'DAILY_WEEKDAYS':'Week Day(s)',
@@ -116,12 +128,22 @@ def reservation_event_feed(request, start, end):
 	if personal_schedule:
 		events = events.filter(user=request.user)
 
-	dictionary = {
-		'events': events,
-		'outages': outages,
-		'personal_schedule': personal_schedule,
-	}
-	return render(request, 'calendar/reservation_event_feed.html', dictionary)
+	def build_feed():
+		feed = []
+		for x in events.values('id', 'title', 'start', 'end', 'user_id', *user_name_fields('user'), 'tool__name'):
+			event = calendar_event(f"Reservation {x['id']}", x['title'] or (x['tool__name'] if personal_schedule else user_name(x, 'user')), x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('reservation_details', args=[x['id']]))
+			# The reservation creator or staff may edit the event
+			if request.user.id == x['user_id'] or request.user.is_staff:
+				event['editable'] = True
+			feed.append(event)
+		if outages is not None:
+			for x in outages.values('id', 'title', 'start', 'end'):
+				event = calendar_event(f"Outage {x['id']}", x['title'], x['start'], x['end'], reverse('outage_details', args=[x['id']]), color="#ff0000")
+				if request.user.is_staff:
+					event['editable'] = True
+				feed.append(event)
+		return feed
+	return calendar_feed_response(request, [events, outages], build_feed)
 
 
 def usage_event_feed(request, start, end):
@@ -152,17 +174,29 @@ def usage_event_feed(request, start, end):
 		missed_reservations = Reservation.objects.filter(missed=True, user=request.user)
 	elif tool_id:
 		missed_reservations = Reservation.objects.filter(missed=True, tool=tool_id)
-	if missed_reservations:
+	if missed_reservations is not None:
 		missed_reservations = missed_reservations.exclude(start__lt=start, end__lt=start)
 		missed_reservations = missed_reservations.exclude(start__gt=end, end__gt=end)
 
-	dictionary = {
-		'usage_events': usage_events,
-		'area_access_events': area_access_events,
-		'personal_schedule': personal_schedule,
-		'missed_reservations': missed_reservations,
-	}
-	return render(request, 'calendar/usage_event_feed.html', dictionary)
+	def build_feed():
+		feed = []
+		for x in usage_events.values('id', 'start', 'end', 'tool__name', 'user_id', *user_name_fields('user'), 'operator_id', *user_name_fields('operator')):
+			if personal_schedule:
+				title = x['tool__name']
+			elif x['operator_id'] != x['user_id']:
+				title = f"{user_name(x, 'operator')} on behalf of {user_name(x, 'user')}"
+			else:
+				title = user_name(x, 'user')
+			# Usage events that are less than 15 minutes are artificially lengthened for display purposes.
+			feed.append(calendar_event(x['id'], title, x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('usage_details', args=[x['id']])))
+		if area_access_events is not None:
+			feed.extend(area_access_feed(area_access_events))
+		if missed_reservations is not None:
+			for x in missed_reservations.values('id', 'start', 'end', 'tool__name', *user_name_fields('user')):
+				title = f"Missed reservation for the {x['tool__name']}" if personal_schedule else f"Missed reservation by {user_name(x, 'user')}"
+				feed.append(calendar_event(x['id'], title, x['start'], x['end'], reverse('reservation_details', args=[x['id']]), color="#ff0000"))
+		return feed
+	return calendar_feed_response(request, [usage_events, area_access_events, missed_reservations], build_feed)
 
 
 def specific_user_feed(request, user, start, end):
@@ -189,13 +223,97 @@ def specific_user_feed(request, user, start, end):
 	missed_reservations = missed_reservations.exclude(start__lt=start, end__lt=start)
 	missed_reservations = missed_reservations.exclude(start__gt=end, end__gt=end)
 
-	dictionary = {
-		'usage_events': usage_events,
-		'area_access_events': area_access_events,
-		'reservations': reservations,
-		'missed_reservations': missed_reservations,
+	def build_feed():
+		feed = []
+		for x in usage_events.values('id', 'start', 'end', 'tool__name'):
+			# Usage events that are less than 15 minutes are artificially lengthened for display purposes.
+			feed.append(calendar_event(x['id'], f"Usage of the {x['tool__name']}", x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('usage_details', args=[x['id']]), color="#33ad33"))
+		feed.extend(area_access_feed(area_access_events))
+		for x in reservations.values('id', 'title', 'start', 'end', 'tool__name'):
+			title = f"Reservation for the {x['tool__name']}" + (f", titled \"{x['title']}\"" if x['title'] else "")
+			feed.append(calendar_event(x['id'], title, x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('reservation_details', args=[x['id']]), color="#3a87ad"))
+		for x in missed_reservations.values('id', 'start', 'end', 'tool__name'):
+			feed.append(calendar_event(x['id'], f"Missed reservation for the {x['tool__name']}", x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('reservation_details', args=[x['id']]), color="#ff0000"))
+		return feed
+	return calendar_feed_response(request, [usage_events, area_access_events, reservations, missed_reservations], build_feed)
+
+
+def area_access_feed(area_access_events) -> List[Dict]:
+	feed = []
+	for x in area_access_events.values('id', 'start', 'end', 'area__name', 'project__name', 'staff_charge_id', *user_name_fields('staff_charge__staff_member')):
+		title = f"{x['area__name']} access billed to project {x['project__name']}"
+		if x['staff_charge_id']:
+			title += f" by {user_name(x, 'staff_charge__staff_member')}"
+		# Area access events that are less than 15 minutes are artificially lengthened for display purposes.
+		feed.append(calendar_event(x['id'], title, x['start'], CalendarDisplay.visual_end(x['start'], x['end']), reverse('area_access_details', args=[x['id']]), color="#e68a00"))
+	return feed
+
+
+def user_name_fields(prefix: str) -> List[str]:
+	return [f'{prefix}__first_name', f'{prefix}__last_name', f'{prefix}__username']
+
+
+def user_name(values: Dict, prefix: str) -> str:
+	""" Same as User.get_full_name, for a row read with values() using the user_name_fields """
+	return f"{values[prefix + '__first_name']} {values[prefix + '__last_name']} ({values[prefix + '__username']})"
+
+
+def calendar_event(event_id, title, start, end, details_url, color=None) -> Dict:
+	event = {
+		'title': title,
+		'id': event_id,
+		'start': localtime(start).isoformat(),
+		'end': localtime(end).isoformat(),
+		'details_url': details_url,
 	}
-	return render(request, 'calendar/specific_user_feed.html', dictionary)
+	if color:
+		event['color'] = color
+	return event
+
+
+# The fields the calendar feeds display for each kind of event, the id and times first
+calendar_feed_fields = {
+	Reservation: ['id', 'start', 'end', 'title', 'tool__name', 'user_id', *user_name_fields('user')],
+	ScheduledOutage: ['id', 'start', 'end', 'title'],
+	UsageEvent: ['id', 'start', 'end', 'tool__name', 'user_id', *user_name_fields('user'), 'operator_id', *user_name_fields('operator')],
+	AreaAccessRecord: ['id', 'start', 'end', 'area__name', 'project__name', 'staff_charge_id', *user_name_fields('staff_charge__staff_member')],
+}
+
+
+def calendar_feed_etag(request, sources: List[Optional[QuerySet]]) -> str:
+	"""
+	Computes the ETag of a calendar feed from the fields displayed for the events of each source (including the names of the
+	users, tools, projects and areas), read with one query per source, and from the user the feed is built for.
+	Events in progress have no end yet and are displayed up to the current time, so the ETag changes every minute while there are any.
+	"""
+	fingerprint = md5(f"{request.get_full_path()} {request.user.id} {request.user.is_staff}".encode())
+	in_progress = False
+	for source in sources:
+		if source is None:
+			continue
+		for row in source.order_by('id').values_list(*calendar_feed_fields[source.model]):
+			fingerprint.update(str(row).encode())
+			in_progress = in_progress or row[2] is None
+		fingerprint.update(b'|')
+	if in_progress:
+		fingerprint.update(timezone.now().strftime('%Y-%m-%d %H:%M').encode())
+	return quote_etag(fingerprint.hexdigest())
+
+
+def calendar_feed_response(request, sources: List[Optional[QuerySet]], build_feed: Callable[[], List[Dict]]) -> HttpResponse:
+	"""
+	Returns the calendar events as JSON with a strong ETag computed from the events of the sources.
+	The calendar refreshes the same window constantly, so unchanged events are answered with 304 Not Modified
+	without building the feed.
+	"""
+	etag = calendar_feed_etag(request, sources)
+	response = get_conditional_response(request, etag=etag)
+	if response is None:
+		response = HttpResponse(dumps(build_feed()).encode(), content_type='application/json')
+	response['ETag'] = etag
+	# Browsers may keep the feed but have to check with us before using it again
+	patch_cache_control(response, private=True, no_cache=True)
+	return response
 
 
 @login_required
@@ -552,34 +670,87 @@ def change_reservation_project(request, reservation_id):
 @require_GET
 def email_reservation_reminders(request):
 	# Exit early if the reservation reminder email template has not been customized for the organization yet.
-	reservation_reminder_message = get_media_file_contents('reservation_reminder_email.html')
-	reservation_warning_message = get_media_file_contents('reservation_warning_email.html')
-	if not reservation_reminder_message or not reservation_warning_message:
+	reservation_reminder_template = get_media_file_template('reservation_reminder_email.html')
+	reservation_warning_template = get_media_file_template('reservation_warning_email.html')
+	if not reservation_reminder_template or not reservation_warning_template:
 		return HttpResponseNotFound('The reservation reminder email template has not been customized for your organization yet. Please visit the NEMO customizable_key_values page to upload a template, then reservation reminder email notifications can be sent.')
 
-	# Find all reservations that are two hours from now, plus or minus 5 minutes to allow for time skew.
-	preparation_time = 120
-	tolerance = 5
-	earliest_start = timezone.now() + timedelta(minutes=preparation_time) - timedelta(minutes=tolerance)
-	latest_start = timezone.now() + timedelta(minutes=preparation_time) + timedelta(minutes=tolerance)
-	upcoming_reservations = Reservation.objects.filter(cancelled=False, start__gt=earliest_start, start__lt=latest_start)
-	# Email a reminder to each user with an upcoming reservation.
-	for reservation in upcoming_reservations:
-		tool = reservation.tool
-		if tool.operational and not tool.problematic() and tool.all_resources_available():
-			subject = reservation.tool.name + " reservation reminder"
-			rendered_message = Template(reservation_reminder_message).render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('success')}))
-		elif not tool.operational or tool.required_resource_is_unavailable():
-			subject = reservation.tool.name + " reservation problem"
-			rendered_message = Template(reservation_warning_message).render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('danger'), 'fatal_error': True}))
-		else:
-			subject = reservation.tool.name + " reservation warning"
-			rendered_message = Template(reservation_warning_message).render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('warning'), 'fatal_error': False}))
-		user_office_email = get_customization('user_office_email_address')
-		reservation.user.email_user(subject, rendered_message, user_office_email)
+	send_reservation_reminders(timezone.now(), reservation_reminder_template, reservation_warning_template)
 	return HttpResponse()
 
 
+def send_reservation_reminders(now: datetime, reminder_template, warning_template) -> DeliveryReport:
+	"""
+	Emails a reminder for the reservations starting within the next two hours that didn't get one yet, and saves when it was sent.
+	Reminders missed by a late run are caught up by the next one. Reservations made less than two hours before they start
+	don't get a reminder, their user just made them.
+	The reservations are claimed before the emails are sent, so a run overlapping this one doesn't remind them again.
+	"""
+	preparation_time = timedelta(minutes=120)
+	# Allows for time skew between the runs
+	tolerance = timedelta(minutes=5)
+	with transaction.atomic():
+		# An overlapping run waits for this one to claim its reservations
+		service_run = TimedServiceRun.lock(reservation_reminder_service_name)
+		reservations = Reservation.objects.filter(cancelled=False, missed=False, reminder_sent=None, start__gt=now, start__lte=now + preparation_time, creation_time__lte=F('start') - preparation_time + tolerance)
+		reservations = list(reservations.select_related('tool__parent_tool', 'user'))
+		Reservation.objects.filter(id__in=[r.id for r in reservations]).update(reminder_sent=timezone.now())
+		service_run.last_run = now
+		service_run.save()
+	health = get_tool_health([r.tool for r in reservations])
+	user_office_email = get_customization('user_office_email_address')
+	# Reminders of the batch being sent, with their reservation
+	batch: List[Tuple[EmailMessage, int]] = []
+
+	def reminders():
+		for reservation in reservations:
+			operational, problematic, required_resource_unavailable, nonrequired_resource_unavailable = health[reservation.tool_id]
+			if operational and not problematic and not required_resource_unavailable and not nonrequired_resource_unavailable:
+				subject = reservation.tool.name + " reservation reminder"
+				rendered_message = reminder_template.render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('success')}))
+			elif not operational or required_resource_unavailable:
+				subject = reservation.tool.name + " reservation problem"
+				rendered_message = warning_template.render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('danger'), 'fatal_error': True}))
+			else:
+				subject = reservation.tool.name + " reservation warning"
+				rendered_message = warning_template.render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('warning'), 'fatal_error': False}))
+			email = create_email(subject, rendered_message, user_office_email, [reservation.user.email])
+			batch.append((email, reservation.id))
+			yield email
+
+	failed = 0
+
+	def release_failed_reminders(report: DeliveryReport):
+		nonlocal failed
+		# The reservations of the reminders that failed are left for the next run
+		failed_messages = [message for message, error in report.errors[failed:]]
+		if failed_messages:
+			Reservation.objects.filter(id__in=[reservation_id for email, reservation_id in batch if email in failed_messages]).update(reminder_sent=None)
+		failed = len(report.errors)
+		batch.clear()
+
+	# Email a reminder to each user with an upcoming reservation.
+	return deliver(reminders(), "Reservation reminders", progress=release_failed_reminders)
+
+
+def get_tool_health(tools: List[Tool]) -> Dict[int, Tuple[bool, bool, bool, bool]]:
+	"""
+	Returns whether each tool is operational, has unresolved problems, and has unavailable required and nonrequired resources, by tool id.
+	Child tools get the health of their parent tool. The parent tools must be loaded with the tools.
+	"""
+	parent_ids = {tool.parent_tool_id or tool.id for tool in tools}
+	if not parent_ids:
+		return {}
+	problematic = set(Task.objects.filter(tool_id__in=parent_ids, resolved=False, cancelled=False).values_list('tool_id', flat=True))
+	required_resource_unavailable = set(Tool.objects.filter(id__in=parent_ids, required_resource_set__available=False).values_list('id', flat=True))
+	nonrequired_resource_unavailable = set(Tool.objects.filter(id__in=parent_ids, nonrequired_resource_set__available=False).values_list('id', flat=True))
+	health = {}
+	for tool in tools:
+		parent_id = tool.parent_tool_id or tool.id
+		health[tool.id] = (tool.operational, parent_id in problematic, parent_id in required_resource_unavailable, parent_id in nonrequired_resource_unavailable)
+	return health
+
+
 @login_required
 @permission_required('NEMO.trigger_timed_services', raise_exception=True)
 @require_GET
@@ -612,21 +783,23 @@ def email_usage_reminders(request):
 
 	user_office_email = get_customization('user_office_email_address')
 
-	message = get_media_file_contents('usage_reminder_email.html')
-	if message:
-		subject = "NanoFab usage"
-		for user in aggregate.values():
-			rendered_message = Template(message).render(Context({'user': user}))
-			send_mail(subject, rendered_message, user_office_email, [user['email']])
-
-	message = get_media_file_contents('staff_charge_reminder_email.html')
-	if message:
-		busy_staff = StaffCharge.objects.filter(end=None)
-		for staff_charge in busy_staff:
-			subject = "Active staff charge since " + format_datetime(staff_charge.start)
-			rendered_message = Template(message).render(Context({'staff_charge': staff_charge}))
-			staff_charge.staff_member.email_user(subject, rendered_message, user_office_email)
-
+	def reminders():
+		template = get_media_file_template('usage_reminder_email.html')
+		if template:
+			subject = "NanoFab usage"
+			for user in aggregate.values():
+				rendered_message = template.render(Context({'user': user}))
+				yield create_email(subject, rendered_message, user_office_email, [user['email']])
+
+		template = get_media_file_template('staff_charge_reminder_email.html')
+		if template:
+			busy_staff = StaffCharge.objects.filter(end=None).select_related('staff_member')
+			for staff_charge in busy_staff:
+				subject = "Active staff charge since " + format_datetime(staff_charge.start)
+				rendered_message = template.render(Context({'staff_charge': staff_charge}))
+				yield create_email(subject, rendered_message, user_office_email, [staff_charge.staff_member.email])
+
+	deliver(reminders(), "Usage reminders")
 	return HttpResponse()
 
 
@@ -667,37 +840,77 @@ def area_access_details(request, event_id):
 @permission_required('NEMO.trigger_timed_services', raise_exception=True)
 def cancel_unused_reservations(request):
 	# Exit early if the missed reservation email template has not been customized for the organization yet.
-	if not get_media_file_contents('missed_reservation_email.html'):
+	if not get_media_file_template('missed_reservation_email.html'):
 		return HttpResponseNotFound('The missed reservation email template has not been customized for your organization yet. Please visit the NEMO customizable_key_values page to upload a template, then missed email notifications can be sent.')
 
-	tools = Tool.objects.filter(visible=True, _operational=True, _missed_reservation_threshold__isnull=False)
-	missed_reservations = []
-	for tool in tools:
-		# If a tool is in use then there's no need to look for unused reservation time.
-		if tool.in_use() or tool.required_resource_is_unavailable() or tool.scheduled_outage_in_progress():
-			continue
-		# Calculate the timestamp of how long a user can be late for a reservation.
-		threshold = (timezone.now() - timedelta(minutes=tool.missed_reservation_threshold))
-		threshold = datetime.replace(threshold, second=0, microsecond=0)  # Round down to the nearest minute.
-		# Find the reservations that began exactly at the threshold.
-		reservation = Reservation.objects.filter(cancelled=False, missed=False, shortened=False, tool=tool, user__is_staff=False, start=threshold, end__gt=timezone.now())
-		for r in reservation:
-			# Staff may abandon reservations.
-			if r.user.is_staff:
-				continue
-			# If there was no tool enable or disable event since the threshold timestamp then we assume the reservation has been missed.
-			if not (UsageEvent.objects.filter(tool_id__in=tool.get_family_tool_ids(), start__gte=threshold).exists() or UsageEvent.objects.filter(tool_id__in=tool.get_family_tool_ids(), end__gte=threshold).exists()):
-				# Mark the reservation as missed and notify the user & NanoFab staff.
-				r.missed = True
-				r.save()
-				missed_reservations.append(r)
-
-	for r in missed_reservations:
-		send_missed_reservation_notification(r)
+	with transaction.atomic():
+		# A run overlapping the previous one waits for it, then only looks at what happened since.
+		service_run = TimedServiceRun.lock(missed_reservation_service_name)
+		now = timezone.now()
+		# Catch up on the reservations that reached their threshold since the last run. The first run only looks at the last minute.
+		since = service_run.last_run or now - timedelta(minutes=1)
+		missed_reservations = mark_missed_reservations(since, now)
+		service_run.last_run = now
+		service_run.save()
+
+	deliver((create_missed_reservation_email(r) for r in missed_reservations), "Missed reservation notifications")
 
 	return HttpResponse()
 
 
+def mark_missed_reservations(since: datetime, now: datetime) -> List[Reservation]:
+	"""
+	Marks as missed the reservations that reached the missed reservation threshold of their tool between since and now,
+	when the tool was not used since the reservation started. The missed reservations are returned.
+	"""
+	thresholds = {tool_id: timedelta(minutes=minutes) for tool_id, minutes in Tool.objects.filter(visible=True, _operational=True, _missed_reservation_threshold__isnull=False).values_list('id', '_missed_reservation_threshold')}
+	if not thresholds:
+		return []
+	# Staff may abandon reservations.
+	reservations = Reservation.objects.filter(cancelled=False, missed=False, shortened=False, tool_id__in=thresholds, user__is_staff=False, start__gt=since - max(thresholds.values()), start__lte=now - min(thresholds.values()), end__gt=now).select_related('tool', 'user')
+	reservations = [r for r in reservations if since - thresholds[r.tool_id] < r.start <= now - thresholds[r.tool_id]]
+	if not reservations:
+		return []
+
+	tool_ids = {r.tool_id for r in reservations}
+	family = get_tool_family()
+	# A tool can be in the family of several reserved tools, a visible child tool with its own reservations for example
+	family_tool_ids: Dict[int, Set[int]] = {}
+	for tool_id in tool_ids:
+		for family_tool_id in family.get_family_tool_ids(tool_id):
+			family_tool_ids.setdefault(family_tool_id, set()).add(tool_id)
+	# If a tool is in use, or can't be used because a required resource is unavailable or an outage is in progress, then there's no need to look for unused reservation time.
+	in_use = UsageEvent.objects.filter(tool_id__in=family_tool_ids, end=None).values_list('tool_id', flat=True)
+	skipped_tool_ids = {reserved_tool_id for tool_id in in_use for reserved_tool_id in family_tool_ids[tool_id]}
+	# Child tools share the resources and the outages of their parent tool
+	parent_tool_ids: Dict[int, Set[int]] = {}
+	for r in reservations:
+		parent_tool_ids.setdefault(r.tool.tool_or_parent_id(), set()).add(r.tool_id)
+	unavailable = Tool.objects.filter(id__in=parent_tool_ids).filter(
+		Q(required_resource_set__available=False) |
+		Q(scheduledoutage__start__lte=now, scheduledoutage__end__gt=now) |
+		Q(required_resource_set__scheduledoutage__start__lte=now, required_resource_set__scheduledoutage__end__gt=now)
+	).values_list('id', flat=True).distinct()
+	skipped_tool_ids.update(reserved_tool_id for tool_id in unavailable for reserved_tool_id in parent_tool_ids[tool_id])
+
+	# Find when each tool family was last enabled or disabled.
+	last_used = {}
+	earliest_start = min(r.start for r in reservations)
+	usage = UsageEvent.objects.filter(Q(start__gte=earliest_start) | Q(end__gte=earliest_start), tool_id__in=family_tool_ids).order_by().values('tool_id').annotate(last_start=Max('start'), last_end=Max('end'))
+	for event in usage:
+		for tool_id in family_tool_ids[event['tool_id']]:
+			last_used[tool_id] = max(filter(None, [event['last_start'], event['last_end'], last_used.get(tool_id)]))
+
+	# If there was no tool enable or disable event since the reservation started then we assume the reservation has been missed.
+	missed_reservations = []
+	for r in reservations:
+		if r.tool_id not in skipped_tool_ids and (r.tool_id not in last_used or last_used[r.tool_id] < r.start):
+			r.missed = True
+			missed_reservations.append(r)
+	Reservation.objects.bulk_update(missed_reservations, ['missed'])
+	return missed_reservations
+
+
 @staff_member_required(login_url=None)
 @require_GET
 def proxy_reservation(request):
@@ -725,9 +938,9 @@ def cancel_the_reservation(reservation: Reservation, user: User, reason: Union[s
 				'reason': reason,
 				'template_color': bootstrap_primary_color('info')
 			}
-			email_contents = get_media_file_contents('cancellation_email.html')
-			if email_contents:
-				cancellation_email = Template(email_contents).render(Context(dictionary))
+			email_template = get_media_file_template('cancellation_email.html')
+			if email_template:
+				cancellation_email = email_template.render(Context(dictionary))
 				if getattr(reservation.user.preferences, 'attach_cancelled_reservation', False):
 					attachment = create_ics_for_reservation(reservation, cancelled=True)
 					reservation.user.email_user('Your reservation was cancelled', cancellation_email, user.email, [attachment])
@@ -741,30 +954,29 @@ def cancel_the_reservation(reservation: Reservation, user: User, reason: Union[s
 	return response
 
 
-def send_missed_reservation_notification(reservation):
+def create_missed_reservation_email(reservation) -> EmailMessage:
 	subject = "Missed reservation for the " + str(reservation.tool)
-	message = get_media_file_contents('missed_reservation_email.html')
-	message = Template(message).render(Context({'reservation': reservation}))
+	message = get_media_file_template('missed_reservation_email.html').render(Context({'reservation': reservation}))
 	user_office_email = get_customization('user_office_email_address')
 	abuse_email = get_customization('abuse_email_address')
-	send_mail(subject, message, user_office_email, [reservation.user.email, abuse_email, user_office_email])
+	return create_email(subject, message, user_office_email, [reservation.user.email, abuse_email, user_office_email])
 
 
 def send_user_created_reservation_notification(reservation: Reservation):
-	if getattr(reservation.user.preferences, 'attach_created_reservation', False):
+	template = get_media_file_template('reservation_created_user_email.html')
+	if template and getattr(reservation.user.preferences, 'attach_created_reservation', False):
 		subject = "[NEMO] Reservation for the " + str(reservation.tool)
-		message = get_media_file_contents('reservation_created_user_email.html')
-		message = Template(message).render(Context({'reservation': reservation}))
+		message = template.render(Context({'reservation': reservation}))
 		user_office_email = get_customization('user_office_email_address')
 		attachment = create_ics_for_reservation(reservation)
 		reservation.user.email_user(subject, message, user_office_email, [attachment])
 
 
 def send_user_cancelled_reservation_notification(reservation: Reservation):
-	if getattr(reservation.user.preferences, 'attach_cancelled_reservation', False):
+	template = get_media_file_template('reservation_cancelled_user_email.html')
+	if template and getattr(reservation.user.preferences, 'attach_cancelled_reservation', False):
 		subject = "[NEMO] Cancelled Reservation for the " + str(reservation.tool)
-		message = get_media_file_contents('reservation_cancelled_user_email.html')
-		message = Template(message).render(Context({'reservation': reservation}))
+		message = template.render(Context({'reservation': reservation}))
 		user_office_email = get_customization('user_office_email_address')
 		attachment = create_ics_for_reservation(reservation, cancelled=True)
 		reservation.user.email_user(subject, message, user_office_email, [attachment])
@@ -4,8 +4,9 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 from django.views.decorators.http import require_GET
 
-from NEMO.models import Tool, Reservation
+from NEMO.models import Tool, Reservation, Configuration
 from NEMO.utilities import localize, naive_local_current_datetime
+from NEMO.widgets.configuration_editor import ConfigurationEditor, ConfigurationEditorContext
 
 
 @staff_member_required(login_url=None)
@@ -27,9 +28,13 @@ def configuration_agenda(request, time_period='today'):
 	end = localize(end)
 	reservations = Reservation.objects.filter(start__gt=start, start__lt=end, tool__id__in=tools, self_configuration=False, cancelled=False, missed=False, shortened=False).exclude(additional_information='').order_by('start')
 	tools = Tool.objects.filter(id__in=reservations.values_list('tool', flat=True))
+	# Load the configurations of all the tools at once, and find which ones the user can change in a single pass.
+	configurations = list(Configuration.objects.filter(tool__in=tools).order_by('display_priority'))
+	context = ConfigurationEditorContext(request.user, configurations)
 	configuration_widgets = {}
 	for tool in tools:
-		configuration_widgets[tool.id] = tool.configuration_widget(request.user)
+		tool_configurations = [configuration for configuration in configurations if configuration.tool_id == tool.id]
+		configuration_widgets[tool.id] = ConfigurationEditor().render(None, {'configurations': tool_configurations, 'user': request.user, 'context': context})
 	dictionary = {
 		'time_period': time_period,
 		'tools': tools,
@@ -1,15 +1,82 @@
+from time import monotonic
+from typing import Dict, Optional, Union
+
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.core.files.storage import get_storage_class
 from django.core.validators import validate_email
 from django.http import HttpResponseBadRequest
 from django.shortcuts import redirect, render
+from django.template import Template
 from django.views.decorators.http import require_GET, require_POST
 
-from NEMO.models import Customization
+from NEMO.models import Customization, get_cached_data, invalidate_cache_version
 
+customization_version_name = 'customization'
+# Larger media files, like images, are read from the storage every time
+media_file_cache_size_limit = 64 * 1024
 
-def get_media_file_contents(file_name):
-	""" Get the contents of a media file if it exists. Return a blank string if it does not exist. """
+
+def get_customization_cache_ttl() -> float:
+	""" Number of seconds a process keeps the customizations before loading them again, even if no change was recorded. """
+	return getattr(settings, 'CUSTOMIZATION_CACHE_TTL', 300)
+
+
+class CustomizationCache:
+	""" The customization key-values, the contents of the small media files and the compiled media file templates, for one version. """
+
+	def __init__(self):
+		self.version: Optional[str] = None
+		self.loaded = monotonic()
+		self.values: Optional[Dict[str, str]] = None
+		self.media_files: Dict[str, Union[str, bytes]] = {}
+		self.media_file_templates: Dict[str, Optional[Template]] = {}
+
+
+customization_cache = CustomizationCache()
+
+
+def get_customization_cache() -> CustomizationCache:
+	"""
+	Returns the customizations of this process, starting over when their version in the database changed, or after
+	CUSTOMIZATION_CACHE_TTL seconds. The version changes whenever a customization or a media file is saved, in any process.
+	"""
+	return get_cached_data(customization_version_name, get_loaded_customization_cache, CustomizationCache, set_loaded_customization_cache)
+
+
+def get_loaded_customization_cache(version: str) -> Optional[CustomizationCache]:
+	current = customization_cache
+	if current.version != version or monotonic() - current.loaded > get_customization_cache_ttl():
+		return None
+	return current
+
+
+def set_loaded_customization_cache(version: str, customizations: CustomizationCache):
+	global customization_cache
+	customizations.version = version
+	customization_cache = customizations
+
+
+def invalidate_customization_cache():
+	""" Makes every process load the customizations and the media files again. """
+	invalidate_cache_version(customization_version_name)
+
+
+def reset_customization_cache():
+	""" Makes this process load the customizations and the media files again. """
+	global customization_cache
+	customization_cache = CustomizationCache()
+
+
+def get_customizations() -> Dict[str, str]:
+	""" Returns all the customization key-values, loaded with a single query once per version. """
+	customizations = get_customization_cache()
+	if customizations.values is None:
+		customizations.values = dict(Customization.objects.values_list('name', 'value'))
+	return customizations.values
+
+
+def read_media_file(file_name):
 	storage = get_storage_class()()
 	if not storage.exists(file_name):
 		return ''
@@ -21,12 +88,33 @@ def get_media_file_contents(file_name):
 		return f.read()
 
 
+def get_media_file_contents(file_name):
+	""" Get the contents of a media file if it exists. Return a blank string if it does not exist. Small files are only read once per version. """
+	customizations = get_customization_cache()
+	contents = customizations.media_files.get(file_name)
+	if contents is None:
+		contents = read_media_file(file_name)
+		if len(contents) <= media_file_cache_size_limit:
+			customizations.media_files[file_name] = contents
+	return contents
+
+
+def get_media_file_template(file_name) -> Optional[Template]:
+	""" Get the compiled template of a media file. Return None if it does not exist or is blank. The file is only read and compiled once per version. """
+	customizations = get_customization_cache()
+	if file_name not in customizations.media_file_templates:
+		contents = get_media_file_contents(file_name)
+		customizations.media_file_templates[file_name] = Template(contents) if contents else None
+	return customizations.media_file_templates[file_name]
+
+
 def store_media_file(content, file_name):
 	""" Delete any existing media file with the same name and save the new content into file_name in the media directory. If content is blank then no new file is created. """
 	storage = get_storage_class()()
 	storage.delete(file_name)
 	if content:
 		storage.save(file_name, content)
+	invalidate_customization_cache()
 
 
 customizable_key_values = [
@@ -66,10 +154,7 @@ customizable_content = [
 def get_customization(name):
 	if name not in customizable_key_values:
 		raise Exception('Invalid customization')
-	try:
-		return Customization.objects.get(name=name).value
-	except Customization.DoesNotExist:
-		return ''
+	return get_customizations().get(name, '')
 
 
 def set_customization(name, value):
@@ -1,18 +1,21 @@
 from logging import getLogger
 from smtplib import SMTPException
 
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.mail import EmailMultiAlternatives
 from django.core.validators import validate_email
 from django.http import HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404
-from django.template import Template, Context
+from django.template import Context
 from django.views.decorators.http import require_GET, require_POST
 
+from NEMO.email_delivery import DeliveryReport, deliver_in_background
 from NEMO.forms import EmailBroadcastForm
 from NEMO.models import Tool, Account, Project, User
-from NEMO.views.customization import get_media_file_contents
+from NEMO.utilities import send_mail
+from NEMO.views.customization import get_media_file_template
 
 
 logger = getLogger(__name__)
@@ -102,7 +105,7 @@ def compose_email(request):
 	except:
 		dictionary = {'error': 'You specified an invalid audience parameter'}
 		return render(request, 'email/email_broadcast.html', dictionary)
-	generic_email_sample = get_media_file_contents('generic_email.html')
+	generic_email_sample = get_media_file_template('generic_email.html')
 	dictionary = {
 		'audience': audience,
 		'selection': selection,
@@ -114,14 +117,15 @@ def compose_email(request):
 			'greeting': 'Greeting',
 			'contents': 'Contents',
 		}
-		dictionary['generic_email_sample'] = Template(generic_email_sample).render(Context(generic_email_context))
+		dictionary['generic_email_sample'] = generic_email_sample.render(Context(generic_email_context))
 	return render(request, 'email/compose_email.html', dictionary)
 
 
 @staff_member_required(login_url=None)
 @require_POST
 def send_broadcast_email(request):
-	if not get_media_file_contents('generic_email.html'):
+	template = get_media_file_template('generic_email.html')
+	if not template:
 		return HttpResponseBadRequest('Generic email template not defined. Visit the NEMO customizable_key_values page to upload a template.')
 	form = EmailBroadcastForm(request.POST)
 	if not form.is_valid():
@@ -132,8 +136,7 @@ def send_broadcast_email(request):
 		'contents': form.cleaned_data['contents'],
 		'template_color': form.cleaned_data['color'],
 	}
-	content = get_media_file_contents('generic_email.html')
-	content = Template(content).render(Context(dictionary))
+	content = template.render(Context(dictionary))
 	users = None
 	audience = form.cleaned_data['audience']
 	selection = form.cleaned_data['selection']
@@ -156,24 +159,30 @@ def send_broadcast_email(request):
 		dictionary = {'error': 'The audience you specified is empty. You must send the email to at least one person.'}
 		return render(request, 'email/compose_email.html', dictionary)
 	subject = form.cleaned_data['subject']
-	users = [x.email for x in users]
+	recipients = {x.email for x in users}
 	if form.cleaned_data['copy_me']:
-		users += [request.user.email]
-	try:
-		email = EmailMultiAlternatives(subject, from_email=request.user.email, bcc=set(users))
-		email.attach_alternative(content, 'text/html')
-		email.send()
-	except SMTPException as error:
-		error_message = 'NEMO was unable to send the email through the email server. The error message that NEMO received is: ' + str(error)
-		logger.exception(error_message)
-		dictionary = {
-			'title': 'Email not sent',
-			'heading': 'There was a problem sending your email',
-			'content': error_message,
-		}
-		return render(request, 'acknowledgement.html', dictionary)
+		recipients.add(request.user.email)
+	sender = request.user.email
+
+	def messages():
+		# One message per recipient, so a rejected address doesn't stop the email from reaching everyone else
+		for recipient in sorted(recipients):
+			email = EmailMultiAlternatives(subject, from_email=sender, to=[recipient])
+			email.attach_alternative(content, 'text/html')
+			yield email
+
+	def report_failures(report: DeliveryReport):
+		# The sender was told the email is being sent, so they need to know who it didn't reach
+		if not report.failed:
+			return
+		failed_recipients = [recipient for message, error in report.errors for recipient in message.recipients()]
+		message = f'Your email "{subject}" could not be sent to {report.failed} of its {len(recipients)} recipients:<br>' + '<br>'.join(failed_recipients)
+		send_mail(f'Undelivered email: {subject}', message, settings.SERVER_EMAIL, [sender])
+
+	deliver_in_background(messages(), f"Broadcast email \"{subject}\" from {sender}", report_failures)
 	dictionary = {
 		'title': 'Email sent',
-		'heading': 'Your email was sent',
+		'heading': 'Your email is being sent',
+		'content': f'The email is being delivered to {len(recipients)} recipients.',
 	}
 	return render(request, 'acknowledgement.html', dictionary)
@@ -1,19 +1,19 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
-from django.template import Template, Context
+from django.template import Context
 from django.views.decorators.http import require_http_methods
 
 from NEMO.utilities import parse_parameter_string, send_mail
 from NEMO.views.constants import FEEDBACK_MAXIMUM_LENGTH
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_template
 
 
 @login_required
 @require_http_methods(['GET', 'POST'])
 def feedback(request):
 	recipient = get_customization('feedback_email_address')
-	email_contents = get_media_file_contents('feedback_email.html')
-	if not recipient or not email_contents:
+	email_template = get_media_file_template('feedback_email.html')
+	if not recipient or not email_template:
 		return render(request, 'feedback.html', {'customization_required': True})
 
 	if request.method == 'GET':
@@ -26,7 +26,7 @@ def feedback(request):
 		'user': request.user,
 	}
 
-	email = Template(email_contents).render(Context(dictionary))
+	email = email_template.render(Context(dictionary))
 	send_mail('Feedback from ' + str(request.user), email, request.user.email, [recipient])
 	dictionary = {
 		'title': 'Feedback',
@@ -3,7 +3,7 @@ from django.shortcuts import render
 from django.utils import timezone
 from django.views.decorators.http import require_GET
 
-from NEMO.models import AreaAccessRecord, UsageEvent, Alert, Resource, Area
+from NEMO.models import AreaAccessRecord, UsageEvent, Alert, Resource, Area, get_area_occupancy
 from NEMO.views.alerts import delete_expired_alerts
 
 
@@ -18,7 +18,7 @@ def jumbotron(request):
 def jumbotron_content(request):
 	delete_expired_alerts()
 	dictionary = {
-		'nanofab_occupants': AreaAccessRecord.objects.filter(end=None, staff_charge=None).prefetch_related('customer', 'project').order_by('area__name', 'start'),
+		'nanofab_occupants': AreaAccessRecord.objects.filter(end=None, staff_charge=None).prefetch_related('customer', 'project').order_by('area__name', 'start') if get_area_occupancy().records else AreaAccessRecord.objects.none(),
 		'usage_events': UsageEvent.objects.filter(end=None).prefetch_related('operator', 'user', 'tool'),
 		'alerts': Alert.objects.filter(user=None, debut_time__lte=timezone.now(), expired=False, deleted=False),
 		'disabled_resources': Resource.objects.filter(available=False),
@@ -1,14 +1,13 @@
 from datetime import timedelta
 
-import requests
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.shortcuts import render
-from django.urls import Resolver404, resolve
 from django.utils import timezone
 from django.views.decorators.http import require_GET
 
+from NEMO.link_health import get_reachable_urls
 from NEMO.models import Alert, LandingPageChoice, Reservation, Resource, UsageEvent
 from NEMO.views.alerts import delete_expired_alerts
 from NEMO.views.area_access import able_to_self_log_in_to_area, able_to_self_log_out_of_area
@@ -32,8 +31,10 @@ def landing(request):
 		landing_page_choices = landing_page_choices.exclude(hide_from_users=True)
 
 	if not settings.ALLOW_CONDITIONAL_URLS:
-		# validate all urls
-		landing_page_choices = [landing_page_choice for landing_page_choice in landing_page_choices if valid_url_for_landing(landing_page_choice.url)]
+		# Hide the links that don't work. External links are probed in the background, never while the page is loading.
+		landing_page_choices = list(landing_page_choices)
+		reachable_urls = get_reachable_urls(landing_page_choice.url for landing_page_choice in landing_page_choices)
+		landing_page_choices = [landing_page_choice for landing_page_choice in landing_page_choices if landing_page_choice.url in reachable_urls]
 
 	dictionary = {
 		'now': timezone.now(),
@@ -48,20 +49,3 @@ def landing(request):
 	}
 	return render(request, 'landing.html', dictionary)
 
-
-def valid_url_for_landing(url) -> bool:
-	if url.startswith("/"):
-		# Internal URL. let's check if it resolves
-		try:
-			resolve(url)
-		except Resolver404:
-			return False
-	else:
-		# External URL, let's check if it exists
-		try:
-			response = requests.head(url, timeout=0.3)
-			if response.status_code > 400:
-				return False
-		except Exception:
-			return False
-	return True
@@ -1,10 +1,15 @@
 from datetime import timedelta
+from itertools import islice
 
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
 from django.utils import timezone
 
 from NEMO.models import News, Notification, SafetyIssue, User
 
+# Notifications are inserted this many at a time when a news story or safety issue is sent to every user.
+notification_batch_size = 1000
+
 
 def delete_expired_notifications():
 	Notification.objects.filter(expiration__lt=timezone.now()).delete()
@@ -22,21 +27,33 @@ def get_notifications(user, notification_type):
 
 
 def get_notificaiton_counts(user):
-	counts = {}
-	for t in Notification.Types.Choices:
-		model = t[0]
-		content_type = ContentType.objects.get(app_label='NEMO', model=model)
-		counts[model] = Notification.objects.filter(user=user, content_type=content_type).count()
+	""" Returns the number of notifications of each type for the user, counted in one grouped query. """
+	# Content types are cached by Django, so they are only looked up once per process.
+	models = {ContentType.objects.get_by_natural_key('NEMO', model).id: model for model, description in Notification.Types.Choices}
+	counts = dict.fromkeys(models.values(), 0)
+	for content_type_id, count in Notification.objects.filter(user=user).order_by().values_list('content_type').annotate(count=Count('id')):
+		if content_type_id in models:
+			counts[models[content_type_id]] = count
 	return counts
 
 
+def create_notifications(users, content_object, expiration):
+	""" Creates a notification about the content object for each user, inserting them in batches. """
+	content_type = ContentType.objects.get_for_model(content_object)
+	user_ids = iter(users.values_list('id', flat=True))
+	while True:
+		notifications = [Notification(user_id=user_id, expiration=expiration, content_type=content_type, object_id=content_object.id) for user_id in islice(user_ids, notification_batch_size)]
+		if not notifications:
+			break
+		Notification.objects.bulk_create(notifications)
+
+
 def create_news_notification(story):
 	content_type = ContentType.objects.get_for_model(News)
 	Notification.objects.filter(content_type=content_type, object_id=story.id).delete()  # Delete all existing notifications for this story, so we don't have multiple notifications for the same story
 	users = User.objects.filter(is_active=True)
 	expiration = timezone.now() + timedelta(days=30)  # Unread news story notifications always expire after 30 days
-	for u in users:
-		Notification.objects.create(user=u, expiration=expiration, content_object=story)
+	create_notifications(users, story, expiration)
 
 
 def delete_news_notification(story):
@@ -47,8 +64,7 @@ def delete_news_notification(story):
 def create_safety_notification(safety_issue):
 	users = User.objects.filter(is_staff=True, is_active=True)
 	expiration = timezone.now() + timedelta(days=30)  # Unread safety issue notifications always expire after 30 days
-	for u in users:
-		Notification.objects.create(user=u, expiration=expiration, content_object=safety_issue)
+	create_notifications(users, safety_issue, expiration)
 
 
 def delete_safety_notification(issue):
@@ -1,16 +1,118 @@
+from bisect import bisect_left
 from datetime import timedelta, date
 
+from django.core.cache import cache
 from django.db.models import Q
 from django.http import HttpResponse, HttpResponseBadRequest
-from django.template import Template, Context
+from django.template import Context
 from django.utils import timezone
 
 from NEMO.exceptions import InactiveUserError, NoActiveProjectsForUserError, PhysicalAccessExpiredUserError, \
 	NoPhysicalAccessUserError, NoAccessiblePhysicalAccessUserError, UnavailableResourcesUserError, \
 	MaximumCapacityReachedError
-from NEMO.models import Reservation, AreaAccessRecord, ScheduledOutage, User, Area, PhysicalAccessLevel
+from NEMO.models import Reservation, ScheduledOutage, User, Area, PhysicalAccessLevel, Resource, get_area_occupancy, get_cached_data, invalidate_cache_version
+from NEMO.tasks import executor
 from NEMO.utilities import format_datetime, send_mail
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_template
+
+
+class ReservationConflictIndex(object):
+	"""
+	In-memory interval index of a tool's reservations and outages around a proposed reservation.
+	All the conflict and quota questions asked when saving a reservation are answered from one bounded
+	fetch of the tool's reservations and one fetch of its outages, instead of one query per policy rule.
+	Each predicate mirrors the ORM filter it replaces so that the same policy problems are reported.
+	"""
+
+	def __init__(self, new_reservation, user, cancelled_reservation=None):
+		self.tool = new_reservation.tool
+		self.user = user
+		self.start = new_reservation.start
+		self.end = new_reservation.end
+		self.excluded_id = cancelled_reservation.id if cancelled_reservation and cancelled_reservation.id else None
+		self.now = timezone.now()
+		self._reservations = None
+		self._starts = None
+		self._outages = None
+
+	def fetch_window(self):
+		""" Returns the widest time window that any of the tool policy rules looks at. """
+		start_of_day = self.start.replace(hour=0, minute=0, second=0, microsecond=0)
+		window_start = min(self.start, start_of_day)
+		window_end = max(self.end, start_of_day + timedelta(days=1))
+		if self.tool.minimum_time_between_reservations:
+			buffer_time = timedelta(minutes=self.tool.minimum_time_between_reservations)
+			window_start = min(window_start, self.start - buffer_time)
+			window_end = max(window_end, self.end + buffer_time)
+		return window_start, window_end
+
+	def reservations(self):
+		""" Returns the (start, end, user_id, missed, shortened) tuples of the non-cancelled reservations in the index, sorted by start. """
+		if self._reservations is None:
+			window_start, window_end = self.fetch_window()
+			# Same "coincides with" filter as the individual policy rules, applied to the widest window...
+			in_window = ~Q(start__lt=window_start, end__lte=window_start) & ~Q(start__gte=window_end, end__gt=window_end)
+			# ...plus all the user's upcoming reservations for the maximum future reservation time rule.
+			upcoming = Q(user=self.user, start__gte=self.now)
+			reservations = Reservation.objects.filter(tool=self.tool, cancelled=False).filter(in_window | upcoming)
+			if self.excluded_id:
+				reservations = reservations.exclude(id=self.excluded_id)
+			self._reservations = list(reservations.order_by('start').values_list('start', 'end', 'user_id', 'missed', 'shortened'))
+			self._starts = [r[0] for r in self._reservations]
+		return self._reservations
+
+	def reservations_starting_before(self, time):
+		reservations = self.reservations()
+		return reservations[:bisect_left(self._starts, time)]
+
+	def reservations_starting_from(self, time):
+		reservations = self.reservations()
+		return reservations[bisect_left(self._starts, time):]
+
+	def outages(self):
+		""" Returns the (start, end) tuples of the tool outages (or fully dependent resource outages) that coincide with the reservation. """
+		if self._outages is None:
+			outages = ScheduledOutage.objects.filter(Q(tool=self.tool) | Q(resource__fully_dependent_tools__in=[self.tool]))
+			outages = outages.exclude(start__lt=self.start, end__lte=self.start)
+			outages = outages.exclude(start__gte=self.end, end__gt=self.end)
+			self._outages = list(outages.values_list('start', 'end'))
+		return self._outages
+
+	def coincident_reservation_exists(self):
+		for start, end, user_id, missed, shortened in self.reservations():
+			if missed or shortened:
+				continue
+			# The reservation neither starts and ends before the time-window, nor starts and ends after it.
+			if not (start < self.start and end <= self.start) and not (start >= self.end and end > self.end):
+				return True
+		return False
+
+	def coincident_outage_exists(self):
+		return len(self.outages()) > 0
+
+	def user_reservation_count_for_the_day(self):
+		""" Missed reservations are included when counting the number of reservations per day. """
+		start_of_day = self.start.replace(hour=0, minute=0, second=0, microsecond=0)
+		end_of_day = start_of_day + timedelta(days=1)
+		return len([r for r in self.reservations_starting_from(start_of_day) if r[2] == self.user.id and not r[4] and r[1] <= end_of_day])
+
+	def user_reservation_ends_too_close(self, buffer_time):
+		""" Returns True if one of the user's reservations ends less than buffer_time before this one starts. """
+		must_end_before = self.start - buffer_time
+		return any(r[2] == self.user.id and not r[4] and r[1] > must_end_before for r in self.reservations_starting_before(self.start))
+
+	def user_reservation_begins_too_close(self, buffer_time):
+		""" Returns True if one of the user's reservations starts less than buffer_time after this one ends. """
+		must_start_after = self.end + buffer_time
+		return any(r[2] == self.user.id and not r[4] and r[1] > self.start for r in self.reservations_starting_before(must_start_after))
+
+	def user_future_reserved_time(self):
+		""" Returns the total duration of the user's reservations starting from now on. """
+		total = timedelta()
+		for start, end, user_id, missed, shortened in self.reservations_starting_from(self.now):
+			if user_id == self.user.id:
+				total += end - start
+		return total
 
 
 def check_policy_to_enable_tool(tool, operator, user, project, staff_charge):
@@ -48,16 +150,17 @@ def check_policy_to_enable_tool(tool, operator, user, project, staff_charge):
 
 	# The tool operator may not activate tools in a particular area unless they are logged in to the area.
 	# Staff are exempt from this rule.
-	if tool.requires_area_access and AreaAccessRecord.objects.filter(area=tool.requires_area_access, customer=operator, staff_charge=None, end=None).count() == 0 and not operator.is_staff:
+	if tool.requires_area_access and get_area_occupancy().get_area_id(operator.id) != tool.requires_area_access.id and not operator.is_staff:
 		dictionary = {
 			'operator': operator,
 			'tool': tool,
 		}
 		abuse_email_address = get_customization('abuse_email_address')
-		message = get_media_file_contents('unauthorized_tool_access_email.html')
-		if abuse_email_address and message:
-			rendered_message = Template(message).render(Context(dictionary))
-			send_mail("Area access requirement", rendered_message, abuse_email_address, [abuse_email_address])
+		template = get_media_file_template('unauthorized_tool_access_email.html')
+		if abuse_email_address and template:
+			rendered_message = template.render(Context(dictionary))
+			# Sent in the background so the tool page doesn't wait for the mail server, and only once: a retry could send it twice
+			executor.submit(send_mail, ["Area access requirement", rendered_message, abuse_email_address, [abuse_email_address]], retries=0)
 		return HttpResponseBadRequest("You must be logged in to the {} to operate this tool.".format(tool.requires_area_access.name.lower()))
 
 	# Staff may only charge staff time for one user at a time.
@@ -114,27 +217,16 @@ def check_policy_to_save_reservation(cancelled_reservation, new_reservation, use
 	if new_reservation.start >= new_reservation.end:
 		policy_problems.append("Reservation start time (" + format_datetime(new_reservation.start) + ") must be before the end time (" + format_datetime(new_reservation.end) + ").")
 
+	# All the reservation and outage conflicts are answered from the same bounded fetch.
+	# The reservation we're cancelling in order to create a new one is excluded from it.
+	conflict_index = ReservationConflictIndex(new_reservation, user, cancelled_reservation)
+
 	# The user may not create, move, or resize a reservation to coincide with another user's reservation.
-	coincident_events = Reservation.objects.filter(tool=new_reservation.tool, cancelled=False, missed=False, shortened=False)
-	# Exclude the reservation we're cancelling in order to create a new one:
-	if cancelled_reservation and cancelled_reservation.id:
-		coincident_events = coincident_events.exclude(id=cancelled_reservation.id)
-	# Exclude events for which the following is true:
-	# The event starts and ends before the time-window, and...
-	# The event starts and ends after the time-window.
-	coincident_events = coincident_events.exclude(start__lt=new_reservation.start, end__lte=new_reservation.start)
-	coincident_events = coincident_events.exclude(start__gte=new_reservation.end, end__gt=new_reservation.end)
-	if coincident_events.count() > 0:
+	if conflict_index.coincident_reservation_exists():
 		policy_problems.append("Your reservation coincides with another reservation that already exists. Please choose a different time.")
 
 	# The user may not create, move, or resize a reservation to coincide with a scheduled outage.
-	coincident_events = ScheduledOutage.objects.filter(Q(tool=new_reservation.tool) | Q(resource__fully_dependent_tools__in=[new_reservation.tool]))
-	# Exclude events for which the following is true:
-	# The event starts and ends before the time-window, and...
-	# The event starts and ends after the time-window.
-	coincident_events = coincident_events.exclude(start__lt=new_reservation.start, end__lte=new_reservation.start)
-	coincident_events = coincident_events.exclude(start__gte=new_reservation.end, end__gt=new_reservation.end)
-	if coincident_events.count() > 0:
+	if conflict_index.coincident_outage_exists():
 		policy_problems.append("Your reservation coincides with a scheduled outage. Please choose a different time.")
 
 	# Reservations that have been cancelled may not be changed.
@@ -142,14 +234,15 @@ def check_policy_to_save_reservation(cancelled_reservation, new_reservation, use
 		policy_problems.append("This reservation has already been cancelled by " + str(new_reservation.cancelled_by) + " at " + format_datetime(new_reservation.cancellation_time) + ".")
 
 	# The user must belong to at least one active project to make a reservation.
-	if new_reservation.user.active_project_count() < 1:
+	active_projects = new_reservation.user.active_projects()
+	if len(active_projects) < 1:
 		if new_reservation.user == user:
 			policy_problems.append("You do not belong to any active projects. Thus, you may not create any reservations.")
 		else:
 			policy_problems.append(str(new_reservation.user) + " does not belong to any active projects and cannot have reservations.")
 
 	# The user must associate their reservation with a project they belong to.
-	if new_reservation.project and new_reservation.project not in new_reservation.user.active_projects():
+	if new_reservation.project and new_reservation.project not in active_projects:
 		if new_reservation.user == user:
 			policy_problems.append("You do not belong to the project associated with this reservation.")
 		else:
@@ -205,14 +298,16 @@ def check_policy_to_save_reservation(cancelled_reservation, new_reservation, use
 	# Check tool policy rules
 	tool_policy_problems = []
 	if new_reservation.tool.should_enforce_policy(new_reservation):
-		tool_policy_problems = check_policy_rules_for_tool(cancelled_reservation, new_reservation, user)
+		tool_policy_problems = check_policy_rules_for_tool(cancelled_reservation, new_reservation, user, conflict_index)
 
 	# Return the list of all policies that are not met.
 	return policy_problems + tool_policy_problems, overridable
 
 
-def check_policy_rules_for_tool(cancelled_reservation, new_reservation, user):
+def check_policy_rules_for_tool(cancelled_reservation, new_reservation, user, conflict_index=None):
 	tool_policy_problems = []
+	if conflict_index is None:
+		conflict_index = ReservationConflictIndex(new_reservation, user, cancelled_reservation)
 	# Calculate the duration of the reservation:
 	duration = new_reservation.end - new_reservation.start
 
@@ -240,16 +335,8 @@ def check_policy_rules_for_tool(cancelled_reservation, new_reservation, user):
 	# Staff may break this rule.
 	# An explicit policy override allows this rule to be broken.
 	if new_reservation.tool.maximum_reservations_per_day:
-		start_of_day = new_reservation.start
-		start_of_day = start_of_day.replace(hour=0, minute=0, second=0, microsecond=0)
-		end_of_day = start_of_day + timedelta(days=1)
-		reservations_for_that_day = Reservation.objects.filter(cancelled=False, shortened=False,
-															   start__gte=start_of_day, end__lte=end_of_day, user=user,
-															   tool=new_reservation.tool)
-		# Exclude any reservation that is being cancelled.
-		if cancelled_reservation and cancelled_reservation.id:
-			reservations_for_that_day = reservations_for_that_day.exclude(id=cancelled_reservation.id)
-		if reservations_for_that_day.count() >= new_reservation.tool.maximum_reservations_per_day:
+		# Any reservation that is being cancelled is excluded from the count.
+		if conflict_index.user_reservation_count_for_the_day() >= new_reservation.tool.maximum_reservations_per_day:
 			tool_policy_problems.append("You may only have " + str(
 				new_reservation.tool.maximum_reservations_per_day) + " reservations for this tool per day. Missed reservations are included when counting the number of reservations per day.")
 
@@ -258,20 +345,10 @@ def check_policy_rules_for_tool(cancelled_reservation, new_reservation, user):
 	# An explicit policy override allows this rule to be broken.
 	if new_reservation.tool.minimum_time_between_reservations:
 		buffer_time = timedelta(minutes=new_reservation.tool.minimum_time_between_reservations)
-		must_end_before = new_reservation.start - buffer_time
-		too_close = Reservation.objects.filter(cancelled=False, shortened=False, user=user, end__gt=must_end_before,
-											   start__lt=new_reservation.start, tool=new_reservation.tool)
-		if cancelled_reservation and cancelled_reservation.id:
-			too_close = too_close.exclude(id=cancelled_reservation.id)
-		if too_close.exists():
+		if conflict_index.user_reservation_ends_too_close(buffer_time):
 			tool_policy_problems.append("Separate reservations for this tool that belong to you must be at least " + str(
 				new_reservation.tool.minimum_time_between_reservations) + " minutes apart from each other. The proposed reservation ends too close to another reservation.")
-		must_start_after = new_reservation.end + buffer_time
-		too_close = Reservation.objects.filter(cancelled=False, shortened=False, user=user, start__lt=must_start_after,
-											   end__gt=new_reservation.start, tool=new_reservation.tool)
-		if cancelled_reservation and cancelled_reservation.id:
-			too_close = too_close.exclude(id=cancelled_reservation.id)
-		if too_close.exists():
+		if conflict_index.user_reservation_begins_too_close(buffer_time):
 			tool_policy_problems.append("Separate reservations for this tool that belong to you must be at least " + str(
 				new_reservation.tool.minimum_time_between_reservations) + " minutes apart from each other. The proposed reservation begins too close to another reservation.")
 
@@ -279,13 +356,7 @@ def check_policy_rules_for_tool(cancelled_reservation, new_reservation, user):
 	# Staff may break this rule.
 	# An explicit policy override allows this rule to be broken.
 	if new_reservation.tool.maximum_future_reservation_time:
-		reservations_after_now = Reservation.objects.filter(cancelled=False, user=user, tool=new_reservation.tool,
-															start__gte=timezone.now())
-		if cancelled_reservation and cancelled_reservation.id:
-			reservations_after_now = reservations_after_now.exclude(id=cancelled_reservation.id)
-		amount_reserved_in_the_future = new_reservation.duration()
-		for r in reservations_after_now:
-			amount_reserved_in_the_future += r.duration()
+		amount_reserved_in_the_future = new_reservation.duration() + conflict_index.user_future_reserved_time()
 		if amount_reserved_in_the_future.total_seconds() / 60 > new_reservation.tool.maximum_future_reservation_time:
 			tool_policy_problems.append("You may only reserve up to " + str(
 				new_reservation.tool.maximum_future_reservation_time) + " minutes of time on this tool, starting from the current time onward.")
@@ -340,6 +411,49 @@ def check_policy_to_create_outage(outage):
 	return None
 
 
+area_access_profile_version_name = 'area_access_profile'
+area_access_profile_cache_timeout = 60
+
+
+class AreaAccessProfile:
+	"""
+	Everything the area access policy needs to know about a user besides the user itself: their active projects,
+	the schedules of the physical access levels they can use in each area, and the areas that can't be entered
+	because a resource is unavailable. It is cached so a badge swipe doesn't query them again.
+	"""
+
+	def __init__(self, user: User):
+		self.active_projects = list(user.active_projects())
+		self.access_schedules = {}
+		access_levels = PhysicalAccessLevel.objects.filter(users=user)
+		if user.is_staff:
+			# If explicitly set on the Physical Access Level, staff may be exempt from being granted explicit access
+			access_levels = PhysicalAccessLevel.objects.filter(Q(users=user) | Q(allow_staff_access=True))
+		for area_id, schedule in access_levels.order_by().values_list('area_id', 'schedule').distinct():
+			self.access_schedules.setdefault(area_id, set()).add(schedule)
+		self.areas_with_unavailable_resources = set(Resource.objects.filter(available=False, dependent_areas__isnull=False).values_list('dependent_areas', flat=True))
+
+	def has_physical_access(self) -> bool:
+		return bool(self.access_schedules)
+
+	def can_access_now(self, area: Area) -> bool:
+		return any(PhysicalAccessLevel.schedule_is_accessible(schedule) for schedule in self.access_schedules.get(area.id, []))
+
+
+def get_area_access_profile(user: User) -> AreaAccessProfile:
+	""" Returns the area access profile of the user, loading it again after anything it depends on was saved or deleted. """
+	return get_cached_data(
+		area_access_profile_version_name,
+		lambda version: cache.get(f'NEMO.area_access_profile.{version}.{user.id}'),
+		lambda: AreaAccessProfile(user),
+		lambda version, profile: cache.set(f'NEMO.area_access_profile.{version}.{user.id}', profile, area_access_profile_cache_timeout),
+	)
+
+
+def invalidate_area_access_profiles():
+	invalidate_cache_version(area_access_profile_version_name)
+
+
 def check_policy_to_enter_any_area(user: User):
 	"""
 	Checks the area access policy for a user.
@@ -347,33 +461,29 @@ def check_policy_to_enter_any_area(user: User):
 	if not user.is_active:
 		raise InactiveUserError(user=user)
 
-	if user.active_project_count() < 1:
+	profile = get_area_access_profile(user)
+	if not profile.active_projects:
 		raise NoActiveProjectsForUserError(user=user)
 
 	if user.access_expiration is not None and user.access_expiration < date.today():
 		raise PhysicalAccessExpiredUserError(user=user)
 
-	user_has_access_to_at_least_one_area = user.physical_access_levels.all().exists()
-	staff_has_access_to_at_least_one_area = user.is_staff and PhysicalAccessLevel.objects.filter(allow_staff_access=True).exists()
-	if not (user_has_access_to_at_least_one_area or staff_has_access_to_at_least_one_area):
+	if not profile.has_physical_access():
 		raise NoPhysicalAccessUserError(user=user)
 
 
 def check_policy_to_enter_this_area(area:Area, user:User):
-	# If explicitly set on the Physical Access Level, staff may be exempt from being granted explicit access
-	if user.is_staff and any([access_level.accessible() for access_level in PhysicalAccessLevel.objects.filter(allow_staff_access=True, area=area)]):
-		pass
-	else:
-		# Check if the user normally has access to this area door at the current time
-		if not any([access_level.accessible() for access_level in user.physical_access_levels.filter(area=area)]):
-			raise NoAccessiblePhysicalAccessUserError(user=user, area=area)
+	profile = get_area_access_profile(user)
+	# Check if the user normally has access to this area door at the current time
+	if not profile.can_access_now(area):
+		raise NoAccessiblePhysicalAccessUserError(user=user, area=area)
 
 	if not user.is_staff:
-		unavailable_resources = area.required_resources.filter(available=False)
-		if unavailable_resources:
+		if area.id in profile.areas_with_unavailable_resources:
+			unavailable_resources = area.required_resources.filter(available=False)
 			raise UnavailableResourcesUserError(user=user, area=area, resources=unavailable_resources)
 
 		# If we reached maximum capacity (non-staff user), fail
-		area_occupancy = AreaAccessRecord.objects.filter(area=area, end=None, staff_charge=None).count()
+		area_occupancy = get_area_occupancy().get_count(area.id)
 		if 0 < area.maximum_capacity <= area_occupancy:
 			raise MaximumCapacityReachedError(user=user, area=area)
@@ -1,14 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import List, Tuple
 from urllib.parse import urljoin
 
 import requests
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
 from django.http import HttpResponseBadRequest, HttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.http import require_GET, require_POST
+from requests.adapters import HTTPAdapter
 
 from NEMO.models import Tool, MembershipHistory, User
 
+qualifications_logger = getLogger(__name__)
+
+# Maximum number of requests sent to the identity service at the same time
+identity_service_concurrency = 8
+
 
 @staff_member_required(login_url=None)
 @require_GET
@@ -35,53 +45,10 @@ def modify_qualifications(request):
 	if tools == {}:
 		return HttpResponseBadRequest("You must specify at least one tool.")
 
-	for user in users.values():
-		original_qualifications = set(user.qualifications.all())
-		if action == 'qualify':
-			user.qualifications.add(*tools)
-			original_physical_access_levels = set(user.physical_access_levels.all())
-			physical_access_level_automatic_enrollment = list(set([t.grant_physical_access_level_upon_qualification for t in tools.values() if t.grant_physical_access_level_upon_qualification]))
-			user.physical_access_levels.add(*physical_access_level_automatic_enrollment)
-			current_physical_access_levels = set(user.physical_access_levels.all())
-			added_physical_access_levels = set(current_physical_access_levels) - set(original_physical_access_levels)
-			for access_level in added_physical_access_levels:
-				entry = MembershipHistory()
-				entry.authorizer = request.user
-				entry.parent_content_object = access_level
-				entry.child_content_object = user
-				entry.action = entry.Action.ADDED
-				entry.save()
-			if settings.IDENTITY_SERVICE['available']:
-				for t in tools:
-					tool = Tool.objects.get(id=t)
-					if tool.grant_badge_reader_access_upon_qualification:
-						parameters = {
-							'username': user.username,
-							'domain': user.domain,
-							'requested_area': tool.grant_badge_reader_access_upon_qualification,
-						}
-						timeout = settings.IDENTITY_SERVICE.get('timeout', 3)
-						requests.put(urljoin(settings.IDENTITY_SERVICE['url'], '/add/'), data=parameters, timeout=timeout)
-		elif action == 'disqualify':
-			user.qualifications.remove(*tools)
-		current_qualifications = set(user.qualifications.all())
-		# Record the qualification changes for each tool:
-		added_qualifications = set(current_qualifications) - set(original_qualifications)
-		for tool in added_qualifications:
-			entry = MembershipHistory()
-			entry.authorizer = request.user
-			entry.parent_content_object = tool
-			entry.child_content_object = user
-			entry.action = entry.Action.ADDED
-			entry.save()
-		removed_qualifications = set(original_qualifications) - set(current_qualifications)
-		for tool in removed_qualifications:
-			entry = MembershipHistory()
-			entry.authorizer = request.user
-			entry.parent_content_object = tool
-			entry.child_content_object = user
-			entry.action = entry.Action.REMOVED
-			entry.save()
+	if action == 'qualify':
+		qualify(request.user, list(users.values()), list(tools.values()))
+	elif action == 'disqualify':
+		disqualify(request.user, list(users.values()), list(tools.values()))
 
 	if request.POST.get('redirect') == 'true':
 		dictionary = {
@@ -94,6 +61,69 @@ def modify_qualifications(request):
 		return HttpResponse()
 
 
+def qualify(authorizer: User, users: List[User], tools: List[Tool]):
+	"""
+	Qualifies the users on the tools, and grants them the physical access levels that come with the tools.
+	The changes are found with one query per kind of membership and are saved in one transaction, along with their history.
+	Badge reader access is then requested from the identity service for all of them at once.
+	"""
+	user_ids = [user.id for user in users]
+	tool_ids = [tool.id for tool in tools]
+	access_levels = {tool.grant_physical_access_level_upon_qualification for tool in tools if tool.grant_physical_access_level_upon_qualification}
+	with transaction.atomic():
+		qualifications = set(User.qualifications.through.objects.filter(user_id__in=user_ids, tool_id__in=tool_ids).values_list('user_id', 'tool_id'))
+		physical_access_levels = set(User.physical_access_levels.through.objects.filter(user_id__in=user_ids, physicalaccesslevel_id__in=[level.id for level in access_levels]).values_list('user_id', 'physicalaccesslevel_id'))
+		history = []
+		for tool in tools:
+			added_users = [user for user in users if (user.id, tool.id) not in qualifications]
+			if added_users:
+				tool.user_set.add(*added_users)
+				history.extend(MembershipHistory(authorizer=authorizer, parent_content_object=tool, child_content_object=user, action=MembershipHistory.Action.ADDED) for user in added_users)
+		for access_level in access_levels:
+			added_users = [user for user in users if (user.id, access_level.id) not in physical_access_levels]
+			if added_users:
+				access_level.users.add(*added_users)
+				history.extend(MembershipHistory(authorizer=authorizer, parent_content_object=access_level, child_content_object=user, action=MembershipHistory.Action.ADDED) for user in added_users)
+		MembershipHistory.objects.bulk_create(history)
+	if settings.IDENTITY_SERVICE['available']:
+		grant_badge_reader_access([(user, tool.grant_badge_reader_access_upon_qualification) for tool in tools if tool.grant_badge_reader_access_upon_qualification for user in users])
+
+
+def disqualify(authorizer: User, users: List[User], tools: List[Tool]):
+	""" Disqualifies the users from the tools, in one transaction along with the history of the changes. """
+	user_ids = [user.id for user in users]
+	with transaction.atomic():
+		qualifications = set(User.qualifications.through.objects.filter(user_id__in=user_ids, tool_id__in=[tool.id for tool in tools]).values_list('user_id', 'tool_id'))
+		history = []
+		for tool in tools:
+			removed_users = [user for user in users if (user.id, tool.id) in qualifications]
+			if removed_users:
+				tool.user_set.remove(*removed_users)
+				history.extend(MembershipHistory(authorizer=authorizer, parent_content_object=tool, child_content_object=user, action=MembershipHistory.Action.REMOVED) for user in removed_users)
+		MembershipHistory.objects.bulk_create(history)
+
+
+def grant_badge_reader_access(grants: List[Tuple[User, str]]):
+	"""
+	Asks the identity service to give each user access to the badge reader area, sending the requests concurrently over one
+	pooled session. The first error is raised once all the requests are done.
+	"""
+	if not grants:
+		return
+	timeout = settings.IDENTITY_SERVICE.get('timeout', 3)
+	url = urljoin(settings.IDENTITY_SERVICE['url'], '/add/')
+	worker_count = min(len(grants), identity_service_concurrency)
+	with requests.Session() as session:
+		session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=worker_count))
+		with ThreadPoolExecutor(max_workers=worker_count) as executor:
+			results = [executor.submit(session.put, url, data={'username': user.username, 'domain': user.domain, 'requested_area': area}, timeout=timeout) for user, area in grants]
+	errors = [result.exception() for result in results if result.exception()]
+	for error in errors:
+		qualifications_logger.error(f"The identity service could not grant badge reader access: {error}")
+	if errors:
+		raise errors[0]
+
+
 @staff_member_required(login_url=None)
 @require_GET
 def get_qualified_users(request):
@@ -2,14 +2,14 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
-from django.template import Context, Template
+from django.template import Context
 from django.urls import reverse
 from django.views.decorators.http import require_GET, require_http_methods
 
 from NEMO.forms import SafetyIssueCreationForm, SafetyIssueUpdateForm
 from NEMO.models import SafetyIssue
 from NEMO.utilities import send_mail
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_contents, get_media_file_template
 from NEMO.views.notifications import create_safety_notification, delete_safety_notification, get_notifications
 
 
@@ -42,10 +42,10 @@ def send_safety_email_notification(request, issue):
 		'issue_absolute_url': request.build_absolute_uri(issue.get_absolute_url()),
 	}
 	recipient = get_customization('safety_email_address')
-	message = get_media_file_contents('safety_issue_email.html')
-	if not recipient or not message:
+	template = get_media_file_template('safety_issue_email.html')
+	if not recipient or not template:
 		return
-	rendered_message = Template(message).render(Context(dictionary))
+	rendered_message = template.render(Context(dictionary))
 	from_email = issue.reporter.email if issue.reporter else recipient
 	send_mail(subject, rendered_message, from_email, [recipient])
 
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.db.models import Q
 from django.http import HttpResponse
 from django.shortcuts import render
@@ -6,7 +8,7 @@ from django.utils import timezone
 from django.views.decorators.http import require_GET
 
 from NEMO.decorators import disable_session_expiry_refresh
-from NEMO.models import Area, AreaAccessRecord, Resource, ScheduledOutage, Task, Tool, UsageEvent
+from NEMO.models import Area, AreaAccessRecord, Resource, ScheduledOutage, Task, Tool, UsageEvent, get_area_occupancy, get_cached_data, invalidate_cache_version
 
 
 @login_required
@@ -21,7 +23,7 @@ def status_dashboard(request, tab=None):
 		dictionary = {
 			'tab': tab if tab else "occupancy",
 			'tool_summary': create_tool_summary(),
-			'nanofab_occupants': AreaAccessRecord.objects.filter(end=None, staff_charge=None).prefetch_related('customer', 'project', 'area'),
+			'nanofab_occupants': get_nanofab_occupants(),
 		}
 		return render(request, 'status_dashboard/status_dashboard.html', dictionary)
 	elif interest == "tools":
@@ -31,31 +33,68 @@ def status_dashboard(request, tab=None):
 		return render(request, 'status_dashboard/tools.html', dictionary)
 	elif interest == "occupancy":
 		dictionary = {
-			'nanofab_occupants': AreaAccessRecord.objects.filter(end=None, staff_charge=None).prefetch_related('customer', 'project', 'area'),
+			'nanofab_occupants': get_nanofab_occupants(),
 		}
 		return render(request, 'status_dashboard/occupancy.html', dictionary)
 
 
+# The tool summary is shared by all users. It is cached, and its version changes whenever a tool, task, resource, scheduled outage
+# or usage event changes, so every process builds it again (see get_cached_data).
+tool_summary_version_name = 'tool_summary'
+
+
+def get_tool_summary_cache_timeout():
+	return getattr(settings, 'TOOL_SUMMARY_CACHE_TIMEOUT', 15)
+
+
+def invalidate_tool_summary():
+	invalidate_cache_version(tool_summary_version_name)
+
+
 def create_tool_summary():
-	tools = Tool.objects.filter(visible=True)
-	tasks = Task.objects.filter(cancelled=False, resolved=False, tool__visible=True).prefetch_related('tool')
+	tool_summary, expiration = get_cached_data(tool_summary_version_name, lambda version: cache.get(f'NEMO.tool_summary.{version}'), build_tool_summary, cache_tool_summary)
+	return tool_summary
+
+
+def cache_tool_summary(version, tool_summary_and_expiration):
+	# Delayed logoffs and scheduled outages start and end without anything being saved, so the summary expires when the next one does.
+	timeout = get_tool_summary_cache_timeout()
+	expiration = tool_summary_and_expiration[1]
+	if expiration:
+		timeout = max(1, min(timeout, int((expiration - timezone.now()).total_seconds()) + 1))
+	cache.set(f'NEMO.tool_summary.{version}', tool_summary_and_expiration, timeout)
+
+
+def build_tool_summary():
+	""" Returns the tool summary, and the next time it will change on its own (or None) """
+	now = timezone.now()
+	tools = Tool.objects.filter(visible=True).select_related('parent_tool')
+	tasks = Task.objects.filter(cancelled=False, resolved=False, tool__visible=True).only('tool')
 	unavailable_resources = Resource.objects.filter(available=False).prefetch_related('fully_dependent_tools', 'partially_dependent_tools')
 	# also check for visibility on the parent if there is one (alternate tool are hidden)
-	usage_events = UsageEvent.objects.filter(Q(end=None, tool__visible=True)|Q(end=None, tool__parent_tool__visible=True)).prefetch_related('operator', 'user', 'tool')
-	scheduled_outages = ScheduledOutage.objects.filter(start__lte=timezone.now(), end__gt=timezone.now())
-	tool_summary = merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages)
+	usage_events = UsageEvent.objects.filter(Q(end=None, tool__visible=True)|Q(end=None, tool__parent_tool__visible=True)).select_related('operator', 'user', 'tool')
+	scheduled_outages = ScheduledOutage.objects.filter(start__lte=now, end__gt=now).select_related('tool').prefetch_related('resource__fully_dependent_tools', 'resource__partially_dependent_tools')
+	delayed_logoff_events = UsageEvent.objects.filter(end__gt=now).select_related('tool')
+	tool_summary = merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages, delayed_logoff_events)
 	tool_summary = list(tool_summary.values())
 	tool_summary.sort(key=lambda x: x['name'])
-	return tool_summary
+	upcoming_changes = [event.end for event in delayed_logoff_events] + [outage.end for outage in scheduled_outages]
+	next_outage = ScheduledOutage.objects.filter(start__gt=now).order_by('start').values_list('start', flat=True).first()
+	if next_outage:
+		upcoming_changes.append(next_outage)
+	return tool_summary, min(upcoming_changes) if upcoming_changes else None
 
 
-def merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages):
+def merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages, delayed_logoff_events=None):
 	result = {}
-	tools_with_delayed_logoff_in_effect = [x.tool.tool_or_parent_id() for x in UsageEvent.objects.filter(end__gt=timezone.now())]
-	parent_ids = Tool.objects.filter(parent_tool__isnull=False).values_list('parent_tool_id', flat=True)
+	if delayed_logoff_events is None:
+		delayed_logoff_events = UsageEvent.objects.filter(end__gt=timezone.now()).select_related('tool')
+	tools_with_delayed_logoff_in_effect = [x.tool.tool_or_parent_id() for x in delayed_logoff_events]
+	# A parent tool is displayed with the name of its child tool when the child tool is in use.
+	tool_in_use_names = {event.tool.tool_or_parent_id(): event.tool.name for event in usage_events}
 	for tool in tools:
 		result[tool.tool_or_parent_id()] = {
-			'name': tool.name_or_child_in_use_name(parent_ids=parent_ids),
+			'name': tool_in_use_names.get(tool.id, tool.name),
 			'id': tool.id,
 			'user': '',
 			'operator': '',
@@ -70,7 +109,7 @@ def merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages):
 			'scheduled_partial_outage': False,
 		}
 	for task in tasks:
-		result[task.tool.id]['problematic'] = True
+		result[task.tool_id]['problematic'] = True
 	for event in usage_events:
 		result[event.tool.tool_or_parent_id()]['operator'] = str(event.operator)
 		result[event.tool.tool_or_parent_id()]['user'] = str(event.operator)
@@ -79,30 +118,41 @@ def merge(tools, tasks, unavailable_resources, usage_events, scheduled_outages):
 		result[event.tool.tool_or_parent_id()]['in_use'] = True
 		result[event.tool.tool_or_parent_id()]['in_use_since'] = event.start
 	for resource in unavailable_resources:
-		for tool in resource.fully_dependent_tools.filter(visible=True):
-			result[tool.id]['required_resource_is_unavailable'] = True
-		for tool in resource.partially_dependent_tools.filter(visible=True):
-			result[tool.id]['nonrequired_resource_is_unavailable'] = True
+		for tool in resource.fully_dependent_tools.all():
+			if tool.visible:
+				result[tool.id]['required_resource_is_unavailable'] = True
+		for tool in resource.partially_dependent_tools.all():
+			if tool.visible:
+				result[tool.id]['nonrequired_resource_is_unavailable'] = True
 	for outage in scheduled_outages:
 		if outage.tool_id and outage.tool.visible:
 			result[outage.tool.id]['scheduled_outage'] = True
 		elif outage.resource_id:
-			for t in outage.resource.fully_dependent_tools.filter(visible=True):
-				result[t.id]['scheduled_outage'] = True
-			for t in outage.resource.partially_dependent_tools.filter(visible=True):
-				result[t.id]['scheduled_partial_outage'] = True
+			for t in outage.resource.fully_dependent_tools.all():
+				if t.visible:
+					result[t.id]['scheduled_outage'] = True
+			for t in outage.resource.partially_dependent_tools.all():
+				if t.visible:
+					result[t.id]['scheduled_partial_outage'] = True
 	return result
 
 
+def get_nanofab_occupants():
+	""" The open area access records (area access charged to a staff member excluded), only queried when somebody is logged in to an area. """
+	if not get_area_occupancy().records:
+		return AreaAccessRecord.objects.none()
+	return AreaAccessRecord.objects.filter(end=None, staff_charge=None).prefetch_related('customer', 'project', 'area')
+
+
 @login_required
 @require_GET
 @disable_session_expiry_refresh
 def occupancy(request):
-	area = request.GET.get('occupancy')
-	if area is None or not Area.objects.filter(name=area).exists():
+	area = Area.objects.filter(name=request.GET.get('occupancy')).first()
+	if area is None:
 		return HttpResponse()
 	dictionary = {
-		'area': area,
-		'occupants': AreaAccessRecord.objects.filter(area__name=area, end=None, staff_charge=None).prefetch_related('customer'),
+		'area': area.name,
+		'occupants': AreaAccessRecord.objects.filter(area=area, end=None, staff_charge=None).prefetch_related('customer') if get_area_occupancy().get_count(area.id) else AreaAccessRecord.objects.none(),
 	}
 	return render(request, 'occupancy.html', dictionary)
@@ -6,15 +6,16 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.files.base import ContentFile
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template import Context, Template
+from django.template import Context
 from django.utils import timezone
 from django.views.decorators.http import require_GET, require_POST
 
 from NEMO.forms import TaskForm, nice_errors, TaskImagesForm
 from NEMO.models import Interlock, Reservation, SafetyIssue, Task, TaskCategory, TaskHistory, TaskStatus, UsageEvent, TaskImages
 from NEMO.utilities import bootstrap_primary_color, format_datetime, send_mail, create_email_attachment, resize_image
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_template
 from NEMO.views.safety import send_safety_email_notification
+from NEMO.views.status_dashboard import invalidate_tool_summary
 from NEMO.views.tool_control import determine_tool_status
 
 tasks_logger = getLogger("NEMO.Tasks")
@@ -54,6 +55,7 @@ def create(request):
 		task.tool.save()
 		# End any usage events in progress for the tool or the tool's children.
 		UsageEvent.objects.filter(tool_id__in=task.tool.get_family_tool_ids(), end=None).update(end=timezone.now())
+		invalidate_tool_summary()
 		# Lock the interlock for this tool.
 		try:
 			tool_interlock = Interlock.objects.get(tool__id=task.tool.id)
@@ -73,11 +75,11 @@ def create(request):
 
 
 def send_new_task_emails(request, task: Task, task_images: List[TaskImages]):
-	message = get_media_file_contents('new_task_email.html')
+	template = get_media_file_template('new_task_email.html')
 	attachments = None
 	if task_images:
 		attachments = [create_email_attachment(task_image.image, task_image.image.name) for task_image in task_images]
-	if message:
+	if template:
 		dictionary = {
 			'template_color': bootstrap_primary_color('danger') if task.force_shutdown else bootstrap_primary_color('warning'),
 			'user': request.user,
@@ -87,7 +89,7 @@ def send_new_task_emails(request, task: Task, task_images: List[TaskImages]):
 		}
 		# Send an email to the appropriate NanoFab staff that a new task has been created:
 		subject = ('SAFETY HAZARD: ' if task.safety_hazard else '') + task.tool.name + (' shutdown' if task.force_shutdown else ' problem')
-		message = Template(message).render(Context(dictionary))
+		message = template.render(Context(dictionary))
 		managers = []
 		if hasattr(settings, 'LAB_MANAGERS'):
 			managers = settings.LAB_MANAGERS
@@ -96,16 +98,15 @@ def send_new_task_emails(request, task: Task, task_images: List[TaskImages]):
 
 	# Send an email to any user (excluding staff) with a future reservation on the tool:
 	user_office_email = get_customization('user_office_email_address')
-	message = get_media_file_contents('new_task_email.html')
-	if user_office_email and message:
+	if user_office_email and template:
 		upcoming_reservations = Reservation.objects.filter(start__gt=timezone.now(), cancelled=False, tool=task.tool, user__is_staff=False)
 		for reservation in upcoming_reservations:
 			if not task.tool.operational:
 				subject = reservation.tool.name + " reservation problem"
-				rendered_message = Template(message).render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('danger'), 'fatal_error': True}))
+				rendered_message = template.render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('danger'), 'fatal_error': True}))
 			else:
 				subject = reservation.tool.name + " reservation warning"
-				rendered_message = Template(message).render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('warning'), 'fatal_error': False}))
+				rendered_message = template.render(Context({'reservation': reservation, 'template_color': bootstrap_primary_color('warning'), 'fatal_error': False}))
 			reservation.user.email_user(subject, rendered_message, user_office_email)
 
 
@@ -239,8 +240,8 @@ def set_task_status(request, task, status_name, user):
 	task.progress_description = status_message if task.progress_description is None else task.progress_description + '\n\n' + status_message
 	task.save()
 
-	message = get_media_file_contents('task_status_notification.html')
-	if not message:
+	template = get_media_file_template('task_status_notification.html')
+	if not template:
 		return
 
 	dictionary = {
@@ -253,7 +254,7 @@ def set_task_status(request, task, status_name, user):
 	}
 	# Send an email to the appropriate NanoFab staff that a new task has been created:
 	subject = f'{task.tool} task notification'
-	message = Template(message).render(Context(dictionary))
+	message = template.render(Context(dictionary))
 	recipients = [
 		task.tool.primary_tool_owner.email if status.notify_primary_tool_owner else None,
 		task.tool.notification_email_address if status.notify_tool_notification_email else None,
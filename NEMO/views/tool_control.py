@@ -10,6 +10,7 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseServerError
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
+from django.utils.safestring import mark_safe
 from django.views.decorators.http import require_GET, require_POST
 
 from NEMO import rates
@@ -18,7 +19,7 @@ from NEMO.models import Comment, Configuration, ConfigurationHistory, Project, R
 from NEMO.utilities import extract_times, quiet_int
 from NEMO.views.policy import check_policy_to_disable_tool, check_policy_to_enable_tool
 from NEMO.widgets.configuration_editor import ConfigurationEditor
-from NEMO.widgets.dynamic_form import DynamicForm
+from NEMO.widgets.dynamic_form import get_dynamic_form
 from NEMO.widgets.tool_tree import ToolTree
 
 tool_control_logger = getLogger(__name__)
@@ -48,15 +49,19 @@ def tool_control(request, tool_id=None):
 def tool_status(request, tool_id):
 	""" Gets the current status of the tool (that is, whether it is currently in use or not). """
 	tool = get_object_or_404(Tool, id=tool_id, visible=True)
+	current_usage_event = tool.get_current_usage_event()
 
 	dictionary = {
 		'tool': tool,
+		'current_usage_event': current_usage_event,
+		'tool_name': current_usage_event.tool.name if current_usage_event and tool.is_parent_tool() else tool.name,
+		'delayed_logoff_in_progress': tool.delayed_logoff_in_progress(),
 		'tool_rate': rates.rate_class.get_tool_rate(tool),
 		'task_categories': TaskCategory.objects.filter(stage=TaskCategory.Stage.INITIAL_ASSESSMENT),
 		'rendered_configuration_html': tool.configuration_widget(request.user),
 		'mobile': request.device == 'mobile',
 		'task_statuses': TaskStatus.objects.all(),
-		'post_usage_questions': DynamicForm(tool.post_usage_questions).render(),
+		'post_usage_questions': get_dynamic_form(tool.post_usage_questions).render(),
 		'configs': get_tool_full_config_history(tool),
 	}
 
@@ -86,24 +91,23 @@ def use_tool_for_other(request):
 def get_tool_full_config_history(tool: Tool):
 	# tool config by user and tool and time
 	configs = []
-	config_history = ConfigurationHistory.objects.filter(configuration__tool_id=tool.id).order_by('-modification_time')[:20]
-	configurations = tool.current_ordered_configurations()
+	config_history = ConfigurationHistory.objects.filter(configuration__tool_id=tool.id).select_related('user').order_by('-modification_time')[:20]
+	configurations = list(tool.current_ordered_configurations())
+	# Each snapshot only differs from the previous one by a single configuration, so only that configuration is rendered again.
+	editor = ConfigurationEditor()
+	rendered_configurations = {co.id: editor.render_configuration(co, False) for co in configurations}
 	for c in config_history:
 		for co in configurations:
-			if co == c.configuration:
+			if co.id == c.configuration_id:
 				current_settings = co.current_settings_as_list()
 				current_settings[c.slot] = c.setting
 				co.current_settings = ', '.join(current_settings)
-		config_input = {
-			'configurations': configurations,
-			'render_as_form': False,
-		}
-		configuration = ConfigurationEditor()
+				rendered_configurations[co.id] = editor.render_configuration(co, False)
 		configs.append(
 			{
 				'modification_time': c.modification_time,
 				'user': c.user,
-				'html': configuration.render(None, config_input),
+				'html': mark_safe(''.join(rendered_configurations[co.id] for co in configurations)),
 			}
 		)
 	return configs
@@ -255,7 +259,7 @@ def disable_tool(request, tool_id):
 	current_usage_event.end = timezone.now() + downtime
 
 	# Collect post-usage questions
-	dynamic_form = DynamicForm(tool.post_usage_questions)
+	dynamic_form = get_dynamic_form(tool.post_usage_questions)
 	current_usage_event.run_data = dynamic_form.extract(request)
 	dynamic_form.charge_for_consumable(current_usage_event.user, current_usage_event.operator, current_usage_event.project, current_usage_event.run_data)
 
@@ -5,7 +5,7 @@ from django.views.decorators.http import require_http_methods
 
 from NEMO.models import User, Project
 from NEMO.utilities import send_mail
-from NEMO.views.customization import get_customization, get_media_file_contents
+from NEMO.views.customization import get_customization, get_media_file_contents, get_media_file_template
 
 
 @login_required
@@ -27,9 +27,9 @@ def nanofab_rules(request):
 			'making_reservations_rule_summary': summary,
 		}
 		abuse_email = get_customization('abuse_email_address')
-		email_contents = get_media_file_contents('nanofab_rules_tutorial_email.html')
-		if abuse_email and email_contents:
-			message = Template(email_contents, dictionary).render(Context(dictionary))
+		email_template = get_media_file_template('nanofab_rules_tutorial_email.html')
+		if abuse_email and email_template:
+			message = email_template.render(Context(dictionary))
 			send_mail('NanoFab rules tutorial', message, abuse_email, [abuse_email])
 		dictionary = {
 			'title': 'NanoFab rules tutorial',
@@ -7,16 +7,22 @@ import requests
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseBadRequest
+from django.db.models import Q
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
+from django.utils.html import escape
 from django.views.decorators.http import require_GET, require_http_methods, require_POST
 
+from NEMO import interlocks
 from NEMO.forms import UserForm, UserPreferencesForm
 from NEMO.models import User, Project, Tool, PhysicalAccessLevel, Reservation, StaffCharge, UsageEvent, AreaAccessRecord, ActivityHistory, UserPreferences, record_local_many_to_many_changes, record_active_state
 
 users_logger = getLogger(__name__)
 
+# Badge numbers are positive integers, which have at most 10 digits in every database
+badge_number_max_digits = 10
+
 @staff_member_required(login_url=None)
 @require_GET
 def users(request):
@@ -24,6 +30,47 @@ def users(request):
 	return render(request, 'users/users.html', {'users': all_users})
 
 
+def get_user_search_page_size() -> int:
+	""" Number of users returned by each page of the user search. """
+	return getattr(settings, 'USER_SEARCH_PAGE_SIZE', 20)
+
+
+@staff_member_required(login_url=None)
+@require_GET
+def search_users(request):
+	"""
+	Searches the users for the autocomplete boxes. Each word of the query must be the beginning of the user's first name,
+	last name or username, or their badge number. Only active users are returned when "active" is set, and the user
+	given by "exclude" is left out. The results are paged with "page" and "limit".
+	"""
+	try:
+		page = max(int(request.GET.get('page', 1)), 1)
+		limit = min(max(int(request.GET.get('limit', get_user_search_page_size())), 1), 100)
+		exclude = int(request.GET['exclude']) if request.GET.get('exclude') else None
+	except ValueError:
+		return HttpResponseBadRequest('Invalid page, limit or excluded user')
+	terms = request.GET.get('query', '').split()
+	if not terms:
+		return JsonResponse({'results': [], 'page': page, 'has_next': False})
+	users = User.objects.all()
+	for term in terms:
+		match = Q(first_name__istartswith=term) | Q(last_name__istartswith=term) | Q(username__istartswith=term)
+		# Longer numbers can't be badge numbers, and don't fit in the column
+		if term.isdecimal() and len(term) <= badge_number_max_digits:
+			match |= Q(badge_number=int(term))
+		users = users.filter(match)
+	if request.GET.get('active') == 'true':
+		users = users.filter(is_active=True)
+	if exclude is not None:
+		users = users.exclude(id=exclude)
+	offset = (page - 1) * limit
+	# One more user than the page size tells whether there is a next page
+	users = list(users.order_by('first_name', 'last_name', 'id').only('id', 'first_name', 'last_name', 'username')[offset:offset + limit + 1])
+	# Escaped like the names of the user lists embedded in the pages, since the autocomplete displays them as HTML
+	results = [{'name': escape(str(user)), 'id': user.id} for user in users[:limit]]
+	return JsonResponse({'results': results, 'page': page, 'has_next': len(users) > limit})
+
+
 @staff_member_required(login_url=None)
 @require_http_methods(['GET', 'POST'])
 def create_or_modify_user(request, user_id):
@@ -170,7 +217,7 @@ def deactivate(request, user_id):
 		'user_to_deactivate': get_object_or_404(User, id=user_id),
 		'reservations': Reservation.objects.filter(user=user_id, cancelled=False, missed=False, end__gt=timezone.now()),
 		'staff_charges': StaffCharge.objects.filter(customer=user_id, end=None),
-		'tool_usage': UsageEvent.objects.filter(user=user_id, end=None).prefetch_related('tool'),
+		'tool_usage': UsageEvent.objects.filter(user=user_id, end=None).select_related('tool__parent_tool___interlock__card__category', 'tool___interlock__card__category'),
 	}
 	user_to_deactivate = dictionary['user_to_deactivate']
 	if request.method == 'GET':
@@ -202,11 +249,14 @@ def deactivate(request, user_id):
 				reservation.cancelled_by = request.user
 				reservation.save()
 		if request.POST.get('disable_tools') == 'on':
-			# End all current tool usage
-			for usage_event in dictionary['tool_usage']:
-				if usage_event.tool.interlock and not usage_event.tool.interlock.lock():
-					error_message = f"The interlock command for the {usage_event.tool} failed. The error message returned: {usage_event.tool.interlock.most_recent_reply}"
+			# End all current tool usage, locking all the interlocks at once
+			tool_interlocks = {usage_event.tool: usage_event.tool.interlock for usage_event in dictionary['tool_usage'] if usage_event.tool.interlock}
+			locked = interlocks.bulk_lock(tool_interlocks.values())
+			for tool, interlock in tool_interlocks.items():
+				if not locked[interlock.id]:
+					error_message = f"The interlock command for the {tool} failed. The error message returned: {interlock.most_recent_reply}"
 					users_logger.error(error_message)
+			for usage_event in dictionary['tool_usage']:
 				usage_event.end = timezone.now()
 				usage_event.save()
 		if request.POST.get('force_area_logout') == 'on':
@@ -3,20 +3,58 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 
+class ConfigurationEditorContext:
+	"""
+	Decides which configurations a user can change. The tools in use and the configurations the user maintains
+	are loaded once, so that any number of configurations (from any number of tools) can be rendered without more queries.
+	"""
+
+	def __init__(self, user, configurations):
+		from NEMO.models import Configuration, UsageEvent, get_tool_family
+		tool_ids = {config.tool_id for config in configurations}
+		family = get_tool_family()
+		# A tool can be in the family of several of the configured tools, so each family tool maps to all of them
+		family_tool_ids = {}
+		for tool_id in tool_ids:
+			for family_tool_id in family.get_family_tool_ids(tool_id):
+				family_tool_ids.setdefault(family_tool_id, set()).add(tool_id)
+		self.tools_in_use = {configured_tool_id for tool_id in UsageEvent.objects.filter(end=None, tool_id__in=family_tool_ids).values_list('tool_id', flat=True) for configured_tool_id in family_tool_ids[tool_id]}
+		self.user_is_staff = user.is_staff
+		self.maintained_configuration_ids = set()
+		self.qualified_tool_ids = set()
+		if not self.user_is_staff:
+			self.maintained_configuration_ids = set(Configuration.maintainers.through.objects.filter(user_id=user.id, configuration_id__in=[config.id for config in configurations]).values_list('configuration_id', flat=True))
+			if any(config.qualified_users_are_maintainers for config in configurations):
+				self.qualified_tool_ids = set(user.qualifications.filter(id__in=tool_ids).values_list('id', flat=True))
+
+	def user_is_maintainer(self, config):
+		""" Same as Configuration.user_is_maintainer, using the preloaded maintainers and qualifications. """
+		if self.user_is_staff or config.id in self.maintained_configuration_ids:
+			return True
+		return config.qualified_users_are_maintainers and config.tool_id in self.qualified_tool_ids
+
+	def can_change(self, config):
+		return config.tool_id not in self.tools_in_use and self.user_is_maintainer(config)
+
+
 class ConfigurationEditor(Widget):
 	def render(self, name, value, attrs=None, **kwargs):
 		result = ""
-		for config in value["configurations"]:
-			current_settings = config.current_settings_as_list()
-			render_as_form = value.get("render_as_form", None)
-			if render_as_form is None:
-				render_as_form = not config.tool.in_use() and config.user_is_maintainer(value["user"])
-			if len(current_settings) == 1:
-				result += self.__render_for_one(config, render_as_form)
-			else:
-				result += self.__render_for_multiple(config, render_as_form)
+		configurations = list(value["configurations"])
+		render_as_form = value.get("render_as_form", None)
+		context = value.get("context", None)
+		if render_as_form is None and context is None and configurations:
+			context = ConfigurationEditorContext(value["user"], configurations)
+		for config in configurations:
+			result += self.render_configuration(config, context.can_change(config) if render_as_form is None else render_as_form)
 		return mark_safe(result)
 
+	def render_configuration(self, config, render_as_form=None):
+		if len(config.current_settings_as_list()) == 1:
+			return self.__render_for_one(config, render_as_form)
+		else:
+			return self.__render_for_multiple(config, render_as_form)
+
 	def __render_for_one(self, config, render_as_form=None):
 		current_setting = config.current_settings_as_list()[0]
 		result = "<p><label class='form-inline'>" + escape(config.name) + ": "
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from json import dumps, loads
 
 from django.utils import timezone
@@ -10,8 +11,17 @@ from NEMO.utilities import quiet_int
 class DynamicForm:
 	def __init__(self, questions):
 		self.questions = loads(questions) if questions else None
+		self.question_names = [question['name'] for question in self.questions] if self.questions else []
+		self.consumable_questions = [question for question in self.questions if 'consumable' in question] if self.questions else []
+		self.html = None
 
 	def render(self):
+		# Built on the first render, so extracting the answers never depends on questions that can't be displayed
+		if self.html is None:
+			self.html = self.build_html()
+		return self.html
+
+	def build_html(self):
 		if not self.questions:
 			return ''
 
@@ -49,29 +59,45 @@ class DynamicForm:
 			return ''
 
 		results = {}
-		for question in self.questions:
+		for name in self.question_names:
 			# Only record the answer when the question was answered. Discard questions that were left blank
-			if request.POST.get(question['name']):
-				results[question['name']] = request.POST[question['name']]
+			if request.POST.get(name):
+				results[name] = request.POST[name]
 		return dumps(results, indent='\t', sort_keys=True) if len(results) else ''
 
+	def get_consumables(self):
+		""" Returns the consumables used in the questions by name. Names matching more than one consumable are ignored. """
+		consumables = {}
+		for consumable in Consumable.objects.filter(name__in=[question['consumable'] for question in self.consumable_questions]):
+			consumables[consumable.name] = None if consumable.name in consumables else consumable
+		return consumables
+
 	def charge_for_consumable(self, customer, merchant, project, run_data):
 		try:
 			run_data = loads(run_data)
 		except:
 			return
-		for question in self.questions:
-			if 'consumable' in question:
-				try:
-					consumable = Consumable.objects.get(name=question['consumable'])
-					quantity = 0
-					if question['type'] == 'textbox':
-						if question['name'] in run_data:
-							quantity = quiet_int(run_data[question['name']])
-					elif question['type'] == 'radio':
-						quantity = 1
+		if not self.consumable_questions:
+			return
+		consumables = self.get_consumables()
+		withdrawals = []
+		for question in self.consumable_questions:
+			consumable = consumables.get(question['consumable'])
+			if consumable is None:
+				continue
+			quantity = 0
+			if question.get('type') == 'textbox':
+				if question.get('name') in run_data:
+					quantity = quiet_int(run_data[question['name']])
+			elif question.get('type') == 'radio':
+				quantity = 1
+
+			if quantity > 0:
+				withdrawals.append(ConsumableWithdraw(customer=customer, merchant=merchant, consumable=consumable, quantity=quantity, project=project, date=timezone.now()))
+		ConsumableWithdraw.objects.bulk_create(withdrawals)
+
 
-					if quantity > 0:
-						ConsumableWithdraw.objects.create(customer=customer, merchant=merchant, consumable=consumable, quantity=quantity, project=project, date=timezone.now())
-				except:
-					pass
+@lru_cache(maxsize=256)
+def get_dynamic_form(questions) -> DynamicForm:
+	""" Returns the form for the post usage questions, parsed and rendered once for each version of the questions. """
+	return DynamicForm(questions)
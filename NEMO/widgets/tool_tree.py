@@ -1,9 +1,37 @@
-from typing import List
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
 
 from django.forms import Widget
 from django.utils.safestring import mark_safe
 
-from NEMO.models import User, Tool
+from NEMO.models import User, Tool, UsageEvent
+
+# The tree of the tools last rendered, along with the ids, categories and names of the tools it was built from
+tool_tree_cache: Optional[Tuple[Tuple, 'ToolTreeHelper']] = None
+tool_tree_lock = Lock()
+
+
+def get_tool_tree(tools: List[Tool]) -> 'ToolTreeHelper':
+	"""
+	Returns the category hierarchy of the tools. It is the same for every user, so it is only built again when a tool
+	was added, removed, renamed or moved to another category.
+	"""
+	global tool_tree_cache
+	key = tuple((tool.id, tool.category, tool.name) for tool in tools)
+	cached = tool_tree_cache
+	if cached is None or cached[0] != key:
+		tree = ToolTreeHelper(None)
+		for tool_id, category, name in key:
+			tree.add(category + '/' + name, tool_id)
+		cached = (key, tree)
+		with tool_tree_lock:
+			tool_tree_cache = cached
+	return cached[1]
+
+
+def get_in_use_names() -> Dict[int, str]:
+	""" Returns the name of the child tool in use for each parent tool, so the parent is listed under that name. """
+	return dict(UsageEvent.objects.filter(end=None, tool__parent_tool__isnull=False).values_list('tool__parent_tool_id', 'tool__name'))
 
 
 class ToolTree(Widget):
@@ -41,14 +69,17 @@ class ToolTree(Widget):
 			</li>
 		</ul>
 		"""
-		tree = ToolTreeHelper(None)
 		user: User = value['user'] if 'user' in value else None
-		tools: List[Tool] = value['tools']
-		parent_ids = Tool.objects.filter(parent_tool__isnull=False).values_list('parent_tool_id', flat=True)
-		for tool in tools:
-			is_qualified = (user and user.is_staff) or (user and tool in user.qualifications.all())
-			tree.add(tool.category + '/' + tool.name_or_child_in_use_name(parent_ids=parent_ids), tool.id,  is_qualified)
-		return mark_safe(tree.render())
+		tools: List[Tool] = list(value['tools'])
+		tree = get_tool_tree(tools)
+		if user and user.is_staff:
+			is_user_qualified = lambda tool_id: True
+		elif user:
+			qualifications = set(user.qualifications.values_list('id', flat=True))
+			is_user_qualified = qualifications.__contains__
+		else:
+			is_user_qualified = lambda tool_id: False
+		return mark_safe(tree.render(is_user_qualified, get_in_use_names()))
 
 
 class ToolTreeHelper:
@@ -58,64 +89,65 @@ class ToolTreeHelper:
 	"""
 	def __init__(self, name):
 		self.name = name
-		self.children = []
+		# Children by name, in the order they were added
+		self.children: Dict[str, ToolTreeHelper] = {}
 		self.id = None
-		self.is_user_qualified = False
 
-	def add(self, tool, identifier, is_user_qualified):
+	def add(self, tool, identifier):
 		"""
 		This function takes as input a string representation of the tool in the organization hierarchy.
 		Example input might be "Imaging and Analysis/Microscopes/Zeiss FIB". The input is parsed with '/' as the
 		separator and the tool is added to the class' tree structure.
 		"""
 		part = tool.partition('/')
-		for child in self.children:
-			if child.name == part[0]:
-				child.add(part[2], identifier, is_user_qualified)
-				return
-		self.children.append(ToolTreeHelper(part[0]))
+		child = self.children.get(part[0])
+		if child is None:
+			child = self.children[part[0]] = ToolTreeHelper(part[0])
+		elif part[2] == '' or child.__is_leaf():
+			# A tool with the same name as another tool or category is listed next to it
+			child = ToolTreeHelper(part[0])
+			self.children[f'{part[0]}/{identifier}'] = child
 		if part[2] != '':
-			self.children[-1].add(part[2], identifier, is_user_qualified)
+			child.add(part[2], identifier)
 		else:
-			self.children[-1].id = identifier
-			self.children[-1].is_user_qualified = is_user_qualified
+			child.id = identifier
 
-	def render(self):
+	def render(self, is_user_qualified: Callable[[int], bool], in_use_names: Dict[int, str]):
 		"""
 		This function cycles through the root node of the tool list and enumerates all the child nodes directly.
 		The function assumes that a tree structure of the tools has already been created by calling 'add(...)' multiple
-		times. A string of unordered HTML lists is returned.
+		times. The tools the user is not qualified for are disabled, and a parent tool is listed under the name of its child
+		tool in use. A string of unordered HTML lists is returned.
 		"""
-		result = '<ul class="nav nav-list" id="tool_tree" style="display:none">'
-		for child in self.children:
-			result += self.__render_helper(child, '')
-		result += '</ul>'
-		return result
+		result = ['<ul class="nav nav-list" id="tool_tree" style="display:none">']
+		for child in self.children.values():
+			self.__render_helper(child, result, is_user_qualified, in_use_names)
+		result.append('</ul>')
+		return ''.join(result)
 
-	def __render_helper(self, node, result):
+	def __render_helper(self, node, result: List[str], is_user_qualified, in_use_names):
 		"""
 		Recursively dive through the tree structure and convert it to unordered HTML lists.
 		Each node is output as an HTML list item. If the node has children then those are also output.
 		"""
-		result += '<li>'
+		result.append('<li>')
 		if node.__is_leaf():
-			css_class = "" if node.is_user_qualified else 'class="disabled"'
-			result += f'<a href="javascript:void(0);" onclick="set_selected_item(this)" data-tool-id="{node.id}" data-type="tool link" {css_class}>{node.name}</a>'
-		if not node.__is_leaf():
-			result += f'<label class="tree-toggler nav-header"><div>{node.name}</div></label><ul class="nav nav-list tree" data-category="{node.name}">'
-			for child in node.children:
-				result = self.__render_helper(child, result)
-			result += '</ul>'
-		result += '</li>'
-		return result
+			css_class = "" if is_user_qualified(node.id) else 'class="disabled"'
+			result.append(f'<a href="javascript:void(0);" onclick="set_selected_item(this)" data-tool-id="{node.id}" data-type="tool link" {css_class}>{in_use_names.get(node.id, node.name)}</a>')
+		else:
+			result.append(f'<label class="tree-toggler nav-header"><div>{node.name}</div></label><ul class="nav nav-list tree" data-category="{node.name}">')
+			for child in node.children.values():
+				self.__render_helper(child, result, is_user_qualified, in_use_names)
+			result.append('</ul>')
+		result.append('</li>')
 
 	def __is_leaf(self):
 		""" Test if this node is a leaf (i.e. an actual tool). If it is not then the node must be a tool category. """
-		return self.children == []
+		return not self.children
 
 	def __str__(self):
 		""" For debugging, output a string representation of the object in the form: <name [child1, child2, child3, ...]> """
 		result = str(self.name)
 		if not self.__is_leaf():
-			result += ' [' + ', '.join(str(child) for child in self.children) + ']'
+			result += ' [' + ', '.join(str(child) for child in self.children.values()) + ']'
 		return result
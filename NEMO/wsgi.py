@@ -1,3 +1,7 @@
 from django.core.wsgi import get_wsgi_application
 
 application = get_wsgi_application()
+
+# Start the door scheduler. The first process started locks again the doors left unlocked when the server stopped
+from NEMO.apps.area_access.door_scheduler import get_door_scheduler
+get_door_scheduler()